@@ -0,0 +1,305 @@
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from ai.comfyui_functions import KeepAliveClient, upload_image
+
+MODEL_LOADER_CLASSES = ('UNETLoader', 'LoraLoaderModelOnly', 'LoraLoader', 'CheckpointLoaderSimple')
+
+
+def workflow_models(prompt: dict) -> frozenset:
+    """提取工作流用到的UNET/LoRA/Checkpoint模型名，用于判断后端是否已加载这些模型"""
+    models = set()
+    for node in prompt.values():
+        if node.get('class_type') in MODEL_LOADER_CLASSES:
+            for key in ('unet_name', 'lora_name', 'ckpt_name'):
+                if isinstance(node['inputs'].get(key), str):
+                    models.add(node['inputs'][key])
+    return frozenset(models)
+
+
+class NoBackendAvailable(Exception):
+    """没有健康的ComfyUI后端可用"""
+
+
+class ComfyUIBackend:
+    """一台ComfyUI服务器及其最近一次探测到的状态"""
+
+    def __init__(self, url: str, upload_cache_size: int = 10000, on_request: Optional[Callable] = None,
+                 dedicated_models: Optional[frozenset] = None):
+        self.url = url.rstrip('/')
+        # 专用后端只接收这些模型的工作流（模型常驻显存，不与其他工作流换入换出）；None 为公共后端
+        self.dedicated_models = dedicated_models
+        # 复用的长连接（提交、上传、探测共用）；on_request(后端地址, method, path, status, seconds) 用于监控
+        self.client = KeepAliveClient(self.url, on_request=(
+            functools.partial(on_request, self.url) if on_request else None))
+        self.upload_cache_size = upload_cache_size
+        self._uploaded = OrderedDict()  # 已上传到该后端的图片：本地文件名 -> ComfyUI中的图片名
+        self._upload_lock = threading.Lock()
+        self._uploading = {}  # 正在上传的图片：本地文件名 -> 上传完成事件
+        self.healthy = True
+        self.queue_running = 0
+        self.queue_pending = 0
+        self.vram_free = None
+        self.inflight = 0  # 上次探测之后本进程新提交的任务数
+        self.resident_models = frozenset()  # 队列跑完后显存中应驻留的模型
+        self.failures = 0  # 连续失败次数
+        self.ejected_until = 0.0
+        self.last_poll = 0.0
+
+    def get_json(self, path: str, timeout: float = 5):
+        return self.client.request_json('GET', path, timeout=timeout)
+
+    def ensure_uploaded(self, image_path: str, subfolder: str = 'videogenius', timeout: Optional[float] = None) -> str:
+        """
+        确保图片已上传到该后端的input目录，返回LoadImage节点使用的图片名
+
+        本地文件名是内容哈希，同名即同内容，上传过的图片不再重复发送。
+        """
+        name = os.path.basename(image_path)
+        while True:
+            with self._upload_lock:
+                ref = self._uploaded.get(name)
+                if ref is not None:
+                    self._uploaded.move_to_end(name)
+                    return ref
+                pending = self._uploading.get(name)
+                if pending is None:
+                    # 同一图片并发提交时只上传一次，其他线程等待结果
+                    pending = self._uploading[name] = threading.Event()
+                    break
+            if not pending.wait(timeout):
+                raise TimeoutError(f'等待图片 {name} 上传到 {self.url} 超时')
+
+        try:
+            ref = upload_image(self.client, image_path, name, subfolder=subfolder, timeout=timeout)
+            with self._upload_lock:
+                self._uploaded[name] = ref
+                while len(self._uploaded) > self.upload_cache_size:
+                    self._uploaded.popitem(last=False)
+            return ref
+        finally:
+            with self._upload_lock:
+                self._uploading.pop(name, None)
+            pending.set()
+
+    def forget_upload(self, image_path: str):
+        """后端的input目录可能被清理过，下次重新上传"""
+        with self._upload_lock:
+            self._uploaded.pop(os.path.basename(image_path), None)
+
+    def load(self):
+        """排队深度：正在执行 + 等待中 + 尚未被探测到的新提交"""
+        return self.queue_running + self.queue_pending + self.inflight
+
+    def describe(self):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'queue_running': self.queue_running,
+            'queue_pending': self.queue_pending,
+            'inflight': self.inflight,
+            'vram_free': self.vram_free,
+            'failures': self.failures,
+            'resident_models': sorted(self.resident_models),
+            'dedicated': self.dedicated_models is not None,
+        }
+
+
+class BackendPool:
+    """
+    多台ComfyUI后端的负载均衡
+
+    按排队深度选择后端，模型已驻留的后端优先（省去UNET/LoRA换入换出的时间）；
+    连续失败的后端被剔除，冷却期后探测成功再重新加入。
+    专用后端只运行指定模型的工作流：这些工作流优先（有可用的专用后端时只）分到专用后端，
+    其他工作流只在没有可用的公共后端时才会分到专用后端。
+
+    Args:
+        urls: ComfyUI地址列表（如 http://192.168.2.158:8188）
+        poll_interval: 探测 /queue 和 /system_stats 的间隔秒数
+        fail_threshold: 连续失败多少次后剔除
+        eject_seconds: 剔除后的初始冷却秒数（再次失败时翻倍，最长10分钟）
+        swap_penalty: 需要换模型时额外计入的排队深度
+        on_request: on_request(后端地址, method, path, status, seconds) 每个ComfyUI请求结束后的回调
+        dedicated: 专用后端：地址 -> 该后端只运行的模型集合（地址可以不在 urls 中）
+    """
+
+    def __init__(self, urls: List[str], poll_interval: float = 2.0, fail_threshold: int = 3,
+                 eject_seconds: float = 10.0, swap_penalty: float = 2.0, on_request: Optional[Callable] = None,
+                 dedicated: Optional[Dict[str, frozenset]] = None):
+        dedicated = {url.rstrip('/'): models for url, models in (dedicated or {}).items()}
+        urls = [url for url in urls if url.rstrip('/') not in dedicated] + list(dedicated)
+        if not urls:
+            raise ValueError('至少需要一个ComfyUI后端')
+        self.backends = [ComfyUIBackend(url, on_request=on_request, dedicated_models=dedicated.get(url.rstrip('/')))
+                         for url in urls]
+        for backend in self.backends:
+            if backend.dedicated_models:
+                backend.resident_models = backend.dedicated_models
+        self.poll_interval = poll_interval
+        self.fail_threshold = fail_threshold
+        self.eject_seconds = eject_seconds
+        self.swap_penalty = swap_penalty
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """启动后台探测线程（每台后端一个，卡住的后端只推迟自己的探测，不影响其他后端的状态更新）"""
+        if self._threads:
+            return
+        self._stop.clear()
+        for backend in self.backends:
+            thread = threading.Thread(target=self._poll_loop, args=(backend,),
+                                      name=f'comfyui-backend-poller-{backend.url}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(self.poll_interval + 5)
+        self._threads = []
+
+    def acquire(self, models: frozenset = frozenset()) -> ComfyUIBackend:
+        """为一个任务选择后端并计入在途数；用完后必须调用 release"""
+        return self.acquire_many(models, 1)[0]
+
+    def acquire_many(self, models: frozenset, count: int) -> List[ComfyUIBackend]:
+        """
+        为同一工作流的 count 个任务逐个选择后端（每个任务都要 release）
+
+        每分配一个任务，所选后端的在途数加一、驻留模型更新为该工作流，
+        因此同一批任务会尽量集中在已加载模型的后端，排队明显更长时才分到其他后端。
+        """
+        with self._lock:
+            candidates = self._candidates(models)
+            if not candidates:
+                raise NoBackendAvailable('没有可用的ComfyUI后端')
+            chosen = []
+            for _ in range(count):
+                backend = min(candidates, key=lambda b: self._score(b, models))
+                backend.inflight += 1
+                if models:
+                    backend.resident_models = models
+                chosen.append(backend)
+            return chosen
+
+    def _candidates(self, models: frozenset) -> List[ComfyUIBackend]:
+        now = time.monotonic()
+        available = [b for b in self.backends if b.healthy and b.ejected_until <= now]
+        dedicated = [b for b in available if b.dedicated_models is not None and models
+                     and models <= b.dedicated_models]
+        if dedicated:
+            return dedicated
+        return [b for b in available if b.dedicated_models is None] or available
+
+    def has_dedicated(self, models: frozenset) -> bool:
+        """是否有可用的专用后端运行这些模型的工作流"""
+        with self._lock:
+            candidates = self._candidates(models)
+            return bool(models) and any(b.dedicated_models is not None and models <= b.dedicated_models
+                                        for b in candidates)
+
+    def count_available(self, dedicated: bool = False) -> int:
+        """可用的专用（或公共）后端数"""
+        now = time.monotonic()
+        return sum(1 for b in self.backends if b.healthy and b.ejected_until <= now
+                   and (b.dedicated_models is not None) == dedicated)
+
+    def release(self, backend: ComfyUIBackend, success: bool, submitted: bool = True):
+        """
+        归还后端
+
+        Args:
+            success: 本次请求是否成功（失败计入连续失败次数）
+            submitted: 任务是否已进入该后端队列（未进入时撤销在途计数）
+        """
+        with self._lock:
+            if not submitted:
+                backend.inflight = max(backend.inflight - 1, 0)
+            if success:
+                backend.failures = 0
+            else:
+                self._record_failure(backend)
+
+    def _score(self, backend: ComfyUIBackend, models: frozenset):
+        score = backend.load()
+        if models and not models <= backend.resident_models:
+            score += self.swap_penalty
+        return score
+
+    def _record_failure(self, backend: ComfyUIBackend):
+        backend.failures += 1
+        if backend.failures >= self.fail_threshold:
+            if backend.healthy:
+                print(f'ComfyUI后端 {backend.url} 连续失败{backend.failures}次，暂时剔除')
+            backend.healthy = False
+            cooldown = min(self.eject_seconds * 2 ** (backend.failures - self.fail_threshold), 600)
+            backend.ejected_until = time.monotonic() + cooldown
+
+    def poll(self, backend: ComfyUIBackend):
+        """探测一台后端的队列和显存，成功后（冷却期已过时）重新加入"""
+        try:
+            queue = backend.get_json('/queue')
+            stats = backend.get_json('/system_stats')
+        except Exception:
+            with self._lock:
+                self._record_failure(backend)
+            return False
+
+        # 队列中最后一个任务的模型就是队列跑完后驻留在显存中的模型
+        items = queue.get('queue_running', []) + queue.get('queue_pending', [])
+        last_models = None
+        if items:
+            last = max(items, key=lambda item: item[0])  # item: [number, prompt_id, prompt, ...]
+            if len(last) > 2 and isinstance(last[2], dict):
+                last_models = workflow_models(last[2])
+        devices = stats.get('devices') or []
+
+        with self._lock:
+            backend.queue_running = len(queue.get('queue_running', []))
+            backend.queue_pending = len(queue.get('queue_pending', []))
+            backend.inflight = 0
+            backend.vram_free = sum(d.get('vram_free', 0) for d in devices) if devices else None
+            if last_models:
+                backend.resident_models = last_models
+            backend.last_poll = time.monotonic()
+            if not backend.healthy and backend.ejected_until <= backend.last_poll:
+                print(f'ComfyUI后端 {backend.url} 恢复，重新加入')
+                backend.healthy = True
+                backend.failures = 0
+            elif backend.healthy:
+                backend.failures = 0
+        return True
+
+    def poll_all(self) -> int:
+        """并行探测全部后端（启动预热时建立长连接），返回探测成功的后端数"""
+        results = []
+        threads = [threading.Thread(target=lambda b=b: results.append(self.poll(b)), daemon=True)
+                   for b in self.backends]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(1 for ok in results if ok)
+
+    def _poll_loop(self, backend: ComfyUIBackend):
+        while not self._stop.is_set():
+            self.poll(backend)
+            self._stop.wait(self.poll_interval)
+
+    def describe(self):
+        with self._lock:
+            return [b.describe() for b in self.backends]
+
+
+def parse_backend_urls(value: Optional[str], default: str) -> List[str]:
+    """解析逗号分隔的ComfyUI地址列表"""
+    urls = [url.strip() for url in (value or '').split(',') if url.strip()]
+    return urls or [default]
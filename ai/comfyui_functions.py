@@ -1,129 +1,208 @@
+import http.client
 import json
-from urllib import request
-from typing import Tuple
-
-
-def load_prompt_template(template_path: str) -> dict:
-    """加载提示词模板"""
-    with open(template_path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-
-def submit_comfyui_task(
-        prompt_template: dict,
-        comfyui_url: str,
-        image_path: str,
-        positive_prompt: str,
-        negative_prompt: str,
-        width: int,
-        height: int,
-        length: int,
-        fps: int,
-        filename_prefix: str
-) -> Tuple[bool, str, str]:
-    """
-    提交任务到ComfyUI
-
-    Args:
-        prompt_template: 提示词模板字典
-        comfyui_url: ComfyUI的prompt接口URL
-        image_path: 输入图片路径
-        positive_prompt: 正面提示词
-        negative_prompt: 负面提示词
-        width: 视频宽度
-        height: 视频高度
-        length: 视频长度(帧)
-        fps: 帧率
-        filename_prefix: 输出文件名前缀
-
-    Returns:
-        (是否成功, prompt_id, 错误信息)
-    """
-    try:
-        # 复制模板以避免修改原始模板
-        prompt = json.loads(json.dumps(prompt_template))
-
-        # 设置输入图像
-        prompt["97"]["inputs"]["image"] = image_path
+import os
+import threading
+import time
+import uuid
+from urllib import parse, request
+from urllib.parse import urlsplit
+from typing import Callable, Iterator, Optional, Tuple
 
-        # 设置正面提示词
-        prompt["93"]["inputs"]["text"] = positive_prompt
 
-        # 设置负面提示词
-        prompt["89"]["inputs"]["text"] = negative_prompt
+class ComfyUIHTTPError(Exception):
+    """ComfyUI返回了非2xx状态码"""
 
-        # 设置视频参数
-        prompt["98"]["inputs"]["width"] = width
-        prompt["98"]["inputs"]["height"] = height
-        prompt["98"]["inputs"]["length"] = length
+    def __init__(self, status: int, body: bytes):
+        super().__init__(f"ComfyUI返回 {status}: {body[:500]!r}")
+        self.status = status
+        self.body = body
 
-        # 设置帧率
-        prompt["94"]["inputs"]["fps"] = fps
 
-        # 设置输出文件名
-        prompt["108"]["inputs"]["filename_prefix"] = filename_prefix
+class KeepAliveClient:
+    """
+    到一台ComfyUI服务器的HTTP/1.1长连接池
 
-        # 构建请求
-        payload = {"prompt": prompt}
-        data = json.dumps(payload).encode("utf-8")
+    空闲连接留在池中复用，省去每次请求的TCP握手；复用的连接已被服务端关闭时自动重连一次。
+    请求体是迭代器（流式上传）时无法重放，总是使用新连接发送，完成后连接照常放回池中。
 
-        req = request.Request(
-            comfyui_url,
-            data=data,
-            headers={"Content-Type": "application/json"}
-        )
+    Args:
+        base_url: 如 http://192.168.2.158:8188
+        max_idle: 最多保留的空闲连接数
+        on_request: on_request(method, path, status, seconds) 每个请求结束后的回调（用于监控），
+            网络错误时 status 为 None
+    """
 
-        # 发送请求
-        response = request.urlopen(req)
-        result = json.loads(response.read())
+    def __init__(self, base_url: str, max_idle: int = 4,
+                 on_request: Optional[Callable[[str, str, Optional[int], float], None]] = None):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.max_idle = max_idle
+        self._on_request = on_request
+        self._idle = []
+        self._lock = threading.Lock()
+        self.connects = 0
+
+    def _new_connection(self, timeout):
+        self.connects += 1
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=timeout)
+
+    def request(self, method: str, path: str, body=None, headers: Optional[dict] = None,
+                timeout: Optional[float] = None) -> Tuple[int, bytes]:
+        """发送请求，返回 (状态码, 响应体)；网络错误直接抛出"""
+        if self._on_request is None:
+            return self._request(method, path, body, headers, timeout)
+        started = time.perf_counter()
+        status = None
+        try:
+            status, data = self._request(method, path, body, headers, timeout)
+            return status, data
+        finally:
+            self._on_request(method, path, status, time.perf_counter() - started)
+
+    def _request(self, method, path, body, headers, timeout):
+        replayable = not isinstance(body, Iterator)
+        for attempt in range(2):
+            conn = None
+            if replayable:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+            reused = conn is not None
+            if conn is None:
+                conn = self._new_connection(timeout)
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # 复用的空闲连接可能已被服务端关闭，换新连接重发一次
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                with self._lock:
+                    if len(self._idle) < self.max_idle:
+                        self._idle.append(conn)
+                        conn = None
+                if conn is not None:
+                    conn.close()
+            return response.status, data
+
+    def request_json(self, method: str, path: str, body=None, headers: Optional[dict] = None,
+                     timeout: Optional[float] = None):
+        """发送请求并解析JSON响应；非2xx时抛 ComfyUIHTTPError"""
+        status, data = self.request(method, path, body=body, headers=headers, timeout=timeout)
+        if not 200 <= status < 300:
+            raise ComfyUIHTTPError(status, data)
+        return json.loads(data)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def submit_payload(client: KeepAliveClient, data: bytes, timeout: Optional[float] = None) -> str:
+    """通过长连接把已序列化的请求体POST到 /prompt，返回prompt_id"""
+    result = client.request_json("POST", "/prompt", body=data,
+                                 headers={"Content-Type": "application/json"}, timeout=timeout)
+    if "prompt_id" not in result:
+        raise ValueError(f"ComfyUI响应不包含prompt_id: {str(result)}")
+    return result["prompt_id"]
+
+
+def upload_image(client: KeepAliveClient, image_path: str, name: str, subfolder: str = "",
+                 timeout: Optional[float] = None) -> str:
+    """
+    把图片上传到ComfyUI的 /upload/image（存入其input目录），返回LoadImage节点可用的图片名
 
-        if "prompt_id" in result:
-            return True, result["prompt_id"], ""
-        else:
-            return False, "", f"ComfyUI响应不包含prompt_id: {str(result)}"
+    图片按块从磁盘读取后直接写入连接，不整体读入内存。
+    """
+    boundary = uuid.uuid4().hex
+    fields = [("overwrite", "true"), ("type", "input")]
+    if subfolder:
+        fields.append(("subfolder", subfolder))
+    preamble = b"".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode("utf-8")
+        for key, value in fields
+    )
+    preamble += (f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{name}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode("utf-8")
+    epilogue = f"\r\n--{boundary}--\r\n".encode("utf-8")
+    length = len(preamble) + os.path.getsize(image_path) + len(epilogue)
+
+    def body():
+        yield preamble
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(256 * 1024), b""):
+                yield chunk
+        yield epilogue
+
+    result = client.request_json("POST", "/upload/image", body=body(), headers={
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(length)
+    }, timeout=timeout)
+    return f"{result['subfolder']}/{result['name']}" if result.get("subfolder") else result["name"]
+
+
+def download_output(comfyui_url: str, output_path: str, dest_path: str,
+                    timeout: Optional[float] = None) -> int:
+    """
+    通过 /view 下载ComfyUI输出目录中的文件（subfolder/filename），返回写入的字节数
 
-    except Exception as e:
-        return False, "", f"提交任务失败: {str(e)}"
+    视频可能有几十MB，边下载边写入文件，不整体读入内存。
+    """
+    subfolder, _, filename = output_path.rpartition("/")
+    query = parse.urlencode({"filename": filename, "subfolder": subfolder, "type": "output"})
+    written = 0
+    with request.urlopen(f"{comfyui_url.rstrip('/')}/view?{query}", timeout=timeout) as response, \
+            open(dest_path, "wb") as f:
+        for chunk in iter(lambda: response.read(1024 * 1024), b""):
+            f.write(chunk)
+            written += len(chunk)
+    return written
 
 
 if __name__ == "__main__":
-    """测试ComfyUI任务提交功能"""
-    import time
+    """测试ComfyUI任务提交功能（工作流由模板注册表生成）"""
+    from ai.templates import create_default_registry
 
     # 测试配置
-    TEMPLATE_PATH = "video_wan2_2_14B_i2v.json"
-    COMFYUI_URL = "http://192.168.2.158:8188/prompt"  # 可替换为实际的ComfyUI地址
+    TEMPLATE_NAME = "wan2_2_14B_i2v"
+    COMFYUI_URL = "http://192.168.2.158:8188"  # 可替换为实际的ComfyUI地址
     TEST_IMAGE_PATH = "/home/ccl/Pictures/Screenshot_2024-12-06_16-54-16.png"
-    TEST_POSITIVE_PROMPT = "测试视频生成"
-    TEST_NEGATIVE_PROMPT = "'色调艳丽，过曝，静态，细节模糊不清'"
-    TEST_WIDTH = 640
-    TEST_HEIGHT = 640
-    TEST_LENGTH = 81
-    TEST_FPS = 16
-    TEST_FILENAME_PREFIX = f"video/test_{int(time.time())}"
-
+    TEST_PARAMS = {
+        "positive_prompt": "测试视频生成",
+        "negative_prompt": "'色调艳丽，过曝，静态，细节模糊不清'",
+        "width": 640,
+        "height": 640,
+        "length": 81,
+        "fps": 16,
+        "filename_prefix": f"video/test_{int(time.time())}",
+    }
+
+    client = KeepAliveClient(COMFYUI_URL)
     try:
-        print("加载提示词模板...")
-        template = load_prompt_template(TEMPLATE_PATH)
+        print("上传测试图片...")
+        image = upload_image(client, TEST_IMAGE_PATH, os.path.basename(TEST_IMAGE_PATH))
 
         print("提交测试任务到ComfyUI...")
-        success, prompt_id, error = submit_comfyui_task(
-            prompt_template=template,
-            comfyui_url=COMFYUI_URL,
-            image_path=TEST_IMAGE_PATH,
-            positive_prompt=TEST_POSITIVE_PROMPT,
-            negative_prompt=TEST_NEGATIVE_PROMPT,
-            width=TEST_WIDTH,
-            height=TEST_HEIGHT,
-            length=TEST_LENGTH,
-            fps=TEST_FPS,
-            filename_prefix=TEST_FILENAME_PREFIX
-        )
-
-        if success:
-            print(f"任务提交成功！prompt_id: {prompt_id}")
-        else:
-            print(f"任务提交失败: {error}")
-
+        template = create_default_registry().get(TEMPLATE_NAME)
+        prompt_id = submit_payload(client, template.build_payload(dict(TEST_PARAMS, image=image)))
+        print(f"任务提交成功！prompt_id: {prompt_id}")
     except Exception as e:
         print(f"测试过程出错: {str(e)}")
+    finally:
+        client.close()
@@ -0,0 +1,293 @@
+import heapq
+import itertools
+import queue
+import random
+import threading
+import time
+
+
+class QueueFullError(Exception):
+    """提交队列已满（调用方应返回HTTP 429）"""
+
+
+class PermanentSubmitError(Exception):
+    """不可重试的提交错误（如ComfyUI拒绝了工作流）"""
+
+
+class SubmissionJob:
+    """一条待提交到ComfyUI的任务"""
+
+    def __init__(self, prompt_id, user_id, params, lane=None):
+        self.prompt_id = prompt_id  # 预先生成的prompt_id，同时作为对外的任务ID
+        self.user_id = user_id
+        self.params = params  # 提交所需的全部参数（图片路径、提示词、宽高等）
+        self.lane = lane  # 优先级档位（由调度队列决定权重）
+        self.attempts = 0
+        self.backend = None  # 提交成功的后端地址
+        self.enqueued_at = time.monotonic()
+        self.not_before = 0.0  # 重试退避：在此时刻（monotonic）之前不再提交
+
+
+class SubmissionDispatcher:
+    """
+    后台提交调度器：接口只负责入队，由固定数量的工作线程提交到ComfyUI
+
+    Args:
+        submit: submit(job) -> prompt_id，失败时抛异常；抛 PermanentSubmitError 表示不必重试
+        workers: 工作线程数（即同时向ComfyUI发起提交的最大并发数）
+        max_queue: 队列容量，满了以后 enqueue 抛 QueueFullError
+        max_retries: 失败后最多重试次数
+        backoff: 重试退避基数（秒），第n次重试等待 backoff * 2**(n-1)，带随机抖动；
+            等待重试的任务不占用工作线程，到期后由取任务的循环优先取出
+        on_submitted: on_submitted(job, prompt_id) 提交成功回调
+        on_failed: on_failed(job, error) 最终失败回调（用于退还积分、标记任务失败）
+        submit_batch: submit_batch(jobs) -> [prompt_id 或 异常, ...]，批量提交同一分组的任务；为空时逐个提交
+        batch_window: 取到任务后再等待多少秒收集同时到达的任务（0 为不合并）
+        max_batch: 每批最多任务数
+        batch_key: batch_key(job) -> 分组键，同一批中键相同的任务一起交给 submit_batch
+        job_queue: 自定义排队顺序的队列（接口同 queue.Queue，如 FairScheduler），为空时先进先出
+    """
+
+    def __init__(self, submit, workers=4, max_queue=100, max_retries=3, backoff=1.0,
+                 on_submitted=None, on_failed=None, submit_batch=None, batch_window=0.0, max_batch=8,
+                 batch_key=None, job_queue=None):
+        self._submit = submit
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._on_submitted = on_submitted
+        self._on_failed = on_failed
+        self._submit_batch = submit_batch
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._batch_key = batch_key or (lambda job: None)
+
+        self._queue = job_queue if job_queue is not None else queue.Queue(maxsize=max_queue)
+        self._delayed = []  # 等待重试的任务（堆）：(not_before, 序号, job)，不占用队列容量
+        self._delayed_seq = itertools.count()
+        self._delayed_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+        self._collect_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {'enqueued': 0, 'rejected': 0, 'submitted': 0, 'retried': 0, 'failed': 0,
+                       'batches': 0, 'batched_jobs': 0}
+
+    def start(self):
+        """启动工作线程（重复调用无副作用）"""
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'comfyui-dispatcher-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        """停止工作线程（队列中未提交的任务保留在数据库中，重启后可恢复）"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def full(self):
+        return self._queue.full()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def enqueue(self, job):
+        """任务入队，不阻塞；队列已满时抛 QueueFullError"""
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full as e:
+            self._count('rejected')
+            raise QueueFullError(str(e) or '提交队列已满')
+        self._count('enqueued')
+
+    def enqueue_many(self, jobs):
+        """
+        一组任务一起入队（批量生成接口）：全部入队或全部不入队，队列容量不足时抛 QueueFullError
+
+        同时到达队列，工作线程在同一个收集窗口内取到，按模板分组后经同一条长连接提交。
+        """
+        put_many = getattr(self._queue, 'put_many_nowait', None)
+        try:
+            if put_many is not None:
+                put_many(jobs)
+            else:
+                maxsize = getattr(self._queue, 'maxsize', 0)
+                if maxsize and self._queue.qsize() + len(jobs) > maxsize:
+                    raise queue.Full('提交队列已满')
+                for job in jobs:
+                    self._queue.put_nowait(job)
+        except queue.Full as e:
+            self._count('rejected', len(jobs))
+            raise QueueFullError(str(e) or '提交队列已满')
+        self._count('enqueued', len(jobs))
+
+    def restore(self, jobs):
+        """
+        重新放入重启前已被接受的任务（已扣积分），不受排队上限限制；队列不支持时按普通入队处理
+
+        Raises:
+            QueueFullError: 队列不支持 restore 且已满
+        """
+        restore = getattr(self._queue, 'restore', None)
+        if restore is not None:
+            restore(jobs)
+        else:
+            for job in jobs:
+                try:
+                    self._queue.put_nowait(job)
+                except queue.Full as e:
+                    raise QueueFullError(str(e) or '提交队列已满')
+        self._count('enqueued', len(jobs))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize()
+        with self._delayed_lock:
+            stats['retry_pending'] = len(self._delayed)
+        stats['workers'] = len(self._threads)
+        return stats
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _run(self):
+        batching = self.batch_window > 0 and self._submit_batch is not None
+        while not self._stop.is_set():
+            if batching:
+                # 同一时刻只有一个线程在收集，突发流量时一批任务不会被其他空闲线程拆散
+                with self._collect_lock:
+                    jobs, taken = self._collect()
+            else:
+                job, taken = self._get(0.5)
+                jobs = [job] if job is not None else []
+            if not jobs:
+                continue
+            try:
+                for group in self._group(jobs):
+                    if len(group) == 1:
+                        self._process(group[0])
+                    else:
+                        self._process_batch(group)
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+
+    def _collect(self):
+        """
+        取到第一个任务后，在 batch_window 内继续收集同时到达的任务（空闲时只多等一个窗口）
+
+        Returns:
+            (任务列表, 其中从队列取出的任务数)
+        """
+        job, taken = self._get(0.5)
+        if job is None:
+            return [], 0
+        jobs = [job]
+        deadline = time.monotonic() + self.batch_window
+        while len(jobs) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            job, from_queue = self._get(remaining)
+            if job is None:
+                break
+            jobs.append(job)
+            taken += from_queue
+        return jobs, taken
+
+    def _get(self, timeout):
+        """
+        取下一个任务：退避时间已到的重试任务优先，否则从队列中取，最多等待 timeout 秒
+
+        Returns:
+            (任务, 是否从队列取出)；超时返回 (None, 0)
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._delayed_lock:
+                now = time.monotonic()
+                if self._delayed and self._delayed[0][0] <= now:
+                    return heapq.heappop(self._delayed)[2], 0
+                next_due = self._delayed[0][0] if self._delayed else deadline
+            wait = min(deadline, next_due) - now
+            if wait <= 0:
+                return None, 0
+            try:
+                return self._queue.get(timeout=wait), 1
+            except queue.Empty:
+                continue
+
+    def _group(self, jobs):
+        """按分组键分组，保持先到先提交"""
+        groups = {}
+        for job in jobs:
+            groups.setdefault(self._batch_key(job), []).append(job)
+        return list(groups.values())
+
+    def _process_batch(self, jobs):
+        """批量提交一组任务，失败的任务再按单个任务的重试规则处理"""
+        self._count('batches')
+        self._count('batched_jobs', len(jobs))
+        for job in jobs:
+            job.attempts += 1
+        try:
+            results = self._submit_batch(jobs)
+        except Exception as e:
+            results = [e] * len(jobs)
+        for job, result in zip(jobs, results):
+            if isinstance(result, Exception):
+                self._retry_later(job, result)
+            else:
+                self._succeed(job, result)
+
+    def _process(self, job):
+        """提交单个任务一次，失败时按重试规则处理"""
+        job.attempts += 1
+        try:
+            prompt_id = self._submit(job)
+        except Exception as e:
+            self._retry_later(job, e)
+        else:
+            self._succeed(job, prompt_id)
+
+    def _retry_later(self, job, error):
+        """处理一次提交失败：需要重试时设置退避到期时间，放入等待重试的任务中（工作线程不等待）"""
+        if isinstance(error, PermanentSubmitError):
+            self._fail(job, str(error))
+            return
+        if self._stop.is_set():
+            return  # 正在停止：任务保持queued，重启后恢复提交
+        if job.attempts > self.max_retries:
+            self._fail(job, str(error))
+            return
+        self._count('retried')
+        delay = self.backoff * 2 ** (job.attempts - 1)
+        print(f'ComfyUI任务 {job.prompt_id} 第{job.attempts}次提交失败，{delay:.1f}秒后重试: {error}')
+        job.not_before = time.monotonic() + delay * random.uniform(0.8, 1.2)
+        with self._delayed_lock:
+            heapq.heappush(self._delayed, (job.not_before, next(self._delayed_seq), job))
+
+    def _succeed(self, job, prompt_id):
+        self._count('submitted')
+        if self._on_submitted:
+            try:
+                self._on_submitted(job, prompt_id)
+            except Exception as e:
+                print(f'ComfyUI任务 {job.prompt_id} 提交成功回调出错: {e}')
+
+    def _fail(self, job, error):
+        self._count('failed')
+        print(f'ComfyUI任务 {job.prompt_id} 提交失败: {error}')
+        if self._on_failed:
+            try:
+                self._on_failed(job, error)
+            except Exception as e:
+                print(f'ComfyUI任务 {job.prompt_id} 失败回调出错: {e}')
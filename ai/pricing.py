@@ -0,0 +1,165 @@
+import math
+import os
+import threading
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# 计费配置
+PRICING_SECONDS_PER_POINT = float(os.environ.get('PRICING_SECONDS_PER_POINT') or 6)  # 每积分对应的GPU秒数
+PRICING_MIN_POINTS = int(os.environ.get('PRICING_MIN_POINTS') or 10)  # 单个任务最少扣的积分
+PRICING_MAX_PIXELS = int(os.environ.get('PRICING_MAX_PIXELS') or 1280 * 1280)  # 单帧最大像素数（宽×高）
+PRICING_MAX_LENGTH = int(os.environ.get('PRICING_MAX_LENGTH') or 241)  # 最大帧数
+PRICING_MAX_GPU_SECONDS = float(os.environ.get('PRICING_MAX_GPU_SECONDS') or 1800)  # 单个任务预计GPU耗时上限
+PRICING_CALIBRATE_INTERVAL = float(os.environ.get('PRICING_CALIBRATE_INTERVAL') or 3600)  # 按实测耗时重新校准的间隔秒数
+PRICING_MIN_SAMPLES = 20  # 某个模板至少有多少个已完成任务才用实测数据校准
+
+# 各模板的默认耗时模型：(固定耗时秒数, 每百万像素帧的秒数)
+# 14B 模型 640×640×81 帧约5分钟；5B 模型约为其三分之一
+DEFAULT_COST_MODELS = {
+    'wan2_2_14B_i2v': (60.0, 7.2),
+    'wan2_2_5B_ti2v': (20.0, 2.4),
+    'wan2_2_5B_t2v': (20.0, 2.4),
+}
+FALLBACK_COST_MODEL = DEFAULT_COST_MODELS['wan2_2_14B_i2v']  # 未配置的模板按最贵的模型估算
+
+
+class PricingError(ValueError):
+    """请求的参数超出允许范围（接口返回400）"""
+
+
+def pixel_frames(width: int, height: int, length: int) -> float:
+    """计算量：宽×高×帧数，单位为百万像素帧"""
+    return width * height * length / 1e6
+
+
+def frames_for_duration(seconds: int, fps: int) -> int:
+    """
+    把时长（秒）换算为Wan模型的帧数：4k+1 帧，超过 PRICING_MAX_LENGTH 时截断到允许的最大帧数
+
+    Raises:
+        PricingError: 时长或帧率不是正数
+    """
+    if seconds <= 0 or fps <= 0:
+        raise PricingError('时长和帧率必须为正数')
+    frames = min(seconds * fps, PRICING_MAX_LENGTH - 1)
+    return max(4, frames // 4 * 4) + 1
+
+
+def fit_cost_model(samples: Iterable[Tuple[float, float]]) -> Optional[Tuple[float, float]]:
+    """
+    用最小二乘拟合 耗时 = 固定耗时 + 系数 × 百万像素帧
+
+    Args:
+        samples: [(百万像素帧, 实测秒数)]
+
+    Returns:
+        (固定耗时, 系数)，样本不足或拟合结果不合理时返回 None
+    """
+    samples = [(x, y) for x, y in samples if x > 0 and y > 0]
+    if len(samples) < PRICING_MIN_SAMPLES:
+        return None
+    n = len(samples)
+    mean_x = sum(x for x, _ in samples) / n
+    mean_y = sum(y for _, y in samples) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+    if var_x > 0:
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x
+        base = mean_y - slope * mean_x
+        if slope > 0 and base >= 0:
+            return base, slope
+    # 分辨率/帧数都一样，或固定耗时拟合为负数：按过原点的比例估算
+    slope = sum(y for _, y in samples) / sum(x for x, _ in samples)
+    return 0.0, slope
+
+
+class PricingEngine:
+    """
+    按预计GPU耗时计费
+
+    预计耗时 = 模板的固定耗时 + 系数 × 宽×高×帧数，扣除积分 = 预计耗时 / 每积分秒数（向上取整，不低于最低积分）。
+    系数初始为 DEFAULT_COST_MODELS，之后定期用已完成任务的实测执行时间（started_at 到 completed_at）重新拟合。
+
+    Args:
+        load_samples: load_samples() -> [(模板, 宽, 高, 帧数, 实测秒数)]，为空时不校准
+        interval: 重新校准的间隔秒数
+    """
+
+    def __init__(self, load_samples: Optional[Callable[[], list]] = None,
+                 models: Optional[Dict[str, Tuple[float, float]]] = None,
+                 interval: float = PRICING_CALIBRATE_INTERVAL):
+        self._load_samples = load_samples
+        self.models = dict(models or DEFAULT_COST_MODELS)
+        self.interval = interval
+        self.calibrated = {}  # 模板名 -> 用于校准的样本数
+        self._stop = threading.Event()
+        self._thread = None
+
+    def estimate_seconds(self, template: str, width: int, height: int, length: int) -> float:
+        base, per_unit = self.models.get(template, FALLBACK_COST_MODEL)
+        return base + per_unit * pixel_frames(width, height, length)
+
+    def quote(self, template: str, width: int, height: int, length: int) -> dict:
+        """
+        计算一个任务的预计耗时和积分，参数超出限制时抛 PricingError
+
+        Returns:
+            {'gpu_seconds': 预计GPU秒数, 'points': 需要的积分}
+        """
+        if width <= 0 or height <= 0 or length <= 0:
+            raise PricingError('宽度、高度和长度必须为正数')
+        if width * height > PRICING_MAX_PIXELS:
+            raise PricingError(f'分辨率过大，宽×高不能超过{PRICING_MAX_PIXELS}像素')
+        if length > PRICING_MAX_LENGTH:
+            raise PricingError(f'视频过长，长度不能超过{PRICING_MAX_LENGTH}帧')
+        gpu_seconds = self.estimate_seconds(template, width, height, length)
+        if gpu_seconds > PRICING_MAX_GPU_SECONDS:
+            raise PricingError('视频计算量过大，请降低分辨率或长度')
+        points = max(PRICING_MIN_POINTS, math.ceil(gpu_seconds / PRICING_SECONDS_PER_POINT))
+        return {'gpu_seconds': int(round(gpu_seconds)), 'points': points}
+
+    def calibrate(self, samples: Iterable[Tuple[str, int, int, int, float]]) -> Dict[str, Tuple[float, float]]:
+        """按模板分组拟合实测耗时，样本足够的模板更新耗时模型；返回更新后的模型"""
+        grouped = {}
+        for template, width, height, length, seconds in samples:
+            if template and width and height and length and seconds:
+                grouped.setdefault(template, []).append((pixel_frames(width, height, length), float(seconds)))
+        models = dict(self.models)
+        calibrated = dict(self.calibrated)
+        for template, points in grouped.items():
+            fitted = fit_cost_model(points)
+            if fitted is not None:
+                models[template] = fitted
+                calibrated[template] = len(points)
+        self.models = models  # 整体替换，报价线程读到的总是完整的模型
+        self.calibrated = calibrated
+        return models
+
+    # ---- 后台校准 ----
+
+    def start(self):
+        if self._thread is not None or self._load_samples is None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='pricing-calibrator', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.calibrate(self._load_samples())
+            except Exception as e:
+                print(f'计费模型校准失败: {e}')
+            if self._stop.wait(self.interval):
+                return
+
+    def stats(self) -> dict:
+        return {
+            'models': {name: {'base_seconds': round(base, 1), 'seconds_per_mpf': round(per_unit, 3)}
+                       for name, (base, per_unit) in self.models.items()},
+            'calibrated': dict(self.calibrated),
+        }
@@ -0,0 +1,280 @@
+import math
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def parse_tiers(value: Optional[str]) -> List[Tuple[str, int, float]]:
+    """
+    解析优先级档位配置 "business:5000:4,pro:1000:2"（名称:最低积分:权重），按最低积分从高到低排列
+
+    积分低于所有档位的用户属于 free 档（权重1）。
+    """
+    tiers = []
+    for item in (value or '').split(','):
+        parts = [part.strip() for part in item.split(':')]
+        if len(parts) == 3 and all(parts):
+            tiers.append((parts[0], int(parts[1]), float(parts[2])))
+    return sorted(tiers, key=lambda tier: tier[1], reverse=True)
+
+
+class _UserQueue:
+    def __init__(self):
+        self.jobs = deque()
+        self.last_finish = 0.0  # 该用户最后一个排队任务的虚拟完成时间
+        self.inflight = 0
+
+
+class FairScheduler:
+    """
+    提交到ComfyUI之前的公平调度队列（可替代 SubmissionDispatcher 的 queue.Queue）
+
+    - 加权公平排队：按用户分别排队，每个任务的虚拟完成时间 = max(当前虚拟时间, 该用户上一个任务的完成时间) + 1/权重，
+      每次取虚拟完成时间最小的任务。大量提交的用户只会排在自己的任务后面，不会挤占其他用户。
+    - 优先级档位：按用户积分所在档位决定权重（高档位按权重比例获得更多GPU时间，低档位不会被饿死）。
+    - 并发上限：ComfyUI上未完成的任务总数不超过 capacity()，单个用户不超过 user_concurrency；
+      任务留在这里排队而不是进入ComfyUI自己的先进先出队列，公平顺序才能生效。
+      任务结束（或提交最终失败）后必须调用 release。
+    - 独立名额：pool_of(job) 返回 pools 中的名称时，该任务占用这个池的名额（如专用于文生视频的后端），
+      不与其他任务争抢；池满时同一用户后面属于其他池的任务可以先出队，短任务不会排在长任务后面。
+
+    Args:
+        capacity: capacity() -> 允许同时在ComfyUI上排队/执行的任务数（随可用后端数变化）
+        max_queue: 排队任务总数上限
+        user_concurrency: 每个用户同时在ComfyUI上的任务数上限
+        user_max_queued: 每个用户排队任务数上限
+        tiers: parse_tiers 的结果
+        default_job_seconds: 还没有完成过任务时，估算等待时间使用的单个任务耗时
+        parallelism: parallelism() -> 同时执行任务的GPU数，用于估算等待时间
+        pools: 独立名额池：名称 -> capacity()，不在其中的任务使用 capacity
+        pool_of: pool_of(job) -> 任务所属的池名称或 None（出队时计算）
+    """
+
+    def __init__(self, capacity: Callable[[], int], max_queue: int = 100, user_concurrency: int = 2,
+                 user_max_queued: int = 10, tiers: Optional[List[Tuple[str, int, float]]] = None,
+                 default_job_seconds: float = 300.0, parallelism: Optional[Callable[[], int]] = None,
+                 pools: Optional[Dict[str, Callable[[], int]]] = None,
+                 pool_of: Optional[Callable[[object], Optional[str]]] = None):
+        self._capacity = capacity
+        self._pools = pools or {}
+        self._pool_of = pool_of or (lambda job: None)
+        self.max_queue = max_queue
+        self.user_concurrency = user_concurrency
+        self.user_max_queued = user_max_queued
+        self.tiers = tiers or []
+        self._parallelism = parallelism or (lambda: 1)
+
+        self._cond = threading.Condition()
+        self._users: Dict[int, _UserQueue] = {}
+        self._queued = 0
+        self._vtime = 0.0  # 虚拟时间：最近一个出队任务的虚拟完成时间
+        self._seq = 0
+        self._inflight = {}  # prompt_id -> [user_id, 出队时间, 开始执行时间, 池名称]
+        self._pool_inflight = {}  # 池名称（None 为公共名额） -> 在ComfyUI上的任务数
+        self.job_seconds = default_job_seconds  # 单个任务执行耗时（指数移动平均）
+        self._stats = {'dispatched': 0, 'completed': 0, 'rejected_user': 0}
+
+    # ---- 档位 ----
+
+    def lane_for(self, points: int) -> str:
+        for name, min_points, _ in self.tiers:
+            if points >= min_points:
+                return name
+        return 'free'
+
+    def weight_for(self, lane: Optional[str]) -> float:
+        for name, _, weight in self.tiers:
+            if name == lane:
+                return weight
+        return 1.0
+
+    # ---- queue.Queue 兼容接口（供 SubmissionDispatcher 使用） ----
+
+    def put_nowait(self, job):
+        self.put_many_nowait([job])
+
+    def put_many_nowait(self, jobs):
+        """一组任务全部入队，或者（超出总数/用户上限时）全部不入队"""
+        with self._cond:
+            if self._queued + len(jobs) > self.max_queue:
+                raise queue.Full('提交队列已满')
+            added = {}
+            for job in jobs:
+                added[job.user_id] = added.get(job.user_id, 0) + 1
+            for user_id, count in added.items():
+                user = self._users.get(user_id)
+                if (len(user.jobs) if user else 0) + count > self.user_max_queued:
+                    self._stats['rejected_user'] += 1
+                    raise queue.Full('该用户排队任务过多')
+            self._append(jobs)
+
+    def restore(self, jobs):
+        """
+        重新放入已被接受过的任务（重启后恢复的排队任务），不受排队总数和用户排队上限限制
+
+        这些任务入队时已通过上限检查并扣除了积分；并发上限照常在出队时生效。
+        """
+        with self._cond:
+            self._append(jobs)
+
+    def _append(self, jobs):
+        """在 self._cond 内调用"""
+        for job in jobs:
+            user = self._users.get(job.user_id)
+            if user is None:
+                user = self._users[job.user_id] = _UserQueue()
+            start = max(self._vtime, user.last_finish)
+            job.finish_tag = start + 1.0 / self.weight_for(getattr(job, 'lane', None))
+            job.sort_key = (job.finish_tag, self._seq)  # 虚拟完成时间相同时先到先出
+            self._seq += 1
+            user.last_finish = job.finish_tag
+            user.jobs.append(job)
+            self._queued += 1
+        self._cond.notify_all()
+
+    def get(self, timeout: Optional[float] = None):
+        """取出下一个可以提交的任务；没有任务、或ComfyUI上的任务已达上限时等待"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                job = self._pick()
+                if job is not None:
+                    return job
+                remaining = 0.5 if deadline is None else deadline - time.monotonic()
+                if remaining <= 0:
+                    raise queue.Empty
+                # 可用后端数变化时没有通知，最多等0.5秒重新检查一次
+                self._cond.wait(min(remaining, 0.5))
+
+    def task_done(self):
+        pass
+
+    def qsize(self) -> int:
+        with self._cond:
+            return self._queued
+
+    def full(self) -> bool:
+        with self._cond:
+            return self._queued >= self.max_queue
+
+    def _room(self, pool: Optional[str]) -> bool:
+        capacity = self._pools[pool] if pool in self._pools else self._capacity
+        return self._pool_inflight.get(pool, 0) < capacity()
+
+    def _pick(self):
+        rooms = {}  # 本次挑选中各池是否还有名额
+        best = best_user = best_pool = None
+        for user in self._users.values():
+            if not user.jobs or user.inflight >= self.user_concurrency:
+                continue
+            # 每个用户取排在最前、所属池还有名额的任务（同一用户的任务虚拟完成时间递增）
+            for job in user.jobs:
+                pool = self._pool_of(job)
+                if pool not in self._pools:
+                    pool = None
+                if pool not in rooms:
+                    rooms[pool] = self._room(pool)
+                if rooms[pool]:
+                    if best is None or job.sort_key < best.sort_key:
+                        best, best_user, best_pool = job, user, pool
+                    break
+        if best is None:
+            return None
+        best_user.jobs.remove(best)
+        best_user.inflight += 1
+        self._queued -= 1
+        self._vtime = max(self._vtime, best.finish_tag)
+        self._inflight[best.prompt_id] = [best.user_id, time.monotonic(), None, best_pool]
+        self._pool_inflight[best_pool] = self._pool_inflight.get(best_pool, 0) + 1
+        self._stats['dispatched'] += 1
+        return best
+
+    # ---- 任务生命周期 ----
+
+    def user_full(self, user_id: int) -> bool:
+        """该用户的排队任务是否已达上限"""
+        return self.room(user_id) <= 0
+
+    def room(self, user_id: int) -> int:
+        """该用户还能再排队的任务数（同时受排队总数上限限制）"""
+        with self._cond:
+            user = self._users.get(user_id)
+            queued = len(user.jobs) if user else 0
+            return max(min(self.user_max_queued - queued, self.max_queue - self._queued), 0)
+
+    def mark_inflight(self, prompt_id: str, user_id: int, pool: Optional[str] = None):
+        """记录一个已在ComfyUI上的任务（重启后恢复跟踪的任务）"""
+        with self._cond:
+            if prompt_id in self._inflight:
+                return
+            if pool not in self._pools:
+                pool = None
+            self._users.setdefault(user_id, _UserQueue()).inflight += 1
+            self._inflight[prompt_id] = [user_id, time.monotonic(), None, pool]
+            self._pool_inflight[pool] = self._pool_inflight.get(pool, 0) + 1
+
+    def started(self, prompt_id: str):
+        """任务开始在GPU上执行"""
+        with self._cond:
+            entry = self._inflight.get(prompt_id)
+            if entry is not None and entry[2] is None:
+                entry[2] = time.monotonic()
+
+    def release(self, prompt_id: str, completed: bool = False):
+        """任务结束或提交最终失败：释放并发名额；正常完成时更新单个任务耗时的估计"""
+        with self._cond:
+            entry = self._inflight.pop(prompt_id, None)
+            if entry is None:
+                return
+            user_id, _, started_at, pool = entry
+            self._pool_inflight[pool] -= 1
+            user = self._users.get(user_id)
+            if user is not None:
+                user.inflight -= 1
+                if not user.inflight and not user.jobs and user.last_finish <= self._vtime:
+                    del self._users[user_id]  # 空闲用户不保留状态（其虚拟完成时间已落后，不影响公平性）
+            if completed:
+                self._stats['completed'] += 1
+                if started_at is not None:
+                    self.job_seconds = 0.8 * self.job_seconds + 0.2 * (time.monotonic() - started_at)
+            self._cond.notify_all()
+
+    def position(self, prompt_id: str) -> Optional[dict]:
+        """
+        排队位置估计：前面还有多少个任务、预计多少秒后开始执行
+
+        只是估计：之后到达的高权重任务可能排到前面，用户并发上限也会让部分任务推迟。
+        """
+        with self._cond:
+            target = None
+            for user in self._users.values():
+                for job in user.jobs:
+                    if job.prompt_id == prompt_id:
+                        target = job
+                        break
+                if target is not None:
+                    break
+            if target is None:
+                return None
+            ahead = sum(1 for user in self._users.values() for job in user.jobs
+                        if job.sort_key < target.sort_key)
+            running = len(self._inflight)
+            parallelism = max(self._parallelism(), 1)
+            rounds = math.ceil((ahead + running + 1) / parallelism) - 1
+            return {'queue_position': ahead + 1, 'eta_seconds': int(max(rounds, 0) * self.job_seconds)}
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'queued': self._queued,
+                'inflight': len(self._inflight),
+                'capacity': self._capacity(),
+                'pools': {pool: {'inflight': self._pool_inflight.get(pool, 0), 'capacity': capacity()}
+                          for pool, capacity in self._pools.items()},
+                'users': len(self._users),
+                'job_seconds': round(self.job_seconds, 1),
+            })
+            return stats
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from ai.backends import workflow_models
+
+AI_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 各模板的参数绑定：参数名 -> [(节点ID, 输入名), ...]
+WAN22_I2V_14B_BINDINGS = {
+    'image': [('97', 'image')],
+    'positive_prompt': [('93', 'text')],
+    'negative_prompt': [('89', 'text')],
+    'width': [('98', 'width')],
+    'height': [('98', 'height')],
+    'length': [('98', 'length')],
+    'fps': [('94', 'fps')],
+    'filename_prefix': [('108', 'filename_prefix')],
+}
+
+WAN22_TI2V_5B_BINDINGS = {
+    'image': [('56', 'image')],
+    'positive_prompt': [('6', 'text')],
+    'negative_prompt': [('7', 'text')],
+    'width': [('55', 'width')],
+    'height': [('55', 'height')],
+    'length': [('55', 'length')],
+    'fps': [('57', 'fps')],
+    'filename_prefix': [('58', 'filename_prefix')],
+}
+
+# 5B 文生视频：与图生视频共用同一个工作流文件，去掉 LoadImage 节点和潜空间节点的起始图片输入
+WAN22_T2V_5B_BINDINGS = {param: targets for param, targets in WAN22_TI2V_5B_BINDINGS.items() if param != 'image'}
+WAN22_T2V_5B_REMOVE_NODES = ('56',)
+WAN22_T2V_5B_REMOVE_INPUTS = (('55', 'start_image'),)
+
+
+# 不影响生成结果的参数（输入图片以内容哈希参与计算，输出文件名前缀每次不同）
+REQUEST_KEY_EXCLUDED = ('image', 'filename_prefix')
+
+
+class TemplateError(Exception):
+    """模板文件不存在、格式错误或与参数绑定不匹配"""
+
+
+class WorkflowTemplate:
+    """
+    预编译的ComfyUI工作流模板
+
+    加载时校验参数绑定，并把不需要修改的节点预先序列化成字节片段；
+    生成请求体时只序列化被修改的节点，再与预序列化片段拼接，无需整份深拷贝。
+
+    remove_nodes / remove_inputs 用于从同一个工作流文件派生变体（如去掉输入图片节点得到文生视频），
+    加载时删除，删除后仍被引用的节点视为模板错误。
+    """
+
+    def __init__(self, name: str, path: str, bindings: Dict[str, List[Tuple[str, str]]],
+                 remove_nodes: Tuple[str, ...] = (), remove_inputs: Tuple[Tuple[str, str], ...] = ()):
+        self.name = name
+        self.path = path
+        self.bindings = bindings
+        self.remove_nodes = tuple(remove_nodes)
+        self.remove_inputs = tuple(remove_inputs)
+        self.mtime = None
+        self.prompt = None
+        self.models = frozenset()
+        self._patched_nodes = {}  # 节点ID -> 原始节点（生成请求时按需复制）
+        self._static_fragment = b''  # 未修改节点的预序列化片段
+        self.fingerprint = ''  # 模板内容的哈希，模板修改后旧的结果不再复用
+
+    def load(self):
+        """读取并校验模板文件"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, 'r', encoding='utf-8') as f:
+                prompt = json.load(f)
+        except (OSError, ValueError) as e:
+            raise TemplateError(f'加载模板 {self.name} 失败: {e}')
+
+        for node_id in self.remove_nodes:
+            if prompt.pop(node_id, None) is None:
+                raise TemplateError(f'模板 {self.name} 没有要删除的节点 {node_id}')
+        for node_id, input_name in self.remove_inputs:
+            if prompt.get(node_id, {}).get('inputs', {}).pop(input_name, None) is None:
+                raise TemplateError(f'模板 {self.name} 没有要删除的节点输入 {node_id}.{input_name}')
+        for node_id, node in prompt.items():
+            for input_name, value in node.get('inputs', {}).items():
+                if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) \
+                        and value[0] not in prompt:
+                    raise TemplateError(f'模板 {self.name} 的节点输入 {node_id}.{input_name} 引用了不存在的节点 {value[0]}')
+
+        for param, targets in self.bindings.items():
+            for node_id, input_name in targets:
+                node = prompt.get(node_id)
+                if not isinstance(node, dict) or input_name not in node.get('inputs', {}):
+                    raise TemplateError(f'模板 {self.name} 缺少参数 {param} 绑定的节点输入 {node_id}.{input_name}')
+
+        patched_ids = {node_id for targets in self.bindings.values() for node_id, _ in targets}
+        fragments = [
+            json.dumps(node_id).encode('utf-8') + b': ' + json.dumps(node, ensure_ascii=False).encode('utf-8')
+            for node_id, node in prompt.items() if node_id not in patched_ids
+        ]
+
+        self.prompt = prompt
+        self.models = workflow_models(prompt)
+        self._patched_nodes = {node_id: prompt[node_id] for node_id in patched_ids}
+        self._static_fragment = b', '.join(fragments)
+        self.fingerprint = hashlib.sha256(json.dumps(prompt, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        self.mtime = mtime
+
+    def _patch(self, params: dict) -> dict:
+        """复制被绑定的节点并填入参数；值为 None 的参数保留模板默认值"""
+        nodes = {}
+        for node_id, node in self._patched_nodes.items():
+            nodes[node_id] = dict(node, inputs=dict(node['inputs']))
+        for param, value in params.items():
+            if value is None or param not in self.bindings:
+                continue
+            for node_id, input_name in self.bindings[param]:
+                nodes[node_id]['inputs'][input_name] = value
+        return nodes
+
+    def render(self, params: dict) -> dict:
+        """生成完整的工作流字典（未修改的节点与模板共享，调用方不应修改）"""
+        prompt = dict(self.prompt)
+        prompt.update(self._patch(params))
+        return prompt
+
+    def request_key(self, params: dict, image_digest: str) -> str:
+        """
+        相同请求的哈希：模板内容 + 输入图片内容哈希 + 规范化后的参数
+
+        提示词去掉首尾空白并合并连续空白，数值统一为整数，参数顺序不影响结果。
+        """
+        normalized = {}
+        for param, value in params.items():
+            if param in REQUEST_KEY_EXCLUDED or param not in self.bindings or value is None:
+                continue
+            if isinstance(value, str):
+                value = ' '.join(value.split())
+            elif isinstance(value, float) and value.is_integer():
+                value = int(value)
+            normalized[param] = value
+        raw = json.dumps([self.name, self.fingerprint, image_digest, normalized],
+                         sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def build_payload(self, params: dict, prompt_id: Optional[str] = None,
+                      client_id: Optional[str] = None) -> bytes:
+        """生成POST到 /prompt 的请求体字节"""
+        fragments = [self._static_fragment] if self._static_fragment else []
+        for node_id, node in self._patch(params).items():
+            fragments.append(json.dumps(node_id).encode('utf-8') + b': ' +
+                             json.dumps(node, ensure_ascii=False).encode('utf-8'))
+        body = b'{"prompt": {' + b', '.join(fragments) + b'}'
+        if prompt_id:
+            body += b', "prompt_id": ' + json.dumps(prompt_id).encode('utf-8')
+        if client_id:
+            body += b', "client_id": ' + json.dumps(client_id).encode('utf-8')
+        return body + b'}'
+
+
+class TemplateRegistry:
+    """
+    工作流模板注册表：启动时加载全部模板，文件修改时间变化后自动重新加载
+
+    Args:
+        check_interval: 两次检查文件修改时间的最短间隔秒数
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self._templates = {}
+        self._last_check = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, path: str, bindings: Dict[str, List[Tuple[str, str]]],
+                 remove_nodes: Tuple[str, ...] = (),
+                 remove_inputs: Tuple[Tuple[str, str], ...] = ()) -> WorkflowTemplate:
+        """注册并立即加载模板（校验失败时抛 TemplateError）"""
+        template = WorkflowTemplate(name, path, bindings, remove_nodes, remove_inputs)
+        template.load()
+        with self._lock:
+            self._templates[name] = template
+            self._last_check[name] = time.monotonic()
+        return template
+
+    def names(self):
+        return list(self._templates)
+
+    def get(self, name: str) -> WorkflowTemplate:
+        """获取模板；文件被修改过时重新加载，新文件校验失败则继续使用旧版本"""
+        template = self._templates.get(name)
+        if template is None:
+            raise TemplateError(f'未知的模板: {name}')
+
+        now = time.monotonic()
+        if now - self._last_check.get(name, 0) < self.check_interval:
+            return template
+        self._last_check[name] = now
+
+        try:
+            mtime = os.stat(template.path).st_mtime
+        except OSError:
+            return template
+        if mtime == template.mtime:
+            return template
+
+        with self._lock:
+            current = self._templates[name]
+            if current.mtime != mtime:
+                fresh = WorkflowTemplate(name, template.path, template.bindings,
+                                         template.remove_nodes, template.remove_inputs)
+                try:
+                    fresh.load()
+                except TemplateError as e:
+                    print(f'模板 {name} 重新加载失败，继续使用旧版本: {e}')
+                    current.mtime = mtime  # 文件没再变化前不再重试
+                    return current
+                self._templates[name] = fresh
+                print(f'模板 {name} 已重新加载')
+            return self._templates[name]
+
+
+def create_default_registry(check_interval: float = 1.0) -> TemplateRegistry:
+    """注册 Wan2.2 14B图生视频、5B图生视频和5B文生视频三个模板"""
+    registry = TemplateRegistry(check_interval)
+    registry.register('wan2_2_14B_i2v', os.path.join(AI_DIR, 'video_wan2_2_14B_i2v.json'),
+                      WAN22_I2V_14B_BINDINGS)
+    registry.register('wan2_2_5B_ti2v', os.path.join(AI_DIR, 'video_wan2_2_5B_ti2v.json'),
+                      WAN22_TI2V_5B_BINDINGS)
+    registry.register('wan2_2_5B_t2v', os.path.join(AI_DIR, 'video_wan2_2_5B_ti2v.json'),
+                      WAN22_T2V_5B_BINDINGS, WAN22_T2V_5B_REMOVE_NODES, WAN22_T2V_5B_REMOVE_INPUTS)
+    return registry
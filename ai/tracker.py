@@ -0,0 +1,225 @@
+import json
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+try:
+    import websocket  # websocket-client，可选；未安装时只用 /history 轮询
+except ImportError:
+    websocket = None
+
+TERMINAL_STATUSES = ('completed', 'failed')  # 任务结束的状态（接口和进度推送也使用这里的定义）
+
+
+def output_files(outputs: dict) -> list:
+    """从ComfyUI的节点输出中提取结果文件的相对路径（subfolder/filename）"""
+    files = []
+    for node_output in (outputs or {}).values():
+        for key in ('videos', 'gifs', 'images'):
+            for item in node_output.get(key) or []:
+                if isinstance(item, dict) and item.get('filename') and item.get('type', 'output') == 'output':
+                    subfolder = item.get('subfolder') or ''
+                    files.append(f"{subfolder}/{item['filename']}" if subfolder else item['filename'])
+    return files
+
+
+class TaskTracker:
+    """
+    跟踪已提交到ComfyUI的任务状态
+
+    每台后端一个 /ws 长连接接收执行事件（需安装 websocket-client），
+    长时间没有事件的任务再用 /history/{prompt_id} 兜底查询。
+    状态变化先合并在内存中，按 flush_interval 批量写入数据库，写库次数与在途任务数无关。
+    开始/结束时间记为UTC秒数（time.time()），写库时由数据库换算，与查询中的 NOW() 使用同一时钟。
+
+    Args:
+        backend_pool: BackendPool，用于按地址找到后端及其长连接
+        flush: flush(updates) 批量写库函数，updates 为 {prompt_id: {字段: 值}}
+        flush_interval: 批量写库间隔秒数
+        history_interval: 任务多久没有收到事件就查询一次 /history
+    """
+
+    def __init__(self, backend_pool, flush, flush_interval=1.0, history_interval=10.0):
+        self.backend_pool = backend_pool
+        self.client_id = uuid.uuid4().hex  # 提交时带上该ID，ComfyUI才会把事件推送到我们的 /ws 连接
+        self._flush = flush
+        self.flush_interval = flush_interval
+        self.history_interval = history_interval
+
+        self._lock = threading.Lock()
+        self._tasks = {}  # prompt_id -> {'backend': url, 'status': ..., 'seen': 最近收到事件的时间}
+        self._pending = {}  # 待写库的变化
+        self._listeners = []
+        self._stop = threading.Event()
+        self._threads = []
+        self._ws_connected = {}
+        self.flushes = 0
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        targets = [(self._flush_loop, 'task-tracker-flush'), (self._history_loop, 'task-tracker-history')]
+        if websocket is not None:
+            for backend in self.backend_pool.backends:
+                targets.append((lambda b=backend: self._ws_loop(b), f'task-tracker-ws-{backend.url}'))
+        else:
+            print('未安装websocket-client，任务状态只通过 /history 轮询跟踪')
+        for target, name in targets:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self.flush_now()
+
+    def add_listener(self, callback):
+        """注册状态变化回调 callback(prompt_id, fields)，在跟踪线程中调用，应尽快返回"""
+        self._listeners.append(callback)
+
+    def track(self, prompt_id, backend_url, status='pending'):
+        """开始跟踪一个已提交的任务"""
+        with self._lock:
+            self._tasks[prompt_id] = {'backend': backend_url, 'status': status, 'seen': time.monotonic()}
+
+    def tracked(self):
+        with self._lock:
+            return len(self._tasks)
+
+    def update(self, prompt_id, **fields):
+        """记录任务状态变化（合并后批量写库），任务结束后停止跟踪"""
+        with self._lock:
+            task = self._tasks.get(prompt_id)
+            if task is None:
+                return
+            if task['status'] in TERMINAL_STATUSES:
+                return
+            task['seen'] = time.monotonic()
+            if 'status' in fields:
+                task['status'] = fields['status']
+                if fields['status'] in TERMINAL_STATUSES:
+                    del self._tasks[prompt_id]
+            self._pending.setdefault(prompt_id, {}).update(fields)
+        for callback in self._listeners:
+            try:
+                callback(prompt_id, fields)
+            except Exception as e:
+                print(f'任务状态回调出错: {e}')
+
+    def flush_now(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        if self._flush(pending):
+            self.flushes += 1
+        else:
+            # 写库失败，放回去下次重试（期间新的变化优先）
+            with self._lock:
+                for prompt_id, fields in pending.items():
+                    merged = dict(fields)
+                    merged.update(self._pending.get(prompt_id, {}))
+                    self._pending[prompt_id] = merged
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush_now()
+
+    # ---- WebSocket 事件 ----
+
+    def _ws_loop(self, backend):
+        parts = urlsplit(backend.url)
+        scheme = 'wss' if parts.scheme == 'https' else 'ws'
+        ws_url = f'{scheme}://{parts.netloc}/ws?clientId={self.client_id}'
+        delay = 1
+        while not self._stop.is_set():
+            ws = websocket.WebSocket()
+            try:
+                ws.connect(ws_url, timeout=10)
+                ws.settimeout(1)
+                self._ws_connected[backend.url] = True
+                delay = 1
+                while not self._stop.is_set():
+                    try:
+                        message = ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        continue
+                    if isinstance(message, str):
+                        self.handle_event(json.loads(message))
+            except Exception as e:
+                if self._ws_connected.get(backend.url):
+                    print(f'ComfyUI后端 {backend.url} 的 /ws 连接断开: {e}')
+            finally:
+                self._ws_connected[backend.url] = False
+                ws.close()
+            self._stop.wait(delay)
+            delay = min(delay * 2, 30)
+
+    def handle_event(self, message):
+        """处理一条 /ws 事件（二进制的预览帧不经过这里）"""
+        event_type = message.get('type')
+        data = message.get('data') or {}
+        prompt_id = data.get('prompt_id')
+        if not prompt_id:
+            return
+        if event_type == 'execution_start':
+            self.update(prompt_id, status='running', started_at=time.time())
+        elif event_type == 'progress' and data.get('max'):
+            self.update(prompt_id, status='running', progress=min(int(data['value'] * 100 / data['max']), 99))
+        elif event_type == 'executed':
+            files = output_files({data.get('node'): data.get('output') or {}})
+            if files:
+                self.update(prompt_id, output_path=files[0])
+        elif event_type == 'execution_success' or (event_type == 'executing' and data.get('node') is None):
+            self.update(prompt_id, status='completed', progress=100, completed_at=time.time())
+        elif event_type in ('execution_error', 'execution_interrupted'):
+            error = data.get('exception_message') or ('任务被中断' if event_type == 'execution_interrupted' else '执行失败')
+            self.update(prompt_id, status='failed', error=str(error)[:500], completed_at=time.time())
+
+    # ---- /history 兜底 ----
+
+    def _history_loop(self):
+        while not self._stop.wait(min(self.history_interval, 5)):
+            now = time.monotonic()
+            with self._lock:
+                stale = [(prompt_id, task['backend']) for prompt_id, task in self._tasks.items()
+                         if now - task['seen'] >= self.history_interval]
+            backends = {backend.url: backend for backend in self.backend_pool.backends}
+            for prompt_id, backend_url in stale:
+                if self._stop.is_set():
+                    return
+                backend = backends.get(backend_url)
+                if backend is not None:
+                    self.check_history(backend, prompt_id)
+
+    def check_history(self, backend, prompt_id):
+        """查询 /history/{prompt_id}，任务已结束时更新状态"""
+        try:
+            history = backend.get_json(f'/history/{prompt_id}')
+        except Exception as e:
+            print(f'查询任务 {prompt_id} 历史失败: {e}')
+            return
+        with self._lock:
+            if prompt_id in self._tasks:
+                self._tasks[prompt_id]['seen'] = time.monotonic()
+        entry = history.get(prompt_id)
+        if not entry:
+            return  # 仍在排队或执行中
+        status = entry.get('status') or {}
+        fields = {'completed_at': time.time()}
+        files = output_files(entry.get('outputs'))
+        if files:
+            fields['output_path'] = files[0]
+        if status.get('status_str') == 'error':
+            error = '执行失败'
+            for message_type, message in status.get('messages') or []:
+                if message_type == 'execution_error':
+                    error = message.get('exception_message') or error
+            self.update(prompt_id, status='failed', error=str(error)[:500], **fields)
+        elif status.get('completed', True):
+            self.update(prompt_id, status='completed', progress=100, **fields)
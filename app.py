@@ -1,40 +1,408 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, send_file, g
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename  # 用于安全处理文件名
+from werkzeug.middleware.proxy_fix import ProxyFix
 import jwt
 import datetime
+import json
 import os
-import uuid  # 用于生成唯一文件名
+import time
+import uuid  # 用于生成唯一任务ID
 from functools import wraps
 
 # 导入自定义模块
 from db import db  # 数据库模块（已包含积分相关函数）
 import utils  # 工具函数（可移除Base64相关代码）
-from ai.comfyui_functions import load_prompt_template, submit_comfyui_task  # AI功能模块
+import metrics  # Prometheus 指标
+from passwords import PasswordHasher, HasherBusy  # 密码哈希（独立进程池计算）
+from ratelimit import TokenBucketLimiter, LOGIN_IP_RATE, LOGIN_IP_BURST, LOGIN_EMAIL_RATE, LOGIN_EMAIL_BURST
+from tokens import TokenService, TokenRevoked, RevocationList, parse_keys, JWT_KEYS  # 访问令牌与刷新令牌
+from storage import IngestRequest, StorageManager, ingest_image, image_digest, ingest_stats  # 上传图片保存与存储清理
+from pubsub import TaskEventHub  # 任务进度推送
+from media import MediaProcessor, POSTER_NAME, PREVIEW_NAME  # 结果视频、封面和预览
+from ai.comfyui_functions import ComfyUIHTTPError, submit_payload  # AI功能模块
+from ai.backends import BackendPool, parse_backend_urls
+from ai.templates import create_default_registry
+from ai.tracker import TERMINAL_STATUSES, TaskTracker
+from ai.dispatcher import SubmissionDispatcher, SubmissionJob, QueueFullError, PermanentSubmitError
+from ai.scheduler import FairScheduler, parse_tiers
+from ai.pricing import PricingEngine, PricingError, frames_for_duration  # 按预计GPU耗时计费
+from warmup import Warmup  # 启动预热
 
 # 初始化Flask应用
 app = Flask(__name__)
+app.request_class = IngestRequest  # 上传文件边接收边计算哈希
 CORS(app)
+# 部署在反向代理之后时，按 X-Forwarded-For 取客户端IP（值为代理层数，0 为直接使用连接地址）
+PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR') or 0)
+if PROXY_FIX_X_FOR > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_X_FOR)
 
 # 配置
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or 'your-secret-key'
-app.config['UPLOAD_FOLDER'] = 'static/upload'  # 图片上传目录
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER') or 'static/upload'  # 图片上传目录
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 限制上传文件大小（10MB）
-COMFYUI_URL = "http://192.168.2.158:8188/prompt"  # ComfyUI地址
-PROMPT_TEMPLATE_PATH = "ai/video_wan2_2_14B_i2v.json"  # 提示词模板路径
+# 结果视频由前端服务器（Apache/lighttpd 的 X-Sendfile）直接发送文件，Flask只做权限校验
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+COMFYUI_URL = "http://192.168.2.158:8188"  # 默认ComfyUI地址
+# 多台GPU服务器时用逗号分隔，如 http://10.0.0.1:8188,http://10.0.0.2:8188
+COMFYUI_URLS = parse_backend_urls(os.environ.get('COMFYUI_URLS'), COMFYUI_URL)
+DEFAULT_TEMPLATE = 'wan2_2_14B_i2v'  # 默认工作流模板（ai/video_wan2_2_14B_i2v.json）
+TEXT_TEMPLATE = 'wan2_2_5B_t2v'  # 文生视频模板（ai/video_wan2_2_5B_ti2v.json 去掉输入图片）
+# 专用于文生视频的ComfyUI后端（5B模型常驻显存，不运行14B图生视频），逗号分隔；为空时与图生视频共用 COMFYUI_URLS
+COMFYUI_T2V_URLS = [url for url in parse_backend_urls(os.environ.get('COMFYUI_T2V_URLS'), '') if url]
+TEXT_POOL = 'text'  # 文生视频专用后端在调度器中的名额池
+# 文生视频的风格选项追加到提示词后面
+STYLE_PROMPTS = {
+    'realistic': '写实风格，电影质感，细节丰富',
+    'cartoon': '卡通风格，色彩鲜明，线条简洁',
+    'anime': '日本动漫风格，赛璐璐上色',
+    'abstract': '抽象艺术风格，几何图形，色彩流动',
+}
+# 图片传给ComfyUI的方式：shared 通过共享目录（NFS）读取；upload 直接上传到后端的 /upload/image
+COMFYUI_TRANSFER_MODE = os.environ.get('COMFYUI_TRANSFER_MODE') or 'shared'
+COMFYUI_TIMEOUT = float(os.environ.get('COMFYUI_TIMEOUT') or 30)  # 提交到ComfyUI的超时秒数
+COMFYUI_DISPATCH_WORKERS = int(os.environ.get('COMFYUI_DISPATCH_WORKERS') or 4)  # 同时提交的最大并发数
+COMFYUI_QUEUE_SIZE = int(os.environ.get('COMFYUI_QUEUE_SIZE') or 100)  # 提交队列容量，满了返回429
+COMFYUI_MAX_RETRIES = int(os.environ.get('COMFYUI_MAX_RETRIES') or 3)  # 提交失败重试次数
+COMFYUI_BATCH_WINDOW_MS = int(os.environ.get('COMFYUI_BATCH_WINDOW_MS') or 50)  # 合并同时到达的提交的等待毫秒数，0 为不合并
+COMFYUI_SLOTS_PER_BACKEND = int(os.environ.get('COMFYUI_SLOTS_PER_BACKEND') or 2)  # 每台后端同时排队/执行的任务数（其余在本服务按公平顺序排队）
+SCHEDULER_USER_CONCURRENCY = int(os.environ.get('SCHEDULER_USER_CONCURRENCY') or 2)  # 每个用户同时在GPU上的任务数
+SCHEDULER_USER_MAX_QUEUED = int(os.environ.get('SCHEDULER_USER_MAX_QUEUED') or 10)  # 每个用户最多排队的任务数
+# 优先级档位（名称:最低积分:权重），积分越高的档位分到的GPU时间越多，对应价格方案中的优先处理
+SCHEDULER_TIERS = parse_tiers(os.environ.get('SCHEDULER_TIERS') or 'business:5000:4,pro:1000:2')
+COMFYUI_BATCH_SIZE = int(os.environ.get('COMFYUI_BATCH_SIZE') or 8)  # 每批最多合并的任务数
+# 批量生成接口每次最多的参数组数；不超过每个用户的排队上限，排队为空的用户总能提交一整批，
+# 之后按用户并发上限（SCHEDULER_USER_CONCURRENCY）逐步提交到GPU
+GENERATE_BATCH_MAX = min(int(os.environ.get('GENERATE_BATCH_MAX') or 16), SCHEDULER_USER_MAX_QUEUED)
+TASK_PAGE_SIZE = 20  # 任务历史每页默认条数
+TASK_PAGE_MAX = 100  # 任务历史每页最多条数
+# 相同请求（模板、图片内容、规范化参数都相同）复用结果的有效秒数，0 为关闭
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL') or 7 * 24 * 3600)
+MEDIA_MAX_AGE = 7 * 24 * 3600  # 结果视频、封面、预览生成后不再变化，浏览器可缓存的秒数
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # 设置后 /metrics 需要 Authorization: Bearer <METRICS_TOKEN>
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT') or 15)  # 任务进度推送的心跳间隔秒数（防止代理断开空闲连接）
+# 启动时执行数据库迁移（生产环境用 python migrate.py 单独执行，serve.py 默认关闭）
+AUTO_MIGRATE = (os.environ.get('AUTO_MIGRATE') or '1') == '1'
+WARMUP_DB_CONNECTIONS = int(os.environ.get('WARMUP_DB_CONNECTIONS') or 4)  # 启动时预先建立的数据库连接数
 
 # 创建上传目录（如果不存在）
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # 如果localtest = True，说明本后端服务和COMFYUI服务不在同一台服务器，也没有共享目录，目录是nfs的，两台机器同一文件夹目录不太一致
 localtest = True
-if localtest:
+if localtest and COMFYUI_TRANSFER_MODE == 'shared':
     app.config['UPLOAD_FOLDER'] = '/mnt/mnt158_hdd/ccl/temp_images'  # 图片上传目录
 
 
+def comfyui_image_path(image_path):
+    """本地图片路径转换为ComfyUI服务器上看到的路径（shared 模式）"""
+    if localtest:
+        return image_path.replace('/mnt/mnt158_hdd/', '/slow_disk/')
+    return image_path
 
-# JWT认证装饰器
+
+def submit_to_backend(backend, template, job):
+    """在已选定的后端上提交一个任务（调用方负责 acquire/release），返回prompt_id"""
+    params = job.params
+    image = None  # 文生视频模板没有输入图片
+    if 'image' in template.bindings:
+        if COMFYUI_TRANSFER_MODE == 'upload':
+            image = backend.ensure_uploaded(params['image_path'], timeout=COMFYUI_TIMEOUT)
+        else:
+            image = comfyui_image_path(params['image_path'])
+    payload = template.build_payload({
+        'image': image,
+        'positive_prompt': params['positive_prompt'],
+        'negative_prompt': params['negative_prompt'],
+        'width': params['width'],
+        'height': params['height'],
+        'length': params['length'],
+        'fps': params['fps'],
+        'filename_prefix': params['filename_prefix']
+    }, prompt_id=job.prompt_id, client_id=tracker.client_id)
+    prompt_id = submit_payload(backend.client, payload, timeout=COMFYUI_TIMEOUT)
+    job.backend = backend.url
+    return prompt_id
+
+
+def submit_batch(jobs):
+    """
+    调度器工作线程中执行：把同一模板的一组任务提交到ComfyUI
+
+    按排队深度和已加载模型为每个任务选择后端（同一批尽量集中在已加载该工作流模型的后端），
+    分到同一后端的任务经同一条长连接依次POST，在该后端队列中相邻执行，中间不需要换模型。
+
+    Returns:
+        与 jobs 一一对应的 prompt_id 或异常（PermanentSubmitError 表示不必重试）
+    """
+    try:
+        with metrics.span('template_load'):
+            template = templates.get(jobs[0].params['template'])
+        with metrics.span('backend_acquire'):
+            backends = backend_pool.acquire_many(template.models, len(jobs))
+    except Exception as e:
+        return [e] * len(jobs)
+
+    results = []
+    broken = {}  # 后端地址 -> 连接错误；出错后剩余任务不再发给这台后端，由调度器单独重试
+    for job, backend in zip(jobs, backends):
+        if backend.url in broken:
+            backend_pool.release(backend, success=True, submitted=False)
+            results.append(broken[backend.url])
+            continue
+        try:
+            with metrics.span('comfyui_submit'):
+                results.append(submit_to_backend(backend, template, job))
+        except ComfyUIHTTPError as e:
+            if 400 <= e.status < 500:
+                # ComfyUI拒绝了工作流（参数校验失败等），不算后端故障
+                backend_pool.release(backend, success=True, submitted=False)
+                if COMFYUI_TRANSFER_MODE == 'upload' and job.params['image_path'] and job.attempts == 1:
+                    # 可能是后端的input目录被清理，图片已不存在：重新上传后再试一次
+                    backend.forget_upload(job.params['image_path'])
+                    results.append(e)
+                else:
+                    results.append(PermanentSubmitError(f'ComfyUI拒绝任务: {e}'))
+                continue
+            backend_pool.release(backend, success=False, submitted=False)
+            results.append(e)
+            broken[backend.url] = e
+            continue
+        except Exception as e:
+            backend_pool.release(backend, success=False, submitted=False)
+            results.append(e)
+            broken[backend.url] = e
+            continue
+        backend_pool.release(backend, success=True)
+    return results
+
+
+def submit_job(job):
+    """调度器工作线程中执行：提交单个任务，失败时抛异常"""
+    result = submit_batch([job])[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def on_job_submitted(job, prompt_id):
+    """任务已进入ComfyUI队列，开始跟踪执行状态"""
+    metrics.stage_seconds.observe(time.monotonic() - job.enqueued_at, 'queue_wait')  # 入队到ComfyUI接收
+    db.commit_video_task(job.prompt_id, job.backend)
+    tracker.track(job.prompt_id, job.backend)
+    task_events.publish(job.prompt_id, {'status': 'pending'})
+
+
+def on_job_failed(job, error):
+    """任务最终提交失败：标记失败、退还积分（图片按内容去重，可能被其他任务引用，不在此删除）"""
+    if not db.refund_video_task(job.prompt_id, job.user_id):
+        print(f"警告：用户 {job.user_id} 任务 {job.prompt_id} 积分退还失败")
+    scheduler.release(job.prompt_id)
+    task_events.publish(job.prompt_id, {'status': 'failed', 'error': str(error)[:500]})
+
+
+def find_reusable_task(request_key, user_id):
+    """
+    按请求哈希查找可复用的任务（排队/执行中，或已完成且结果文件仍在）
+
+    Returns:
+        (任务记录, 是否为该用户自己的任务)；没有可复用的任务时为 (None, False)
+    """
+    try:
+        candidates = db.find_cached_video_tasks(request_key, RESULT_CACHE_TTL)
+    except Exception as e:
+        print(f'查询结果缓存错误: {e}')
+        return None, False
+    return pick_reusable_task(candidates, user_id)
+
+
+def pick_reusable_task(candidates, user_id):
+    """从候选任务中选出可复用的一个（已完成但结果文件已被清理的不可用），优先选用户自己的任务"""
+    usable = [task for task in candidates if task['status'] != 'completed' or media.video_path(task)]
+    for task in usable:
+        if task['user_id'] == user_id:
+            return task, True
+    return (usable[0], False) if usable else (None, False)
+
+
+def job_from_task(task):
+    """由数据库中的任务记录构造提交任务（优先级档位按用户当前积分）"""
+    user = db.get_cached_user(task['user_id'])
+    lane = scheduler.lane_for(user['points']) if user else None
+    return SubmissionJob(task['prompt_id'], task['user_id'], {
+        'template': task['template'] or DEFAULT_TEMPLATE,
+        'image_path': task['image_path'],
+        'positive_prompt': task['positive_prompt'],
+        'negative_prompt': task['negative_prompt'],
+        'width': task['width'],
+        'height': task['height'],
+        'length': task['length'],
+        'fps': task['fps'],
+        'filename_prefix': task['filename_prefix']
+    }, lane=lane)
+
+
+# 工作流模板注册表（启动时加载校验，文件修改后自动重新加载）
+templates = create_default_registry()
+
+# ComfyUI后端池（按排队深度和已加载模型选择后端；文生视频专用后端只运行5B模板）
+backend_pool = BackendPool(COMFYUI_URLS, on_request=metrics.observe_comfyui,
+                           dedicated={url: templates.get(TEXT_TEMPLATE).models for url in COMFYUI_T2V_URLS})
+
+# 任务状态跟踪（/ws 事件 + /history 兜底，批量写库）
+tracker = TaskTracker(backend_pool, flush=db.bulk_update_video_tasks)
+
+# 任务进度发布/订阅（状态变化直接推送给 /api/tasks/<prompt_id>/events 的订阅者，不经过数据库）
+task_events = TaskEventHub()
+tracker.add_listener(task_events.publish)
+
+
+def lookup_task_output(prompt_id):
+    """结果处理线程中执行：先把内存中的状态写库，再查询结果文件路径"""
+    tracker.flush_now()
+    return db.get_video_task_output(prompt_id)
+
+
+def on_task_update(prompt_id, fields):
+    """任务开始执行/结束时更新调度名额；完成后在后台准备结果视频、生成封面和预览"""
+    status = fields.get('status')
+    if status == 'running':
+        scheduler.started(prompt_id)
+    elif status in TERMINAL_STATUSES:
+        scheduler.release(prompt_id, completed=status == 'completed')
+    if status == 'completed':
+        media.enqueue(prompt_id)
+
+
+# 结果视频处理（下载、封面、低码率预览；超出容量时清理最旧的结果，被清理的结果不再复用）
+media = MediaProcessor(lookup=lookup_task_output, on_evict=db.expire_request_keys)
+tracker.add_listener(on_task_update)
+
+# 存储清理：删除不再被未结束任务引用的输入图片，结果视频按时间迁移到冷存储或过期删除
+storage_manager = StorageManager(
+    upload_dir=app.config['UPLOAD_FOLDER'],
+    media=media,
+    find_active=db.get_active_image_paths,
+    list_outputs=db.get_stored_outputs,
+    set_tier=db.set_storage_tier
+)
+
+# 计费：按模板、分辨率和帧数估算GPU耗时，定期用实测执行时间校准
+pricing = PricingEngine(load_samples=db.get_task_durations)
+
+
+
+def scheduler_pool(job):
+    """有可用的文生视频专用后端时，文生视频任务只占用专用后端的名额，不排在14B图生视频任务后面"""
+    if job.params['template'] == TEXT_TEMPLATE and backend_pool.has_dedicated(templates.get(TEXT_TEMPLATE).models):
+        return TEXT_POOL
+    return None
+
+
+# 公平调度队列：按用户加权公平排队，ComfyUI上的任务数按可用后端限制，单个用户不能占满GPU
+scheduler = FairScheduler(
+    # 公共后端全部不可用时，其他任务也会分到专用后端
+    capacity=lambda: (backend_pool.count_available() or
+                      backend_pool.count_available(dedicated=True)) * COMFYUI_SLOTS_PER_BACKEND,
+    pools={TEXT_POOL: lambda: backend_pool.count_available(dedicated=True) * COMFYUI_SLOTS_PER_BACKEND},
+    pool_of=scheduler_pool,
+    max_queue=COMFYUI_QUEUE_SIZE,
+    user_concurrency=SCHEDULER_USER_CONCURRENCY,
+    user_max_queued=SCHEDULER_USER_MAX_QUEUED,
+    tiers=SCHEDULER_TIERS,
+    parallelism=lambda: sum(1 for b in backend_pool.backends if b.healthy)
+)
+
+# ComfyUI提交调度器（接口只入队，后台线程按调度顺序提交）
+dispatcher = SubmissionDispatcher(
+    submit=submit_job,
+    workers=COMFYUI_DISPATCH_WORKERS,
+    max_queue=COMFYUI_QUEUE_SIZE,
+    max_retries=COMFYUI_MAX_RETRIES,
+    on_submitted=on_job_submitted,
+    on_failed=on_job_failed,
+    submit_batch=submit_batch,
+    batch_window=COMFYUI_BATCH_WINDOW_MS / 1000,
+    max_batch=COMFYUI_BATCH_SIZE,
+    batch_key=lambda job: job.params['template'],  # 同一模板的任务合并提交到同一台后端
+    job_queue=scheduler
+)
+
+# 监控指标：各组件的 stats() 在 /metrics 被抓取时才读取，不影响处理请求
+metrics.registry.add_stats('videogenius_db_pool', db.get_pool_stats, label='database')
+metrics.registry.add_stats('videogenius_user_cache', db.get_cache_stats)
+metrics.registry.add_stats('videogenius_ingest', lambda: ingest_stats)
+metrics.registry.add_stats('videogenius_dispatcher', dispatcher.stats)
+metrics.registry.add_stats('videogenius_scheduler', scheduler.stats)
+metrics.registry.add_stats('videogenius_tracker', lambda: {'tracked': tracker.tracked(), 'flushes': tracker.flushes})
+metrics.registry.add_stats('videogenius_task_events', task_events.stats)
+metrics.registry.add_stats('videogenius_media', media.stats)
+metrics.registry.add_stats('videogenius_storage', storage_manager.stats)
+metrics.registry.add_stats('videogenius_pricing', lambda: pricing.stats()['models'], label='template')
+metrics.registry.add_stats('videogenius_backend', lambda: {b['url']: b for b in backend_pool.describe()},
+                           label='backend')
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        metrics.http_request_seconds.observe(time.perf_counter() - started, request.method, endpoint)
+        metrics.http_requests.inc(request.method, endpoint, str(response.status_code))
+    return response
+
+
+# 密码哈希与登录限流：哈希在固定数量的进程中计算，登录/注册的容量可预期，不占用其他接口的线程
+password_hasher = PasswordHasher()
+login_ip_limiter = TokenBucketLimiter(LOGIN_IP_RATE, LOGIN_IP_BURST)
+login_email_limiter = TokenBucketLimiter(LOGIN_EMAIL_RATE, LOGIN_EMAIL_BURST)
+metrics.registry.add_stats('videogenius_password_hasher', password_hasher.stats)
+metrics.registry.add_stats('videogenius_login_limiter', lambda: {
+    'ip': login_ip_limiter.stats(), 'email': login_email_limiter.stats()})
+
+# 令牌：短期访问令牌的载荷带用户信息快照，认证不查库；刷新令牌换取新的访问令牌；签名密钥按 kid 轮换
+token_revocations = RevocationList(load=db.get_revoked_tokens, save=db.add_revoked_token)
+token_service = TokenService(parse_keys(JWT_KEYS, app.config['SECRET_KEY']), token_revocations,
+                             legacy_secret=app.config['SECRET_KEY'])
+metrics.registry.add_stats('videogenius_tokens', token_service.stats)
+
+
+def rate_limited(retry_after):
+    response = jsonify({'message': '请求过于频繁，请稍后重试'})
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response, 429
+
+
+def hasher_busy(e):
+    response = jsonify({'message': str(e)})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+# 允许通过查询参数 ?token= 传递令牌的接口
+QUERY_TOKEN_ENDPOINTS = {'task_events_stream', 'task_media'}
+
+
+def user_from_claims(claims):
+    """访问令牌载荷中的用户信息；旧令牌只有 user_id，返回 None"""
+    if 'name' not in claims:
+        return None
+    return {'id': claims['user_id'], 'name': claims['name'], 'email': claims['email'], 'points': claims['points']}
+
+
+def current_points(user):
+    """用户当前积分：令牌中的积分是签发时的快照，需要准确余额时读用户缓存（未命中时查库）"""
+    cached = db.get_cached_user(user['id'])
+    return cached['points'] if cached else user['points']
+
+
+# JWT认证装饰器（用户信息取自访问令牌的载荷，不查库）
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -42,19 +410,27 @@ def token_required(f):
         if 'Authorization' in request.headers:
             auth_header = request.headers['Authorization']
             token = auth_header.split(" ")[1] if len(auth_header.split(" ")) > 1 else None
+        elif request.endpoint in QUERY_TOKEN_ENDPOINTS:
+            # 浏览器的 EventSource、<video>、<img> 不能设置请求头，令牌通过查询参数传递
+            token = request.args.get('token')
 
         if not token:
             return jsonify({'message': '令牌缺失'}), 401
 
         try:
-            decoded_data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user = db.get_user_by_id(decoded_data['user_id'])
-            if not current_user:
-                return jsonify({'message': '用户不存在'}), 401
+            claims = token_service.verify(token)
         except jwt.ExpiredSignatureError:
             return jsonify({'message': '令牌已过期'}), 401
+        except TokenRevoked:
+            return jsonify({'message': '令牌已失效，请重新登录'}), 401
         except jwt.InvalidTokenError:
             return jsonify({'message': '无效的令牌'}), 401
+        current_user = user_from_claims(claims)
+        if current_user is None:
+            current_user = db.get_cached_user(claims['user_id'])
+            if not current_user:
+                return jsonify({'message': '用户不存在'}), 401
+        g.token_claims = claims
 
         return f(current_user, *args, **kwargs)
 
@@ -68,10 +444,18 @@ def register():
     if not all(key in data for key in ['name', 'email', 'password']):
         return jsonify({'message': '缺少必要的参数'}), 400
 
+    # 注册同样要计算密码哈希，与登录共用按IP的限流
+    allowed, retry_after = login_ip_limiter.acquire(request.remote_addr)
+    if not allowed:
+        return rate_limited(retry_after)
+
     if db.get_user_by_email(data['email']):
         return jsonify({'message': '邮箱已被注册'}), 400
 
-    hashed_password = generate_password_hash(data['password'], method='pbkdf2:sha256')
+    try:
+        hashed_password = password_hasher.hash(data['password'])
+    except HasherBusy as e:
+        return hasher_busy(e)
     if db.create_user(
             name=data['name'],
             email=data['email'],
@@ -90,18 +474,28 @@ def login():
     if not all(key in data for key in ['email', 'password']):
         return jsonify({'message': '缺少必要的参数'}), 400
 
+    # 限流在查库和计算哈希之前，撞库请求不会占用数据库连接和哈希进程
+    allowed, retry_after = login_ip_limiter.acquire(request.remote_addr)
+    if allowed:
+        allowed, retry_after = login_email_limiter.acquire(str(data['email']).strip().lower())
+    if not allowed:
+        return rate_limited(retry_after)
+
     user = db.get_user_by_email(data['email'])
-    if not user or not check_password_hash(user['password'], data['password']):
+    try:
+        valid, new_hash = password_hasher.verify(user['password'] if user else None, data['password'])
+    except HasherBusy as e:
+        return hasher_busy(e)
+    if not valid:
         return jsonify({'message': '邮箱或密码错误'}), 401
-
-    token = jwt.encode({
-        'user_id': user['id'],
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
-    }, app.config['SECRET_KEY'], algorithm='HS256')
+    if new_hash and not db.update_user_password(user['id'], new_hash):
+        print(f"警告：用户 {user['id']} 密码哈希升级失败")  # 不影响本次登录，下次登录再升级
 
     return jsonify({
         'message': '登录成功',
-        'token': token,
+        'token': token_service.issue_access(user),
+        'refresh_token': token_service.issue_refresh(user),
+        'expires_in': token_service.access_ttl,
         'user': {
             'id': user['id'],
             'name': user['name'],
@@ -119,8 +513,8 @@ def verify_token():
         return jsonify({'message': '缺少令牌参数'}), 400
 
     try:
-        decoded_data = jwt.decode(data['token'], app.config['SECRET_KEY'], algorithms=['HS256'])
-        user = db.get_user_by_id(decoded_data['user_id'])
+        claims = token_service.verify(data['token'])
+        user = user_from_claims(claims) or db.get_cached_user(claims['user_id'])
         if not user:
             return jsonify({'message': '用户不存在'}), 404
 
@@ -130,11 +524,13 @@ def verify_token():
                 'id': user['id'],
                 'name': user['name'],
                 'email': user['email'],
-                'points': user['points']
+                'points': current_points(user)
             }
         }), 200
     except jwt.ExpiredSignatureError:
         return jsonify({'message': '令牌已过期'}), 401
+    except TokenRevoked:
+        return jsonify({'message': '令牌已失效，请重新登录'}), 401
     except jwt.InvalidTokenError:
         return jsonify({'message': '无效的令牌'}), 401
     except Exception as e:
@@ -142,22 +538,90 @@ def verify_token():
         return jsonify({'message': '验证令牌失败'}), 500
 
 
+# 刷新令牌接口：用刷新令牌换取新的访问令牌（重新读取用户信息，积分快照随之更新）
+@app.route('/api/token/refresh', methods=['POST'])
+def refresh_token():
+    data = request.get_json(silent=True) or {}
+    if 'refresh_token' not in data:
+        return jsonify({'message': '缺少刷新令牌参数'}), 400
+
+    try:
+        claims = token_service.verify(data['refresh_token'], typ='refresh')
+    except jwt.ExpiredSignatureError:
+        return jsonify({'message': '登录已过期，请重新登录'}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({'message': '无效的刷新令牌'}), 401
+    user = db.get_cached_user(claims['user_id'])
+    if not user:
+        return jsonify({'message': '用户不存在'}), 401
+
+    return jsonify({
+        'message': '令牌已刷新',
+        'token': token_service.issue_access(user),
+        'expires_in': token_service.access_ttl,
+        'user': {
+            'id': user['id'],
+            'name': user['name'],
+            'email': user['email'],
+            'points': user['points']
+        }
+    }), 200
+
+
+# 退出登录接口：吊销当前访问令牌和刷新令牌；all 为 true 时吊销该用户此前签发的全部令牌（所有设备下线）
+@app.route('/api/logout', methods=['POST'])
+@token_required
+def logout(current_user):
+    data = request.get_json(silent=True) or {}
+    if data.get('all'):
+        saved = token_revocations.revoke_user(current_user['id'])
+        # 按用户吊销只覆盖吊销之前那一秒及更早签发的令牌，当前令牌可能与吊销同一秒签发，单独吊销
+        saved = token_service.revoke(g.token_claims) and saved
+    else:
+        saved = token_service.revoke(g.token_claims)
+        if data.get('refresh_token'):
+            try:
+                claims = token_service.verify(data['refresh_token'], typ='refresh')
+            except jwt.InvalidTokenError:
+                claims = None  # 已过期或已吊销，无需处理
+            if claims and claims['user_id'] == current_user['id']:
+                saved = token_service.revoke(claims) and saved
+    if not saved:
+        # 本进程已生效，其他进程要等数据库恢复后才能同步到
+        print(f"警告：用户 {current_user['id']} 的令牌吊销记录写入失败")
+    return jsonify({'message': '已退出登录'}), 200
+
+
 # 视频生成接口（二进制文件上传版）
 @app.route('/api/generate-video', methods=['POST'])
 @token_required
 def generate_video(current_user):
-    """生成视频接口（使用FormData上传图片，二进制处理）"""
+    """
+    生成视频接口（使用FormData上传图片，二进制处理）
+
+    上传了图片时为图生视频（14B模板）；没有图片、只有 prompt 时为文生视频（5B模板），
+    此时可以用 duration（秒）代替 length（帧数），按帧率换算并截断到模型支持的最大帧数，style 追加到提示词后面。
+    """
     # 1. 验证请求格式（FormData）
-    if 'image' not in request.files:
-        return jsonify({'message': '缺少图片文件'}), 400
+    image_file = request.files.get('image')
+    text_prompt = request.form.get('prompt', '').strip()
+    if image_file is None and not text_prompt:
+        return jsonify({'message': '缺少图片文件或视频描述'}), 400
 
     # 2. 获取图片文件和其他参数
-    image_file = request.files['image']
-    positive_prompt = request.form.get('positive_prompt', '')
+    if image_file is not None:
+        template_name = DEFAULT_TEMPLATE
+        positive_prompt = request.form.get('positive_prompt', '')
+    else:
+        template_name = TEXT_TEMPLATE
+        style = STYLE_PROMPTS.get(request.form.get('style', ''))
+        positive_prompt = f'{text_prompt}，{style}' if style else text_prompt
     negative_prompt = request.form.get('negative_prompt', '')
 
     # 验证必要参数
-    required_form_fields = ['width', 'height', 'length', 'fps']
+    required_form_fields = ['width', 'height', 'fps']
+    if image_file is not None or 'duration' not in request.form:
+        required_form_fields.append('length')
     for field in required_form_fields:
         if field not in request.form:
             return jsonify({'message': f'缺少必要的参数: {field}'}), 400
@@ -166,17 +630,29 @@ def generate_video(current_user):
         # 转换参数为整数
         width = int(request.form['width'])
         height = int(request.form['height'])
-        length = int(request.form['length'])
         fps = int(request.form['fps'])
+        duration = None if 'length' in required_form_fields else int(request.form['duration'])
+        length = int(request.form['length']) if duration is None else None
     except ValueError:
         return jsonify({'message': '参数格式错误，宽度/高度/长度/FPS必须为整数'}), 400
+    if duration is not None:
+        try:
+            length = frames_for_duration(duration, fps)  # Wan的帧数为4k+1，超长时按最大帧数生成
+        except PricingError as e:
+            return jsonify({'message': str(e)}), 400
 
     try:
-        # 3. 积分校验
-        user_points = current_user['points']
-        video_resolution = width * height
-        required_points = 50
+        # 3. 按预计GPU耗时计算积分（超出分辨率/帧数/计算量上限的请求在排队前拒绝）
+        try:
+            quote = pricing.quote(template_name, width, height, length)
+        except PricingError as e:
+            return jsonify({'message': str(e)}), 400
+        required_points = quote['points']
 
+        # 积分预检（基于令牌中的积分快照，不足时再读缓存中的余额，最终以数据库的原子扣减为准）
+        user_points = current_user['points']
+        if user_points < required_points:
+            user_points = current_points(current_user)
         if user_points < required_points:
             return jsonify({
                 'message': '积分不足，无法生成视频',
@@ -184,105 +660,452 @@ def generate_video(current_user):
                 'required_points': required_points
             }), 402
 
-        # 4. 保存图片（二进制直接保存，无需Base64解码）
-        # 生成唯一文件名（避免重复）
-        filename = f"{current_user['id']}_{uuid.uuid4()}_{secure_filename(image_file.filename)}"
-        image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        # 4. 校验并保存图片（上传时已边接收边计算哈希，文件名为内容哈希，相同图片只写一次）
+        image_path = ''  # 文生视频没有输入图片
+        if image_file is not None:
+            with metrics.span('image_ingest'):
+                saved, image_path, error = ingest_image(image_file, app.config['UPLOAD_FOLDER'])
+            if not saved:
+                status_code = 500 if error.startswith('图片保存失败') else 400
+                return jsonify({'message': error}), status_code
 
-        # 保存二进制文件
-        try:
-            image_file.save(image_path)
-        except Exception as e:
-            return jsonify({'message': f'图片保存失败: {str(e)}'}), 500
+        # 5. 相同请求（同一模板、同一图片、相同参数）已生成过或正在生成时直接复用，不再占用GPU、不扣积分
+        params = {
+            'positive_prompt': positive_prompt,
+            'negative_prompt': negative_prompt,
+            'width': width,
+            'height': height,
+            'length': length,
+            'fps': fps
+        }
+        request_key = None
+        if RESULT_CACHE_TTL > 0:
+            with metrics.span('cache_lookup'):
+                request_key = templates.get(template_name).request_key(
+                    params, image_digest(image_path) if image_path else '')
+                cached, own = find_reusable_task(request_key, current_user['id'])
+            if cached and (own or db.attach_video_task(
+                    current_user['id'], cached, image_path, template=template_name,
+                    request_key=request_key, **params)):
+                completed = cached['status'] == 'completed'
+                return jsonify({
+                    'message': '相同的视频已生成，直接复用结果' if completed else '相同的视频正在生成，已加入该任务',
+                    'prompt_id': cached['prompt_id'],
+                    'status': cached['status'],
+                    'cached': True,
+                    'points_consumed': 0,
+                    'remaining_points': current_points(current_user)
+                }), 200 if completed else 202
 
-        # 5. 加载提示词模板
-        try:
-            prompt_template = load_prompt_template(PROMPT_TEMPLATE_PATH)
-        except Exception as e:
-            return jsonify({'message': f'加载模板失败: {str(e)}'}), 500
+        # 队列已满时直接拒绝，避免扣积分后才发现无法排队
+        if dispatcher.full():
+            return jsonify({'message': '当前排队任务过多，请稍后重试'}), 429
+        if scheduler.user_full(current_user['id']):
+            return jsonify({'message': '您的排队任务过多，请等待已提交的任务开始执行'}), 429
 
-        # 6. 生成文件名前缀
+        # 6. 生成任务ID和文件名前缀（任务ID即提交给ComfyUI的prompt_id）
+        prompt_id = str(uuid.uuid4())
         safe_email = current_user['email'].replace('@', '_').replace('.', '_')
         filename_prefix = f"video/{safe_email}_{int(datetime.datetime.now().timestamp())}"
 
-        if localtest:
-            image_path_ = image_path.replace('/mnt/mnt158_hdd/', '/slow_disk/')
-        else:
-            image_path_ = image_path
-
-        # 7. 提交任务到ComfyUI
-        success, prompt_id, error = submit_comfyui_task(
-            prompt_template=prompt_template,
-            comfyui_url=COMFYUI_URL,
-            image_path=image_path_,
-            positive_prompt=positive_prompt,
-            negative_prompt=negative_prompt,
-            width=width,
-            height=height,
-            length=length,
-            fps=fps,
-            filename_prefix=filename_prefix
-        )
-
-        if not success:
-            # 任务失败时删除已保存的图片
-            if os.path.exists(image_path):
-                os.remove(image_path)
-            return jsonify({'message': f'任务提交失败: {error}'}), 500
-
-        # 8. 扣减用户积分
-        remaining_points = user_points - required_points
-        if not db.update_user_points(current_user['id'], remaining_points):
-            # 积分扣减失败，回滚任务和图片
-            if os.path.exists(image_path):
-                os.remove(image_path)
-            print(f"警告：用户 {current_user['id']} 积分扣减失败")
-            return jsonify({'message': '积分扣减失败，请重试'}), 500
-
-        # 9. 记录任务（包含积分消耗）
-        if not db.add_video_task(
+        # 7. 预扣积分并记录任务（同一事务，状态为queued，重启后可据此恢复提交）
+        with metrics.span('reserve'):
+            status, remaining_points = db.reserve_video_task(
                 user_id=current_user['id'],
+                points=required_points,
                 prompt_id=prompt_id,
                 image_path=image_path,
-                positive_prompt=positive_prompt,
-                negative_prompt=negative_prompt,
-                width=width,
-                height=height,
-                length=length,
-                fps=fps,
-                points_consumed=required_points
-        ):
-            print(f"警告：用户 {current_user['id']} 任务记录失败")
-
-        # 10. 返回结果
-        return jsonify({
+                filename_prefix=filename_prefix,
+                template=template_name,
+                request_key=request_key,
+                **params
+            )
+        if status != 'ok':
+            if status == 'insufficient':
+                return jsonify({
+                    'message': '积分不足，无法生成视频',
+                    'required_points': required_points
+                }), 402
+            print(f"警告：用户 {current_user['id']} 积分扣减失败")
+            return jsonify({'message': '积分扣减失败，请重试'}), 500
+
+        # 8. 入队，由后台调度器提交到ComfyUI
+        job = SubmissionJob(prompt_id, current_user['id'], dict(
+            params,
+            template=template_name,
+            image_path=image_path,
+            filename_prefix=filename_prefix
+        ), lane=scheduler.lane_for(remaining_points + required_points))
+        try:
+            with metrics.span('enqueue'):
+                dispatcher.enqueue(job)
+        except QueueFullError:
+            on_job_failed(job, '提交队列已满')
+            return jsonify({'message': '当前排队任务过多，请稍后重试'}), 429
+
+        # 9. 返回结果（任务已排队，附带排队位置估计，可通过 /api/tasks/<prompt_id> 查询状态）
+        return jsonify(dict({
             'message': '视频生成任务已提交',
             'prompt_id': prompt_id,
+            'status': 'queued',
             'points_consumed': required_points,
-            'remaining_points': remaining_points
-        }), 200
+            'remaining_points': remaining_points,
+            'length': length,
+            'estimated_gpu_seconds': quote['gpu_seconds']
+        }, **(scheduler.position(prompt_id) or {}))), 202
 
     except Exception as e:
         print(f'视频生成接口错误: {str(e)}')
         return jsonify({'message': '服务器内部错误'}), 500
 
 
+# 批量生成接口：一张图片、多组参数
+@app.route('/api/generate-video/batch', methods=['POST'])
+@token_required
+def generate_video_batch(current_user):
+    """
+    批量生成视频（FormData：image 图片，params 为参数组的JSON数组）
+
+    每组参数可包含 positive_prompt、negative_prompt、width、height、length、fps，表单中的同名字段作为默认值。
+    图片只校验保存一次，全部参数组一次查询结果缓存、在同一事务中扣除积分并用一条多行INSERT写入任务，
+    新任务一起入队，由调度器合并提交到同一台后端。
+    """
+    image_file = request.files.get('image')
+    if image_file is None:
+        return jsonify({'message': '缺少图片文件'}), 400
+    try:
+        items = json.loads(request.form.get('params') or '')
+    except ValueError:
+        items = None
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        return jsonify({'message': 'params 必须是非空的JSON数组，每项为一组参数'}), 400
+    if len(items) > GENERATE_BATCH_MAX:
+        return jsonify({'message': f'每次最多提交 {GENERATE_BATCH_MAX} 组参数'}), 400
+
+    # 1. 校验每组参数并计算积分（任何一组不合法时整批拒绝）
+    defaults = {field: request.form[field] for field in
+                ('positive_prompt', 'negative_prompt', 'width', 'height', 'length', 'fps') if field in request.form}
+    param_sets = []
+    for index, item in enumerate(items, 1):
+        merged = dict(defaults, **item)
+        missing = [field for field in ('width', 'height', 'length', 'fps') if field not in merged]
+        if missing:
+            return jsonify({'message': f'第{index}组缺少必要的参数: {", ".join(missing)}'}), 400
+        try:
+            params = {
+                'positive_prompt': str(merged.get('positive_prompt') or ''),
+                'negative_prompt': str(merged.get('negative_prompt') or ''),
+                'width': int(merged['width']),
+                'height': int(merged['height']),
+                'length': int(merged['length']),
+                'fps': int(merged['fps'])
+            }
+        except (TypeError, ValueError):
+            return jsonify({'message': f'第{index}组参数格式错误，宽度/高度/长度/FPS必须为整数'}), 400
+        try:
+            quote = pricing.quote(DEFAULT_TEMPLATE, params['width'], params['height'], params['length'])
+        except PricingError as e:
+            return jsonify({'message': f'第{index}组参数: {e}'}), 400
+        param_sets.append((params, quote))
+
+    try:
+        # 2. 校验并保存图片（只保存一次）
+        with metrics.span('image_ingest'):
+            saved, image_path, error = ingest_image(image_file, app.config['UPLOAD_FOLDER'])
+        if not saved:
+            status_code = 500 if error.startswith('图片保存失败') else 400
+            return jsonify({'message': error}), status_code
+
+        # 3. 一次查询全部参数组的结果缓存
+        request_keys = [None] * len(param_sets)
+        cached_tasks = {}
+        if RESULT_CACHE_TTL > 0:
+            with metrics.span('cache_lookup'):
+                template = templates.get(DEFAULT_TEMPLATE)
+                digest = image_digest(image_path)
+                request_keys = [template.request_key(params, digest) for params, _ in param_sets]
+                try:
+                    cached_tasks = db.find_cached_video_tasks_many(sorted(set(request_keys)), RESULT_CACHE_TTL)
+                except Exception as e:
+                    print(f'查询结果缓存错误: {e}')
+
+        # 4. 逐组决定复用已有任务还是新建任务（同一批中相同的参数只生成一次）
+        safe_email = current_user['email'].replace('@', '_').replace('.', '_')
+        timestamp = int(datetime.datetime.now().timestamp())
+        results, rows, jobs, by_key = [], [], [], {}
+        required_points = 0
+        for index, ((params, quote), request_key) in enumerate(zip(param_sets, request_keys)):
+            if request_key is not None and request_key in by_key:
+                results.append(dict(by_key[request_key], cached=True, points_consumed=0))
+                continue
+            cached, own = pick_reusable_task(cached_tasks.get(request_key, []), current_user['id'])
+            if cached:
+                if not own:
+                    rows.append(dict(
+                        params, prompt_id=cached['prompt_id'], image_path=image_path, points_consumed=0,
+                        status=cached['status'], template=DEFAULT_TEMPLATE, backend=cached['backend'],
+                        progress=cached['progress'], output_path=cached['output_path'],
+                        started_at=cached['started_at'], completed_at=cached['completed_at'],
+                        request_key=request_key, attached=1))
+                result = {'prompt_id': cached['prompt_id'], 'status': cached['status'],
+                          'cached': True, 'points_consumed': 0}
+            else:
+                prompt_id = str(uuid.uuid4())
+                filename_prefix = f"video/{safe_email}_{timestamp}_{index}"
+                rows.append(dict(
+                    params, prompt_id=prompt_id, image_path=image_path, points_consumed=quote['points'],
+                    status='queued', filename_prefix=filename_prefix, template=DEFAULT_TEMPLATE,
+                    progress=0, request_key=request_key, attached=0))
+                jobs.append(SubmissionJob(prompt_id, current_user['id'], dict(
+                    params, template=DEFAULT_TEMPLATE, image_path=image_path, filename_prefix=filename_prefix)))
+                required_points += quote['points']
+                result = {'prompt_id': prompt_id, 'status': 'queued', 'cached': False,
+                          'points_consumed': quote['points'], 'estimated_gpu_seconds': quote['gpu_seconds']}
+            if request_key is not None:
+                by_key[request_key] = result
+            results.append(result)
+
+        # 积分预检（基于令牌中的积分快照，不足时再读缓存中的余额，最终以数据库的原子扣减为准）
+        user_points = current_user['points']
+        if user_points < required_points:
+            user_points = current_points(current_user)
+        if user_points < required_points:
+            return jsonify({
+                'message': '积分不足，无法生成视频',
+                'current_points': user_points,
+                'required_points': required_points
+            }), 402
+        # 队列放不下整批任务时直接拒绝，避免扣积分后才发现无法排队
+        if jobs and dispatcher.qsize() + len(jobs) > COMFYUI_QUEUE_SIZE:
+            return jsonify({'message': '当前排队任务过多，请稍后重试'}), 429
+        if jobs and scheduler.room(current_user['id']) < len(jobs):
+            return jsonify({'message': '您的排队任务过多，请等待已提交的任务开始执行或减少参数组数'}), 429
+
+        # 5. 一次扣除全部积分并写入全部任务记录（同一事务）
+        if rows:
+            with metrics.span('reserve'):
+                status, remaining_points = db.reserve_video_tasks(current_user['id'], required_points, rows)
+            if status != 'ok':
+                if status == 'insufficient':
+                    return jsonify({
+                        'message': '积分不足，无法生成视频',
+                        'required_points': required_points
+                    }), 402
+                print(f"警告：用户 {current_user['id']} 批量积分扣减失败")
+                return jsonify({'message': '积分扣减失败，请重试'}), 500
+        else:
+            remaining_points = current_points(current_user)
+
+        # 6. 新任务一起入队
+        if jobs:
+            lane = scheduler.lane_for(remaining_points + required_points)
+            for job in jobs:
+                job.lane = lane
+            try:
+                with metrics.span('enqueue'):
+                    dispatcher.enqueue_many(jobs)
+            except QueueFullError:
+                for job in jobs:
+                    on_job_failed(job, '提交队列已满')
+                return jsonify({'message': '当前排队任务过多，请稍后重试'}), 429
+            for result in results:
+                if not result['cached']:
+                    result.update(scheduler.position(result['prompt_id']) or {})
+
+        completed = all(result['status'] == 'completed' for result in results)
+        return jsonify({
+            'message': '批量生成任务已提交' if jobs else '相同的视频已生成或正在生成，直接复用结果',
+            'tasks': results,
+            'points_consumed': required_points,
+            'remaining_points': remaining_points
+        }), 200 if completed else 202
+
+    except Exception as e:
+        print(f'批量生成接口错误: {str(e)}')
+        return jsonify({'message': '服务器内部错误'}), 500
+
+
 # 新增接口：查询用户积分
 @app.route('/api/user/points', methods=['GET'])
 @token_required
 def get_user_points(current_user):
     return jsonify({
         'user_id': current_user['id'],
-        'points': current_user['points']
+        'points': current_points(current_user)
+    }), 200
+
+
+# 新增接口：生成前查询价格（与生成接口使用同一计费模型）
+@app.route('/api/pricing/quote', methods=['GET'])
+def pricing_quote():
+    template_name = request.args.get('template') or DEFAULT_TEMPLATE
+    if template_name not in templates.names():
+        return jsonify({'message': f'未知的模板: {template_name}'}), 400
+    try:
+        width = int(request.args['width'])
+        height = int(request.args['height'])
+        length = int(request.args['length'])
+    except (KeyError, ValueError):
+        return jsonify({'message': '参数格式错误，宽度/高度/长度必须为整数'}), 400
+    try:
+        quote = pricing.quote(template_name, width, height, length)
+    except PricingError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify({
+        'template': template_name,
+        'required_points': quote['points'],
+        'estimated_gpu_seconds': quote['gpu_seconds']
     }), 200
 
 
-# 新增接口：查询用户任务历史
+def parse_date_arg(name):
+    """解析日期查询参数（2024-01-01 或 2024-01-01T12:00:00），未提供时返回 None，格式错误抛 ValueError"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'参数格式错误: {name}')
+
+
+# 新增接口：查询用户任务历史（游标分页）
 @app.route('/api/user/tasks', methods=['GET'])
 @token_required
 def get_user_tasks(current_user):
-    tasks = db.get_user_video_tasks(current_user['id'])
-    return jsonify({'tasks': tasks}), 200
+    """
+    查询参数：limit 每页条数（默认20，最多100）、cursor 上一页返回的 next_cursor、
+    status 任务状态、since / until 创建时间范围
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', TASK_PAGE_SIZE)), 1), TASK_PAGE_MAX)
+    except ValueError:
+        return jsonify({'message': '参数格式错误: limit'}), 400
+    status = request.args.get('status') or None
+    if status and status not in db.TASK_STATUSES:
+        return jsonify({'message': f'无效的任务状态: {status}'}), 400
+    try:
+        since = parse_date_arg('since')
+        until = parse_date_arg('until')
+        tasks, next_cursor = db.get_user_video_tasks(
+            current_user['id'],
+            limit=limit,
+            cursor=request.args.get('cursor') or None,
+            status=status,
+            since=since,
+            until=until
+        )
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify({'tasks': tasks, 'next_cursor': next_cursor}), 200
+
+
+# 新增接口：查询单个任务状态
+@app.route('/api/tasks/<prompt_id>', methods=['GET'])
+@token_required
+def get_task(current_user, prompt_id):
+    task = db.get_video_task(prompt_id, current_user['id'])
+    if not task:
+        return jsonify({'message': '任务不存在'}), 404
+    if task['status'] == 'queued':
+        task.update(scheduler.position(prompt_id) or {})
+    return jsonify({'task': task}), 200
+
+
+def sse_event(data):
+    """格式化一条SSE消息（时间字段转为字符串）"""
+    return f"data: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+# 新增接口：订阅任务进度（Server-Sent Events）
+@app.route('/api/tasks/<prompt_id>/events', methods=['GET'])
+@token_required
+def task_events_stream(current_user, prompt_id):
+    """
+    推送任务状态变化，任务结束（completed/failed）后关闭连接
+
+    先订阅再查库，避免两者之间的状态变化丢失；之后只等待内存中的推送，不再访问数据库。
+    连接空闲时只占用一个阻塞在队列上的线程/协程，使用 gevent worker 时单进程即可挂住大量订阅者。
+    """
+    subscription = task_events.subscribe(prompt_id)
+    task = db.get_video_task(prompt_id, current_user['id'])
+    if not task:
+        subscription.close()
+        return jsonify({'message': '任务不存在'}), 404
+
+    # 数据库中的状态按批写入，可能落后于内存中的最新状态
+    snapshot = dict(task)
+    snapshot.update(task_events.state(prompt_id) or {})
+    if snapshot['status'] == 'queued':
+        snapshot.update(scheduler.position(prompt_id) or {})
+
+    def stream():
+        try:
+            yield f"retry: 3000\n{sse_event(snapshot)}"
+            if snapshot['status'] in TERMINAL_STATUSES:
+                return
+            while True:
+                event = subscription.get(timeout=SSE_HEARTBEAT)
+                if event is None:
+                    yield ': keep-alive\n\n'  # 注释行，客户端忽略；写入失败说明客户端已断开
+                    continue
+                event['prompt_id'] = prompt_id
+                yield sse_event(event)
+                if event.get('status') in TERMINAL_STATUSES:
+                    return
+        finally:
+            subscription.close()
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 关闭nginx的响应缓冲，事件立即送达
+    })
+
+
+# 新增接口：结果视频、封面、低码率预览（支持Range请求和ETag/Last-Modified缓存校验）
+@app.route('/api/tasks/<prompt_id>/<any(video, poster, preview):kind>', methods=['GET'])
+@token_required
+def task_media(current_user, prompt_id, kind):
+    task = db.get_video_task_output(prompt_id, current_user['id'])
+    if not task:
+        return jsonify({'message': '任务不存在'}), 404
+    if task['status'] != 'completed':
+        return jsonify({'message': '任务尚未完成', 'status': task['status']}), 409
+
+    if kind == 'video':
+        path = media.video_path(task)
+    else:
+        path = media.derived_path(prompt_id, POSTER_NAME if kind == 'poster' else PREVIEW_NAME)
+    if path is None:
+        return jsonify({'message': '文件不存在或仍在处理中'}), 404
+
+    # conditional=True 时 Werkzeug 处理 Range/If-None-Match/If-Modified-Since；
+    # 完整响应交给 WSGI 服务器的 file_wrapper（gunicorn 会用 sendfile 零拷贝发送）
+    response = send_file(os.path.abspath(path), conditional=True, etag=True, max_age=MEDIA_MAX_AGE)
+    response.cache_control.public = False
+    response.cache_control.private = True  # 需要登录才能访问，不允许共享缓存保存
+    return response
+
+
+# 监控指标（Prometheus 文本格式）
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'message': '令牌缺失或无效'}), 401
+    return Response(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# 存活检查：进程能处理请求即返回200
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({'status': 'ok'}), 200
+
+
+# 就绪检查：启动预热的必需步骤全部成功后返回200，之前返回503（负载均衡据此决定是否转发请求）
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    state = warmup.describe()
+    return jsonify(state), 200 if state['ready'] else 503
 
 
 # 首页路由
@@ -291,9 +1114,75 @@ def index():
     return render_template('index.html')
 
 
-# 初始化数据库
-with app.app_context():
-    db.init_db()
+def warm_database():
+    """执行数据库迁移（AUTO_MIGRATE，生产环境由 migrate.py 在部署时执行一次）并预先建立连接"""
+    if AUTO_MIGRATE:
+        with app.app_context():
+            if not db.init_db():
+                raise RuntimeError('数据库迁移失败')
+    db.get_pool().prefill(WARMUP_DB_CONNECTIONS)
+
+
+def warm_templates():
+    """检查模板文件并生成一次请求体，第一个请求不再经过冷路径"""
+    for name in templates.names():
+        templates.get(name).build_payload({}, prompt_id='warmup')
+
+
+def warm_backends():
+    """探测全部ComfyUI后端，建立长连接并取得队列和已加载模型"""
+    if not backend_pool.poll_all():
+        raise ConnectionError('没有可连接的ComfyUI后端')
+
+
+recovered = set()  # 已完成的恢复阶段（失败重试时跳过已完成的阶段，避免重复跟踪或重复入队）
+
+
+def recover_tasks():
+    """
+    恢复上次退出时仍在执行中（恢复状态跟踪）和仍在排队（重新入队）的任务，之后启动状态跟踪和提交线程
+
+    数据库不可用时抛异常，由预热按间隔重试；恢复完成之前 /readyz 返回503。
+    """
+    if 'active' not in recovered:
+        dedicated_urls = {b.url for b in backend_pool.backends if b.dedicated_models is not None}
+        for active_task in db.get_active_video_tasks():
+            tracker.track(active_task['prompt_id'], active_task['backend'], active_task['status'])
+            scheduler.mark_inflight(active_task['prompt_id'], active_task['user_id'],
+                                    TEXT_POOL if active_task['backend'] in dedicated_urls else None)
+        recovered.add('active')
+    if 'queued' not in recovered:
+        # 这些任务已扣积分、入队时已通过排队上限检查，恢复时不再受上限限制
+        for queued_task in db.get_queued_video_tasks():
+            job = job_from_task(queued_task)
+            try:
+                dispatcher.restore([job])
+            except QueueFullError as e:
+                on_job_failed(job, f'服务重启后无法恢复排队: {e}')
+        recovered.add('queued')
+    tracker.start()
+    dispatcher.start()
+
+
+# 启动预热：数据库、令牌吊销列表、模板、ComfyUI和任务恢复并行执行，最多等待 WARMUP_TIMEOUT 秒，
+# 数据库不可用时进程照常启动，必需步骤在后台重试，/readyz 在全部完成前返回503
+warmup = Warmup()
+warmup.add('database', warm_database)
+warmup.add('revocations', token_revocations.sync)
+warmup.add('templates', warm_templates)
+warmup.add('comfyui', warm_backends, required=False)  # 后端暂时不可用时任务照常排队
+warmup.add('recovery', recover_tasks)
+warmup.run()
+metrics.registry.add_stats('videogenius_warmup', warmup.stats)
+
+# 启动后端探测和后台线程（状态跟踪和提交线程由 recovery 步骤在任务恢复完成后启动）
+backend_pool.start()
+media.start()
+storage_manager.start()
+token_revocations.start()
+pricing.start()
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # 调度器、跟踪器等后台线程在导入时启动；关闭重载器，避免重载子进程再启动一套，造成重复提交和重复跟踪
+    password_hasher.start()  # 导入 app 时不创建哈希进程，由启动入口在处理请求前创建
+    app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""
+压测用的假ComfyUI服务器
+
+实现本服务用到的接口（/prompt、/upload/image、/queue、/system_stats、/history、/view），
+可配置每个请求的延迟、/prompt 的失败率和任务的执行时长，不需要GPU。
+
+单独运行：
+    python -m bench.fake_comfyui --port 8188 --latency 0.05 --failure-rate 0.1 --exec-seconds 5
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FAKE_VIDEO = b'\x00\x00\x00\x18ftypmp42' + b'\x00' * 64 * 1024  # /view 返回的假视频内容
+
+
+class FakeComfyUIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持长连接，与 KeepAliveClient 的行为一致
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if not server.available:
+            return self._send_json(503, {'error': 'fake outage'})
+        server.sleep()
+        path = urlsplit(self.path).path
+        if path == '/prompt':
+            if random.random() < server.failure_rate:
+                server.count('prompt_failed')
+                return self._send_json(500, {'error': 'fake failure'})
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return self._send_json(400, {'error': 'invalid json'})
+            prompt_id = data.get('prompt_id') or str(uuid.uuid4())
+            server.add_prompt(prompt_id)
+            return self._send_json(200, {'prompt_id': prompt_id, 'number': server.counts['prompt'], 'node_errors': {}})
+        if path == '/upload/image':
+            server.count('upload')
+            return self._send_json(200, {'name': f'{uuid.uuid4().hex}.png', 'subfolder': '', 'type': 'input'})
+        self._send_json(404, {'error': 'not found'})
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        if not server.available:
+            return self._send_json(503, {'error': 'fake outage'})
+        if parts.path in ('/queue', '/system_stats') and server.probe_delay:
+            time.sleep(server.probe_delay)
+        if parts.path == '/queue':
+            running, pending = server.queue_state()
+            return self._send_json(200, {
+                'queue_running': [[0, prompt_id] for prompt_id in running],
+                'queue_pending': [[i + 1, prompt_id] for i, prompt_id in enumerate(pending)]
+            })
+        if parts.path == '/system_stats':
+            return self._send_json(200, {'system': {}, 'devices': [
+                {'name': 'cuda:0 fake', 'vram_total': 24 << 30, 'vram_free': 20 << 30}]})
+        if parts.path.startswith('/history/'):
+            prompt_id = parts.path.rsplit('/', 1)[-1]
+            if not server.finished(prompt_id):
+                return self._send_json(200, {})
+            return self._send_json(200, {prompt_id: {
+                'status': {'status_str': 'success', 'completed': True, 'messages': []},
+                'outputs': {'108': {'images': [{'filename': f'{prompt_id}.mp4', 'subfolder': 'video', 'type': 'output'}]}}
+            }})
+        if parts.path == '/view':
+            server.sleep()
+            if not parse_qs(parts.query).get('filename'):
+                return self._send_json(400, {'error': 'missing filename'})
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Length', str(len(FAKE_VIDEO)))
+            self.end_headers()
+            self.wfile.write(FAKE_VIDEO)
+            return
+        self._send_json(404, {'error': 'not found'})
+
+
+class FakeComfyUIServer(ThreadingHTTPServer):
+    """
+    Args:
+        latency: 每个请求的固定延迟秒数
+        jitter: 在固定延迟上再加 0~jitter 秒的随机延迟
+        failure_rate: /prompt 返回500的概率
+        exec_seconds: 任务从提交到完成的秒数（按提交顺序串行执行，模拟单GPU）
+
+    available 设为 False 时所有请求返回503（模拟后端故障）；probe_delay 为 /queue、/system_stats 的额外延迟秒数
+    （模拟卡住的后端）。
+    """
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, jitter=0.0, failure_rate=0.0, exec_seconds=1.0):
+        super().__init__(address, FakeComfyUIHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.exec_seconds = exec_seconds
+        self.available = True
+        self.probe_delay = 0.0
+        self.counts = {'prompt': 0, 'prompt_failed': 0, 'upload': 0}
+        self._lock = threading.Lock()
+        self._done_at = {}  # prompt_id -> 预计完成时间
+        self._last_done = 0.0
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def sleep(self):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def add_prompt(self, prompt_id):
+        with self._lock:
+            self.counts['prompt'] += 1
+            self._last_done = max(self._last_done, time.monotonic()) + self.exec_seconds
+            self._done_at[prompt_id] = self._last_done
+
+    def finished(self, prompt_id):
+        with self._lock:
+            done_at = self._done_at.get(prompt_id)
+        return done_at is not None and done_at <= time.monotonic()
+
+    def queue_state(self):
+        now = time.monotonic()
+        with self._lock:
+            waiting = sorted((done_at, prompt_id) for prompt_id, done_at in self._done_at.items() if done_at > now)
+        prompt_ids = [prompt_id for _, prompt_id in waiting]
+        return prompt_ids[:1], prompt_ids[1:]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='fake-comfyui', daemon=True)
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description='假ComfyUI服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8188)
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的延迟秒数')
+    parser.add_argument('--jitter', type=float, default=0.0, help='随机附加延迟的上限秒数')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='/prompt 返回500的概率')
+    parser.add_argument('--exec-seconds', type=float, default=1.0, help='每个任务的执行秒数')
+    args = parser.parse_args()
+    server = FakeComfyUIServer((args.host, args.port), latency=args.latency, jitter=args.jitter,
+                               failure_rate=args.failure_rate, exec_seconds=args.exec_seconds)
+    print(f'假ComfyUI服务器已启动: {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,468 @@
+"""
+接口压测：登录、令牌验证、视频生成、任务历史在不同并发数下的吞吐量和延迟（p50/p95/p99）
+
+ComfyUI用假服务器（bench/fake_comfyui.py）代替；MySQL默认用docker启动一个数据目录在tmpfs（内存）中的临时容器，
+也可以用 --mysql-host 等参数指定已有的测试库（会在其中建表、写入压测数据，不要指向生产库）。
+应用默认在本进程内用多线程WSGI服务器启动（--server gevent 时在子进程中运行 serve.py，便于对比两种部署方式），
+客户端经HTTP长连接发送请求。
+
+结果保存为JSON（默认 bench/results/<git提交>.json），指定 --baseline 时与基线对比，
+p95延迟变长或吞吐量下降超过 --threshold 时视为性能回退，退出码为1。
+
+    python bench/run.py --concurrency 1,8,32 --requests 200
+    python bench/run.py --baseline bench/results/baseline.json
+"""
+import argparse
+import datetime
+import http.client
+import json
+import math
+import os
+import platform
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from bench.fake_comfyui import FakeComfyUIServer  # noqa: E402
+
+ENDPOINTS = ('login', 'verify-token', 'generate-video', 'user-tasks')
+MYSQL_IMAGE = 'mysql:8.0'
+BENCH_PASSWORD = 'bench-password'
+
+
+# ---- 测试环境 ----
+
+def start_mysql_container():
+    """启动数据目录在tmpfs中的临时MySQL容器，返回 (容器ID, 端口)"""
+    container_id = subprocess.check_output([
+        'docker', 'run', '-d', '--rm',
+        '-e', f'MYSQL_ROOT_PASSWORD={BENCH_PASSWORD}',
+        '-p', '127.0.0.1::3306',
+        '--tmpfs', '/var/lib/mysql',
+        MYSQL_IMAGE
+    ], text=True).strip()
+    mapping = subprocess.check_output(['docker', 'port', container_id, '3306/tcp'], text=True)
+    port = int(mapping.splitlines()[0].rsplit(':', 1)[1])
+    return container_id, port
+
+
+def wait_for_mysql(host, port, user, password, timeout=120):
+    import pymysql
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            pymysql.connect(host=host, port=port, user=user, password=password).close()
+            return
+        except pymysql.MySQLError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(1)
+
+
+def run_migrations():
+    """在子进程中执行 migrate.py 建库建表（使用当前环境变量中的MySQL配置）"""
+    subprocess.run([sys.executable, os.path.join(ROOT_DIR, 'migrate.py')], cwd=ROOT_DIR, check=True)
+
+
+def start_thread_server():
+    """在本进程内用多线程WSGI服务器启动应用（配置已写入环境变量），返回 (host, port, stop)"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import app as app_module
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass  # 每个请求打印一行日志会影响测得的延迟
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    host, port = server.server_address[:2]
+    return host, port, server.shutdown
+
+
+def start_gevent_server(timeout=60):
+    """在子进程中用 serve.py（gevent）启动应用，返回 (host, port, stop)"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    env = dict(os.environ, HOST='127.0.0.1', PORT=str(port))
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, 'serve.py')], cwd=ROOT_DIR, env=env)
+
+    def stop():
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    # 等到 /readyz 返回200（预热完成）再开始压测
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f'serve.py 启动失败，退出码 {process.returncode}')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/readyz')
+            ready = conn.getresponse().status == 200
+            conn.close()
+        except OSError:
+            ready = False
+        if ready:
+            return '127.0.0.1', port, stop
+        if time.monotonic() > deadline:
+            stop()
+            raise RuntimeError(f'serve.py 在{timeout}秒内未就绪')
+        time.sleep(0.2)
+
+
+def scrape_gauges(host, port, prefixes):
+    """从 /metrics 读取指定前缀的指标当前值"""
+    status, data = Client(host, port).request('GET', '/metrics')
+    values = {}
+    if status != 200:
+        return values
+    for line in data.decode('utf-8').splitlines():
+        if line.startswith(prefixes):
+            name, _, value = line.rpartition(' ')
+            values[name] = float(value)
+    return values
+
+
+def make_png(width=640, height=640):
+    """生成一张纯色PNG（上传接口会校验图片头和尺寸）"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    row = b'\x00' + b'\x80\x80\x80' * width
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(row * height))
+            + chunk(b'IEND', b''))
+
+
+def multipart(fields, file_field, filename, content):
+    boundary = uuid.uuid4().hex
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode('utf-8')
+             for key, value in fields.items()]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                 f'Content-Type: image/png\r\n\r\n'.encode('utf-8') + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    """一个压测线程使用的HTTP长连接"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.conn.request(method, path, body=body, headers=headers or {})
+                response = self.conn.getresponse()
+                data = response.read()
+                if response.will_close:
+                    self.conn.close()
+                    self.conn = None
+                return response.status, data
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+    def json(self, method, path, obj=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if obj is not None:
+            body = json.dumps(obj).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        status, data = self.request(method, path, body, headers)
+        return status, json.loads(data) if data else None
+
+
+# ---- 压测 ----
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # 最近秩法：不小于 p% 样本的最小值
+    index = min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    counts = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    errors = sum(1 for status in statuses if status is None or status >= 500)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        'requests': len(statuses),
+        'errors': errors,
+        'status_counts': counts,
+        'throughput_rps': round(len(statuses) / elapsed, 1) if elapsed > 0 else None,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+    }
+
+
+def run_level(host, port, concurrency, total, make_request):
+    """
+    concurrency 个线程共发送 total 个请求
+
+    Args:
+        make_request: make_request(client, worker_index, request_index) -> 状态码
+    """
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+    counter = iter(range(total))
+    start_barrier = threading.Barrier(concurrency + 1)
+
+    def worker(worker_index):
+        client = Client(host, port)
+        start_barrier.wait()
+        while True:
+            with lock:
+                request_index = next(counter, None)
+            if request_index is None:
+                return
+            started = time.perf_counter()
+            try:
+                status = make_request(client, worker_index, request_index)
+            except Exception as e:
+                print(f'请求失败: {e}')
+                status = None
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses.append(status)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+def build_scenarios(users, image):
+    """各接口的请求函数；users: [(email, password, token)]，每个压测线程使用自己的用户"""
+
+    def login(client, worker, i):
+        email, password, _ = users[worker]
+        return client.json('POST', '/api/login', {'email': email, 'password': password})[0]
+
+    def verify_token(client, worker, i):
+        return client.json('POST', '/api/verify-token', {'token': users[worker][2]})[0]
+
+    def generate_video(client, worker, i):
+        body, content_type = multipart({
+            'positive_prompt': f'bench {worker} {i} {uuid.uuid4().hex}',  # 提示词不同，不命中结果缓存
+            'negative_prompt': '',
+            'width': '640', 'height': '640', 'length': '81', 'fps': '16'
+        }, 'image', 'bench.png', image)
+        return client.request('POST', '/api/generate-video', body, {
+            'Content-Type': content_type,
+            'Authorization': f'Bearer {users[worker][2]}'
+        })[0]
+
+    def user_tasks(client, worker, i):
+        return client.request('GET', '/api/user/tasks?limit=20',
+                              headers={'Authorization': f'Bearer {users[worker][2]}'})[0]
+
+    return {
+        'login': login,
+        'verify-token': verify_token,
+        'generate-video': generate_video,
+        'user-tasks': user_tasks,
+    }
+
+
+def create_users(client, count):
+    users = []
+    run_id = uuid.uuid4().hex[:8]
+    for i in range(count):
+        email = f'bench_{run_id}_{i}@example.com'
+        password = 'bench-password'
+        status, _ = client.json('POST', '/api/register', {
+            'name': f'bench{i}', 'email': email, 'password': password, 'initial_points': 10 ** 9})
+        if status != 201:
+            raise RuntimeError(f'创建压测用户失败: {status}')
+        status, data = client.json('POST', '/api/login', {'email': email, 'password': password})
+        if status != 200:
+            raise RuntimeError(f'压测用户登录失败: {status}')
+        users.append((email, password, data['token']))
+    return users
+
+
+# ---- 基线对比 ----
+
+def compare(results, baseline, threshold):
+    """返回性能回退列表：p95延迟变长或吞吐量下降超过 threshold（比例）"""
+    regressions = []
+    for endpoint, levels in results['endpoints'].items():
+        for concurrency, current in levels.items():
+            previous = baseline.get('endpoints', {}).get(endpoint, {}).get(concurrency)
+            if not previous:
+                continue
+            if previous.get('p95_ms') and current.get('p95_ms') and \
+                    current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+                regressions.append(f"{endpoint} 并发{concurrency}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+            if previous.get('throughput_rps') and current.get('throughput_rps') and \
+                    current['throughput_rps'] < previous['throughput_rps'] * (1 - threshold):
+                regressions.append(f"{endpoint} 并发{concurrency}: 吞吐量 "
+                                   f"{previous['throughput_rps']} -> {current['throughput_rps']} req/s")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_table(results):
+    print(f"{'接口':<16}{'并发':>6}{'请求':>8}{'错误':>6}{'req/s':>10}{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}")
+    for endpoint, levels in results['endpoints'].items():
+        for concurrency, r in levels.items():
+            print(f"{endpoint:<16}{concurrency:>6}{r['requests']:>8}{r['errors']:>6}{r['throughput_rps']!s:>10}"
+                  f"{r['p50_ms']!s:>10}{r['p95_ms']!s:>10}{r['p99_ms']!s:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='VideoGenius 接口压测')
+    parser.add_argument('--concurrency', default='1,8,32', help='并发数，逗号分隔')
+    parser.add_argument('--requests', type=int, default=200, help='每个接口每个并发数发送的请求数')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='压测的接口，逗号分隔')
+    parser.add_argument('--latency', type=float, default=0.02, help='假ComfyUI每个请求的延迟秒数')
+    parser.add_argument('--jitter', type=float, default=0.01, help='假ComfyUI随机附加延迟的上限秒数')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='假ComfyUI /prompt 的失败率')
+    parser.add_argument('--exec-seconds', type=float, default=0.5, help='假ComfyUI每个任务的执行秒数')
+    parser.add_argument('--server', choices=('thread', 'gevent'), default='thread',
+                        help='thread: 本进程内的多线程WSGI服务器；gevent: 子进程运行 serve.py')
+    parser.add_argument('--backends', type=int, default=2, help='假ComfyUI后端数')
+    parser.add_argument('--mysql-host', help='已有测试库的地址（不指定时用docker启动临时MySQL）')
+    parser.add_argument('--mysql-port', type=int, default=3306)
+    parser.add_argument('--mysql-user', default='root')
+    parser.add_argument('--mysql-password', default=BENCH_PASSWORD)
+    parser.add_argument('--mysql-db', default='videogenius_bench')
+    parser.add_argument('--output', help='结果文件（默认 bench/results/<git提交>.json）')
+    parser.add_argument('--baseline', help='对比的基线结果文件')
+    parser.add_argument('--threshold', type=float, default=0.2, help='判定为性能回退的变化比例')
+    args = parser.parse_args()
+
+    concurrency_levels = [int(value) for value in args.concurrency.split(',') if value.strip()]
+    endpoints = [value.strip() for value in args.endpoints.split(',') if value.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"未知接口: {', '.join(sorted(unknown))}")
+
+    backends = [FakeComfyUIServer(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                                  exec_seconds=args.exec_seconds).start() for _ in range(args.backends)]
+
+    container_id = None
+    if args.mysql_host:
+        mysql_host, mysql_port, mysql_password = args.mysql_host, args.mysql_port, args.mysql_password
+    else:
+        print(f'启动临时MySQL容器（{MYSQL_IMAGE}，数据在tmpfs中）...')
+        container_id, mysql_port = start_mysql_container()
+        mysql_host, mysql_password = '127.0.0.1', BENCH_PASSWORD
+    work_dir = tempfile.mkdtemp(prefix='videogenius-bench-')
+
+    try:
+        wait_for_mysql(mysql_host, mysql_port, args.mysql_user, mysql_password)
+
+        # app 在导入时读取配置：排队上限放宽到不影响压测，关闭结果缓存
+        os.environ.update({
+            'MYSQL_HOST': mysql_host,
+            'MYSQL_PORT': str(mysql_port),
+            'MYSQL_USER': args.mysql_user,
+            'MYSQL_PASSWORD': mysql_password,
+            'MYSQL_DB': args.mysql_db,
+            'COMFYUI_URLS': ','.join(backend.url for backend in backends),
+            'COMFYUI_TRANSFER_MODE': 'upload',
+            'COMFYUI_QUEUE_SIZE': '1000000',
+            'SCHEDULER_USER_MAX_QUEUED': '1000000',
+            'RESULT_CACHE_TTL': '0',
+            'AUTO_MIGRATE': '0',  # 已由 run_migrations 建表
+            # 登录限流放宽到不影响压测，测得的是密码哈希进程池的实际容量
+            'LOGIN_IP_RATE': '1000000', 'LOGIN_IP_BURST': '1000000',
+            'LOGIN_EMAIL_RATE': '1000000', 'LOGIN_EMAIL_BURST': '1000000',
+            'MEDIA_DIR': os.path.join(work_dir, 'media'),
+            'UPLOAD_FOLDER': os.path.join(work_dir, 'upload'),
+        })
+        run_migrations()
+        if args.server == 'gevent':
+            host, port, stop_server = start_gevent_server()
+        else:
+            host, port, stop_server = start_thread_server()
+
+        users = create_users(Client(host, port), max(concurrency_levels))
+        scenarios = build_scenarios(users, make_png())
+
+        results = {
+            'revision': git_revision(),
+            'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': {key: value for key, value in vars(args).items() if not key.startswith('mysql')},
+            'endpoints': {},
+        }
+        for endpoint in endpoints:
+            for concurrency in concurrency_levels:
+                print(f'压测 {endpoint}，并发 {concurrency}...')
+                summary = run_level(host, port, concurrency, args.requests, scenarios[endpoint])
+                results['endpoints'].setdefault(endpoint, {})[str(concurrency)] = summary
+        results['app_stats'] = scrape_gauges(host, port, ('videogenius_dispatcher_', 'videogenius_scheduler_',
+                                                          'videogenius_db_pool_'))
+        results['app_stats']['fake_comfyui'] = [backend.counts for backend in backends]
+        stop_server()
+    finally:
+        if container_id:
+            subprocess.run(['docker', 'stop', container_id], stdout=subprocess.DEVNULL, check=False)
+
+    print_table(results)
+    output = args.output or os.path.join(ROOT_DIR, 'bench', 'results', f"{results['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f'结果已保存: {output}')
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"相对基线 {baseline.get('revision')} 的性能回退:")
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print(f"与基线 {baseline.get('revision')} 相比没有性能回退")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    线程安全的进程内 LRU + TTL 缓存
+
+    Args:
+        maxsize: 最多缓存条数，超出后淘汰最久未使用的
+        ttl: 过期秒数
+    """
+
+    def __init__(self, maxsize=10000, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (过期时间, 值)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class UserCache:
+    """
+    用户信息两级缓存：进程内 TTLCache + 可选的共享缓存（Redis 或兼容 get/setex/delete 的替身）
+
+    缓存的用户字典不含密码哈希。多进程部署时共享层在积分变化后被显式删除，
+    其他进程的本地缓存最多在 local_ttl 秒后过期。
+    """
+
+    def __init__(self, local_ttl=30, maxsize=10000, shared=None, shared_ttl=300, prefix='user:'):
+        self.local = TTLCache(maxsize=maxsize, ttl=local_ttl)
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+        self.loads = 0
+
+    def get(self, user_id, loader):
+        """
+        读取用户：本地缓存 -> 共享缓存 -> loader(user_id)（通常是查数据库）
+
+        loader 返回 None（用户不存在）时不缓存。
+        """
+        user = self.local.get(user_id)
+        if user is not None:
+            return dict(user)
+
+        if self.shared is not None:
+            user = self._shared_get(user_id)
+            if user is not None:
+                self.local.set(user_id, user)
+                return dict(user)
+
+        with self._lock:
+            self.loads += 1
+        user = loader(user_id)
+        if user is None:
+            return None
+        user = {key: value for key, value in user.items() if key != 'password'}
+        self.local.set(user_id, user)
+        if self.shared is not None:
+            self._shared_set(user_id, user)
+        return dict(user)
+
+    def invalidate(self, user_id):
+        """用户信息（如积分）变化后调用"""
+        self.local.delete(user_id)
+        if self.shared is not None:
+            try:
+                self.shared.delete(f'{self.prefix}{user_id}')
+            except Exception as e:
+                self._shared_error(e)
+
+    def _shared_get(self, user_id):
+        try:
+            raw = self.shared.get(f'{self.prefix}{user_id}')
+        except Exception as e:
+            self._shared_error(e)
+            return None
+        with self._lock:
+            if raw is None:
+                self.shared_misses += 1
+                return None
+            self.shared_hits += 1
+        return json.loads(raw)
+
+    def _shared_set(self, user_id, user):
+        try:
+            self.shared.setex(f'{self.prefix}{user_id}', self.shared_ttl, json.dumps(user, default=str))
+        except Exception as e:
+            self._shared_error(e)
+
+    def _shared_error(self, e):
+        with self._lock:
+            self.shared_errors += 1
+        print(f'共享用户缓存访问失败: {e}')
+
+    def stats(self):
+        stats = {'local': self.local.stats(), 'loads': self.loads}
+        if self.shared is not None:
+            stats['shared'] = {
+                'hits': self.shared_hits,
+                'misses': self.shared_misses,
+                'errors': self.shared_errors,
+            }
+        return stats
+
+
+def connect_shared_cache(url):
+    """按 REDIS_URL 连接共享缓存；未配置或未安装 redis 包时返回 None（只用进程内缓存）"""
+    if not url:
+        return None
+    try:
+        import redis
+    except ImportError:
+        print('未安装redis包，用户缓存仅使用进程内缓存')
+        return None
+    return redis.Redis.from_url(url, socket_timeout=0.5)
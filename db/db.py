@@ -1,19 +1,52 @@
 import pymysql
 from pymysql.cursors import DictCursor
+import base64
+import binascii
+import datetime
 import os
+import threading
+import time
 from werkzeug.security import generate_password_hash
 
+from db.cache import UserCache, connect_shared_cache
+from db.pool import ConnectionPool
+from metrics import timed_query  # 每个查询函数的耗时计入 /metrics
+
 # 数据库配置
 MYSQL_HOST = os.environ.get('MYSQL_HOST') or 'localhost'
+MYSQL_PORT = int(os.environ.get('MYSQL_PORT') or 3306)
 MYSQL_USER = os.environ.get('MYSQL_USER') or 'root'
 MYSQL_PASSWORD = os.environ.get('MYSQL_PASSWORD') or 'ccl123654789*'
 MYSQL_DB = os.environ.get('MYSQL_DB') or 'videogenius'
 
+# 连接池配置
+MYSQL_POOL_SIZE = int(os.environ.get('MYSQL_POOL_SIZE') or 10)  # 每个数据库最多连接数
+MYSQL_POOL_TIMEOUT = float(os.environ.get('MYSQL_POOL_TIMEOUT') or 10)  # 等待空闲连接的超时秒数
+MYSQL_POOL_RECYCLE = int(os.environ.get('MYSQL_POOL_RECYCLE') or 3600)  # 空闲连接回收秒数
+MYSQL_POOL_PING_INTERVAL = int(os.environ.get('MYSQL_POOL_PING_INTERVAL') or 30)  # 空闲多久后借出前先ping
 
-def get_db_connection(db_name=MYSQL_DB):
-    """获取数据库连接"""
+# 用户缓存配置（REDIS_URL 为空时只用进程内缓存）
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 30)  # 进程内缓存秒数
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 10000)  # 进程内缓存条数
+USER_CACHE_SHARED_TTL = int(os.environ.get('USER_CACHE_SHARED_TTL') or 300)  # 共享缓存秒数
+REDIS_URL = os.environ.get('REDIS_URL')
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+user_cache = UserCache(
+    local_ttl=USER_CACHE_TTL,
+    maxsize=USER_CACHE_SIZE,
+    shared=connect_shared_cache(REDIS_URL),
+    shared_ttl=USER_CACHE_SHARED_TTL
+)
+
+
+def create_raw_connection(db_name=MYSQL_DB):
+    """新建一个不经过连接池的数据库连接"""
     return pymysql.connect(
         host=MYSQL_HOST,
+        port=MYSQL_PORT,
         user=MYSQL_USER,
         password=MYSQL_PASSWORD,
         db=db_name,
@@ -22,11 +55,54 @@ def get_db_connection(db_name=MYSQL_DB):
     )
 
 
+def get_pool(db_name=MYSQL_DB):
+    """获取（必要时创建）指定数据库的连接池"""
+    pool = _pools.get(db_name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_name)
+            if pool is None:
+                pool = ConnectionPool(
+                    lambda: create_raw_connection(db_name),
+                    max_size=MYSQL_POOL_SIZE,
+                    timeout=MYSQL_POOL_TIMEOUT,
+                    recycle=MYSQL_POOL_RECYCLE,
+                    ping_interval=MYSQL_POOL_PING_INTERVAL
+                )
+                _pools[db_name] = pool
+    return pool
+
+
+def set_pool(pool, db_name=MYSQL_DB):
+    """替换连接池（测试时可注入连接到本地MySQL容器或假连接的连接池）"""
+    with _pools_lock:
+        old = _pools.get(db_name)
+        _pools[db_name] = pool
+    if old is not None and old is not pool:
+        old.close_all()
+
+
+def get_db_connection(db_name=MYSQL_DB):
+    """从连接池借出数据库连接，close() 即归还"""
+    return get_pool(db_name).acquire()
+
+
+def get_pool_stats():
+    """各连接池的监控指标（借出数、等待时间等）"""
+    return {name: pool.stats() for name, pool in list(_pools.items())}
+
+
 def init_db():
-    """初始化数据库（创建库和表，新增积分字段）"""
+    """
+    初始化数据库（创建库和表，新增积分字段）；可重复执行，已存在的库、表、字段和索引不会改动
+
+    Returns:
+        是否成功
+    """
     # 先创建数据库（如果不存在）
     connection = pymysql.connect(
         host=MYSQL_HOST,
+        port=MYSQL_PORT,
         user=MYSQL_USER,
         password=MYSQL_PASSWORD,
         charset='utf8mb4',
@@ -71,12 +147,59 @@ def init_db():
                 length INT,
                 fps INT,
                 points_consumed INT NOT NULL DEFAULT 0,  # 新增：本次任务消耗的积分
-                status VARCHAR(20) DEFAULT 'pending',  # pending/running/completed/failed
+                status VARCHAR(20) DEFAULT 'pending',  # queued/pending/running/completed/failed
+                filename_prefix VARCHAR(255),  # 输出文件名前缀（排队任务重启后恢复提交用）
+                template VARCHAR(50),  # 使用的工作流模板名
+                backend VARCHAR(255),  # 执行任务的ComfyUI后端地址
+                progress INT NOT NULL DEFAULT 0,  # 执行进度（0-100）
+                output_path VARCHAR(255),  # ComfyUI输出目录下的结果文件（相对路径）
+                error VARCHAR(500),  # 失败原因
+                started_at DATETIME,  # 开始执行时间
+                completed_at DATETIME,  # 执行结束时间
+                request_key CHAR(64),  # 模板+图片哈希+规范化参数的哈希，相同请求复用结果
+                attached TINYINT(1) NOT NULL DEFAULT 0,  # 1 表示复用了同 prompt_id 任务的结果（不提交、不扣积分）
+                storage_tier VARCHAR(10) NOT NULL DEFAULT 'hot',  # 结果文件所在层级：hot/cold/expired
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users(id)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
             ''')
 
+            # 旧版本建的表补齐新增字段
+            _ensure_column(cursor, 'video_tasks', 'filename_prefix', 'VARCHAR(255) AFTER status')
+            _ensure_column(cursor, 'video_tasks', 'template', 'VARCHAR(50) AFTER filename_prefix')
+            _ensure_column(cursor, 'video_tasks', 'backend', 'VARCHAR(255) AFTER template')
+            _ensure_column(cursor, 'video_tasks', 'progress', 'INT NOT NULL DEFAULT 0 AFTER backend')
+            _ensure_column(cursor, 'video_tasks', 'output_path', 'VARCHAR(255) AFTER progress')
+            _ensure_column(cursor, 'video_tasks', 'error', 'VARCHAR(500) AFTER output_path')
+            _ensure_column(cursor, 'video_tasks', 'started_at', 'DATETIME AFTER error')
+            _ensure_column(cursor, 'video_tasks', 'completed_at', 'DATETIME AFTER started_at')
+            _ensure_column(cursor, 'video_tasks', 'request_key', 'CHAR(64) AFTER completed_at')
+            _ensure_column(cursor, 'video_tasks', 'attached', 'TINYINT(1) NOT NULL DEFAULT 0 AFTER request_key')
+            _ensure_column(cursor, 'video_tasks', 'storage_tier', "VARCHAR(10) NOT NULL DEFAULT 'hot' AFTER attached")
+            # 状态跟踪按 prompt_id 批量更新
+            _ensure_index(cursor, 'video_tasks', 'idx_prompt_id', '(prompt_id)')
+            # 任务历史按 (created_at, id) 游标翻页，可选按状态过滤；索引顺序即排序顺序，无需filesort
+            _ensure_index(cursor, 'video_tasks', 'idx_user_created', '(user_id, created_at, id)')
+            _ensure_index(cursor, 'video_tasks', 'idx_user_status_created', '(user_id, status, created_at, id)')
+            # 结果缓存按请求哈希查找
+            _ensure_index(cursor, 'video_tasks', 'idx_request_key', '(request_key, status)')
+            # 存储清理：按图片路径查引用，按层级和完成时间挑选要迁移/过期的结果
+            _ensure_index(cursor, 'video_tasks', 'idx_image_status', '(image_path, status)')
+            _ensure_index(cursor, 'video_tasks', 'idx_tier_completed', '(storage_tier, status, completed_at)')
+
+            # 令牌吊销表：jti 不为空时吊销单个令牌，为空时吊销该用户 revoked_at 之前签发的全部令牌
+            # 时间与令牌的 iat/exp 一样存为UTC秒数，由应用写入，不受MySQL会话时区影响
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS revoked_tokens (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                jti CHAR(32),
+                user_id INT,
+                revoked_at BIGINT NOT NULL,  # 吊销时间（UTC秒数）
+                expires_at BIGINT NOT NULL,  # 被吊销令牌的过期时间（UTC秒数），之后记录可以删除
+                INDEX idx_expires (expires_at)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            ''')
+
             # 创建默认管理员用户（初始化1000积分）
             cursor.execute('SELECT * FROM users WHERE email = %s', ('admin@example.com',))
             if not cursor.fetchone():
@@ -87,13 +210,38 @@ def init_db():
 
         connection.commit()
         print("数据库表结构（含积分功能）初始化完成")
+        return True
     except Exception as e:
         print(f"数据库初始化错误: {str(e)}")
         connection.rollback()
+        return False
     finally:
         connection.close()
 
 
+def _ensure_column(cursor, table, column, definition):
+    """字段不存在时追加（init_db 的增量迁移）"""
+    cursor.execute('''
+    SELECT 1 FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    ''', (MYSQL_DB, table, column))
+    if not cursor.fetchone():
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        print(f"表 {table} 新增字段 {column}")
+
+
+def _ensure_index(cursor, table, index, columns):
+    """索引不存在时创建（init_db 的增量迁移）"""
+    cursor.execute('''
+    SELECT 1 FROM INFORMATION_SCHEMA.STATISTICS
+    WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND INDEX_NAME = %s
+    ''', (MYSQL_DB, table, index))
+    if not cursor.fetchone():
+        cursor.execute(f'ALTER TABLE {table} ADD INDEX {index} {columns}')
+        print(f"表 {table} 新增索引 {index}")
+
+
+@timed_query
 def get_user_by_email(email):
     """通过邮箱查询用户（包含积分）"""
     connection = get_db_connection()
@@ -105,6 +253,7 @@ def get_user_by_email(email):
         connection.close()
 
 
+@timed_query
 def create_user(name, email, hashed_password, initial_points=0):
     """创建新用户（支持初始化积分，默认0）"""
     connection = get_db_connection()
@@ -123,6 +272,7 @@ def create_user(name, email, hashed_password, initial_points=0):
         connection.close()
 
 
+@timed_query
 def get_user_by_id(user_id):
     """通过ID查询用户（包含积分）"""
     connection = get_db_connection()
@@ -134,6 +284,36 @@ def get_user_by_id(user_id):
         connection.close()
 
 
+def get_cached_user(user_id):
+    """通过ID查询用户（优先读缓存，不含密码哈希）"""
+    return user_cache.get(user_id, get_user_by_id)
+
+
+def get_cache_stats():
+    """用户缓存命中/未命中计数"""
+    return user_cache.stats()
+
+
+@timed_query
+def update_user_password(user_id, hashed_password):
+    """更新密码哈希（登录时把旧方法的哈希升级为新方法）"""
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('''
+            UPDATE users SET password = %s WHERE id = %s
+            ''', (hashed_password, user_id))
+        connection.commit()
+        return cursor.rowcount > 0
+    except Exception as e:
+        print(f"更新用户密码错误: {str(e)}")
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+
+@timed_query
 def update_user_points(user_id, new_points):
     """更新用户积分（直接设置新值）"""
     connection = get_db_connection()
@@ -143,6 +323,7 @@ def update_user_points(user_id, new_points):
             UPDATE users SET points = %s WHERE id = %s
             ''', (new_points, user_id))
         connection.commit()
+        user_cache.invalidate(user_id)
         return cursor.rowcount > 0  # 成功更新返回True
     except Exception as e:
         print(f"更新用户积分错误: {str(e)}")
@@ -152,19 +333,21 @@ def update_user_points(user_id, new_points):
         connection.close()
 
 
+@timed_query
 def add_video_task(user_id, prompt_id, image_path, positive_prompt, negative_prompt,
-                   width, height, length, fps, points_consumed=0):
+                   width, height, length, fps, points_consumed=0, status='pending', filename_prefix=None,
+                   template=None):
     """添加视频任务记录（包含积分消耗）"""
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
             cursor.execute('''
-            INSERT INTO video_tasks 
-            (user_id, prompt_id, image_path, positive_prompt, negative_prompt, 
-             width, height, length, fps, points_consumed)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            INSERT INTO video_tasks
+            (user_id, prompt_id, image_path, positive_prompt, negative_prompt,
+             width, height, length, fps, points_consumed, status, filename_prefix, template)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             ''', (user_id, prompt_id, image_path, positive_prompt, negative_prompt,
-                  width, height, length, fps, points_consumed))
+                  width, height, length, fps, points_consumed, status, filename_prefix, template))
         connection.commit()
         return True
     except Exception as e:
@@ -175,17 +358,587 @@ def add_video_task(user_id, prompt_id, image_path, positive_prompt, negative_pro
         connection.close()
 
 
-def get_user_video_tasks(user_id):
-    """查询用户的视频任务（包含积分消耗记录）"""
+TASK_STATUSES = ('queued', 'pending', 'running', 'completed', 'failed')
+
+
+def encode_task_cursor(created_at, task_id):
+    """把一页最后一条任务的 (created_at, id) 编码为不透明的翻页游标"""
+    raw = f"{created_at.strftime('%Y-%m-%dT%H:%M:%S.%f')}|{task_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_task_cursor(value):
+    """解析翻页游标，格式错误时抛 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+        created_at, task_id = raw.split('|')
+        return datetime.datetime.strptime(created_at, '%Y-%m-%dT%H:%M:%S.%f'), int(task_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise ValueError('无效的翻页游标')
+
+
+@timed_query
+def get_user_video_tasks(user_id, limit=20, cursor=None, status=None, since=None, until=None):
+    """
+    分页查询用户的视频任务（包含积分消耗记录），按创建时间倒序
+
+    使用游标（上一页最后一条的 created_at, id）而不是 OFFSET 翻页，配合
+    (user_id, created_at, id) / (user_id, status, created_at, id) 索引，
+    每页只扫描 limit+1 行，与用户的历史任务总数无关。
+
+    Args:
+        limit: 每页条数
+        cursor: 上一页返回的 next_cursor，为空时从最新的任务开始
+        status: 只查该状态的任务
+        since / until: 创建时间范围 [since, until)
+
+    Returns:
+        (任务列表, 下一页游标；没有更多时为 None)
+    """
+    conditions = ['user_id = %s']
+    params = [user_id]
+    if status:
+        conditions.append('status = %s')
+        params.append(status)
+    if since:
+        conditions.append('created_at >= %s')
+        params.append(since)
+    if until:
+        conditions.append('created_at < %s')
+        params.append(until)
+    if cursor:
+        cursor_created_at, cursor_id = decode_task_cursor(cursor)
+        # 展开写法（而非行比较）保证 MySQL 各版本都能走索引范围扫描
+        conditions.append('(created_at < %s OR (created_at = %s AND id < %s))')
+        params.extend([cursor_created_at, cursor_created_at, cursor_id])
+
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as db_cursor:
+            db_cursor.execute(f'''
+            SELECT id, prompt_id, points_consumed, status, progress, created_at 
+            FROM video_tasks 
+            WHERE {' AND '.join(conditions)} 
+            ORDER BY created_at DESC, id DESC 
+            LIMIT %s
+            ''', params + [limit + 1])
+            tasks = db_cursor.fetchall()
+    finally:
+        connection.close()
+
+    # 多取一条用于判断是否还有下一页
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = encode_task_cursor(tasks[-1]['created_at'], tasks[-1]['id'])
+    return tasks, next_cursor
+
+
+@timed_query
+def reserve_video_task(user_id, points, prompt_id, image_path, positive_prompt, negative_prompt,
+                       width, height, length, fps, filename_prefix=None, template=None, request_key=None):
+    """
+    预扣积分并记录任务（同一连接、同一事务）
+
+    积分扣减是带条件的原子操作（points >= 所需积分才扣），同一用户并发请求不会超扣。
+    任务记录状态为 queued，提交到ComfyUI后调用 commit_video_task，失败时调用 refund_video_task。
+
+    Returns:
+        ('ok', 剩余积分) / ('insufficient', None) 积分不足 / ('error', None) 数据库错误
+    """
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
+            # LAST_INSERT_ID(expr) 让UPDATE顺带返回扣减后的余额，省去一次SELECT
             cursor.execute('''
-            SELECT id, prompt_id, points_consumed, status, created_at 
-            FROM video_tasks 
-            WHERE user_id = %s 
-            ORDER BY created_at DESC
-            ''', (user_id,))
+            UPDATE users SET points = LAST_INSERT_ID(points - %s)
+            WHERE id = %s AND points >= %s
+            ''', (points, user_id, points))
+            if cursor.rowcount == 0:
+                connection.rollback()
+                return 'insufficient', None
+            remaining_points = cursor.lastrowid
+
+            cursor.execute('''
+            INSERT INTO video_tasks
+            (user_id, prompt_id, image_path, positive_prompt, negative_prompt,
+             width, height, length, fps, points_consumed, status, filename_prefix, template, request_key)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'queued', %s, %s, %s)
+            ''', (user_id, prompt_id, image_path, positive_prompt, negative_prompt,
+                  width, height, length, fps, points, filename_prefix, template, request_key))
+        connection.commit()
+        user_cache.invalidate(user_id)
+        return 'ok', remaining_points
+    except Exception as e:
+        print(f"预扣积分错误: {str(e)}")
+        connection.rollback()
+        return 'error', None
+    finally:
+        connection.close()
+
+
+# reserve_video_tasks 每行任务记录的字段（attached=1 的行复用已有结果，不扣积分、不提交）
+BATCH_TASK_COLUMNS = ('prompt_id', 'image_path', 'positive_prompt', 'negative_prompt', 'width', 'height', 'length',
+                      'fps', 'points_consumed', 'status', 'filename_prefix', 'template', 'backend', 'progress',
+                      'output_path', 'started_at', 'completed_at', 'request_key', 'attached')
+
+
+@timed_query
+def reserve_video_tasks(user_id, points, tasks):
+    """
+    批量生成：一次扣除全部积分并插入全部任务记录（同一连接、同一事务）
+
+    Args:
+        points: 全部新任务所需积分之和
+        tasks: 任务记录列表，每条为 BATCH_TASK_COLUMNS 字段的字典（缺少的字段为 NULL）
+
+    Returns:
+        ('ok', 剩余积分) / ('insufficient', None) 积分不足 / ('error', None) 数据库错误
+    """
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            if points > 0:
+                cursor.execute('''
+                UPDATE users SET points = LAST_INSERT_ID(points - %s)
+                WHERE id = %s AND points >= %s
+                ''', (points, user_id, points))
+                if cursor.rowcount == 0:
+                    connection.rollback()
+                    return 'insufficient', None
+                remaining_points = cursor.lastrowid
+            else:
+                cursor.execute('SELECT points FROM users WHERE id = %s', (user_id,))
+                row = cursor.fetchone()
+                remaining_points = row['points'] if row else 0
+
+            # executemany 会把 INSERT ... VALUES 合并成一条多行 INSERT，N 条任务只有一次往返
+            placeholders = ', '.join(['%s'] * (len(BATCH_TASK_COLUMNS) + 1))
+            cursor.executemany(
+                f"INSERT INTO video_tasks (user_id, {', '.join(BATCH_TASK_COLUMNS)}) VALUES ({placeholders})",
+                [(user_id,) + tuple(task.get(column) for column in BATCH_TASK_COLUMNS) for task in tasks]
+            )
+        connection.commit()
+        user_cache.invalidate(user_id)
+        return 'ok', remaining_points
+    except Exception as e:
+        print(f"批量预扣积分错误: {str(e)}")
+        connection.rollback()
+        return 'error', None
+    finally:
+        connection.close()
+
+
+@timed_query
+def commit_video_task(prompt_id, backend=None):
+    """任务已提交到ComfyUI：queued -> pending，并记录执行的后端"""
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('''
+            UPDATE video_tasks SET status = 'pending', backend = %s
+            WHERE prompt_id = %s AND status = 'queued'
+            ''', (backend, prompt_id))
+        connection.commit()
+        return cursor.rowcount > 0
+    except Exception as e:
+        print(f"更新任务状态错误: {str(e)}")
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+
+@timed_query
+def refund_video_task(prompt_id, user_id):
+    """
+    任务提交失败：标记为 failed 并退还预扣的积分（一条语句完成）
+
+    只处理仍为 queued 的任务，重复调用不会重复退款。复用该任务结果的其他记录一并标记失败（未扣积分，退还0）。
+    """
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('''
+            UPDATE video_tasks t JOIN users u ON u.id = t.user_id
+            SET u.points = u.points + t.points_consumed, t.status = 'failed'
+            WHERE t.prompt_id = %s AND t.status = 'queued' AND (t.user_id = %s OR t.attached = 1)
+            ''', (prompt_id, user_id))
+        connection.commit()
+        user_cache.invalidate(user_id)
+        return cursor.rowcount > 0
+    except Exception as e:
+        print(f"退还积分错误: {str(e)}")
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+
+@timed_query
+def get_video_task(prompt_id, user_id):
+    """查询用户的单个视频任务"""
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('''
+            SELECT id, prompt_id, points_consumed, status, progress, error,
+                   created_at, started_at, completed_at
+            FROM video_tasks
+            WHERE prompt_id = %s AND user_id = %s
+            ''', (prompt_id, user_id))
+            return cursor.fetchone()
+    finally:
+        connection.close()
+
+
+@timed_query
+def find_cached_video_tasks(request_key, ttl):
+    """
+    按请求哈希查找可复用的任务：排队/执行中的任务，或 ttl 秒内完成的任务（新的在前）
+
+    Returns:
+        任务记录列表（同一 prompt_id 可能有多条，分属不同用户）
+    """
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('''
+            SELECT prompt_id, user_id, status, progress, backend, output_path, started_at, completed_at
+            FROM video_tasks
+            WHERE request_key = %s AND (status IN ('queued', 'pending', 'running')
+                  OR (status = 'completed' AND completed_at >= NOW() - INTERVAL %s SECOND))
+            ORDER BY id DESC
+            LIMIT 20
+            ''', (request_key, int(ttl)))
+            return cursor.fetchall()
+    finally:
+        connection.close()
+
+
+@timed_query
+def find_cached_video_tasks_many(request_keys, ttl):
+    """
+    批量版 find_cached_video_tasks：一次查询多个请求哈希
+
+    Returns:
+        {请求哈希: 任务记录列表}（没有可复用任务的哈希不在其中）
+    """
+    if not request_keys:
+        return {}
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            placeholders = ', '.join(['%s'] * len(request_keys))
+            cursor.execute(f'''
+            SELECT request_key, prompt_id, user_id, status, progress, backend, output_path, started_at, completed_at
+            FROM video_tasks
+            WHERE request_key IN ({placeholders}) AND (status IN ('queued', 'pending', 'running')
+                  OR (status = 'completed' AND completed_at >= NOW() - INTERVAL %s SECOND))
+            ORDER BY id DESC
+            LIMIT %s
+            ''', list(request_keys) + [int(ttl), 20 * len(request_keys)])
+            tasks = {}
+            for row in cursor.fetchall():
+                tasks.setdefault(row['request_key'], []).append(row)
+            return tasks
+    finally:
+        connection.close()
+
+
+@timed_query
+def attach_video_task(user_id, source, image_path, positive_prompt, negative_prompt,
+                      width, height, length, fps, template=None, request_key=None):
+    """
+    为用户记录一条复用已有结果的任务（同一 prompt_id，不扣积分）
+
+    新记录复制来源任务的当前状态；来源仍在执行时，之后按 prompt_id 的状态更新会同时作用于这条记录。
+    """
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('''
+            INSERT INTO video_tasks
+            (user_id, prompt_id, image_path, positive_prompt, negative_prompt, width, height, length, fps,
+             points_consumed, status, template, backend, progress, output_path, started_at, completed_at,
+             request_key, attached)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 0, %s, %s, %s, %s, %s, %s, %s, %s, 1)
+            ''', (user_id, source['prompt_id'], image_path, positive_prompt, negative_prompt,
+                  width, height, length, fps, source['status'], template, source['backend'], source['progress'],
+                  source['output_path'], source['started_at'], source['completed_at'], request_key))
+        connection.commit()
+        return True
+    except Exception as e:
+        print(f"记录复用任务错误: {str(e)}")
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+
+@timed_query
+def expire_request_keys(prompt_ids):
+    """结果文件已被清理的任务不再参与结果复用"""
+    if not prompt_ids:
+        return True
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+            UPDATE video_tasks SET request_key = NULL
+            WHERE prompt_id IN ({', '.join(['%s'] * len(prompt_ids))})
+            ''', list(prompt_ids))
+        connection.commit()
+        return True
+    except Exception as e:
+        print(f"清除结果缓存键错误: {str(e)}")
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+
+@timed_query
+def get_active_image_paths(image_paths):
+    """查询仍被未结束任务（queued/pending/running）引用的输入图片，返回路径集合"""
+    if not image_paths:
+        return set()
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+            SELECT DISTINCT image_path FROM video_tasks
+            WHERE image_path IN ({', '.join(['%s'] * len(image_paths))})
+            AND status IN ('queued', 'pending', 'running')
+            ''', list(image_paths))
+            return {row['image_path'] for row in cursor.fetchall()}
+    finally:
+        connection.close()
+
+
+@timed_query
+def get_stored_outputs(tier, older_than=None, limit=500):
+    """
+    按完成时间从旧到新查询某一存储层级的结果文件（存储清理用）
+
+    Args:
+        tier: 存储层级（hot/cold）
+        older_than: 只查完成超过该秒数的任务，None 为不限
+        limit: 最多返回条数，None 为不限（统计热存储占用时需要全部记录）
+    """
+    sql = '''
+    SELECT prompt_id, backend, output_path, completed_at FROM video_tasks
+    WHERE storage_tier = %s AND status = 'completed' AND attached = 0 AND output_path IS NOT NULL
+    '''
+    params = [tier]
+    if older_than is not None:
+        sql += ' AND completed_at < NOW() - INTERVAL %s SECOND'
+        params.append(int(older_than))
+    sql += ' ORDER BY completed_at'
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params.append(limit)
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
             return cursor.fetchall()
     finally:
-        connection.close()
\ No newline at end of file
+        connection.close()
+
+
+@timed_query
+def set_storage_tier(prompt_ids, tier):
+    """更新结果文件的存储层级（含复用同一结果的任务）；过期的任务同时清除结果缓存键"""
+    if not prompt_ids:
+        return True
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            extra = ', request_key = NULL' if tier == 'expired' else ''
+            cursor.execute(f'''
+            UPDATE video_tasks SET storage_tier = %s{extra}
+            WHERE prompt_id IN ({', '.join(['%s'] * len(prompt_ids))})
+            ''', [tier, *prompt_ids])
+        connection.commit()
+        return True
+    except Exception as e:
+        print(f"更新存储层级错误: {str(e)}")
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+
+@timed_query
+def add_revoked_token(jti, user_id, revoked_at, expires_at):
+    """写入令牌吊销记录（jti 为空时吊销该用户此前签发的全部令牌；时间均为UTC秒数）"""
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('''
+            INSERT INTO revoked_tokens (jti, user_id, revoked_at, expires_at) VALUES (%s, %s, %s, %s)
+            ''', (jti, user_id, revoked_at, expires_at))
+        connection.commit()
+        return True
+    except Exception as e:
+        print(f"写入令牌吊销记录错误: {str(e)}")
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+
+@timed_query
+def get_revoked_tokens(after_id=None):
+    """查询 id 大于 after_id 且未过期的吊销记录；after_id 为 None（进程启动后首次同步）时顺带删除已过期的记录"""
+    now = int(time.time())
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            if after_id is None:
+                cursor.execute('DELETE FROM revoked_tokens WHERE expires_at < %s', (now,))
+                connection.commit()
+                after_id = 0
+            cursor.execute('''
+            SELECT id, jti, user_id, revoked_at, expires_at FROM revoked_tokens
+            WHERE id > %s AND expires_at >= %s
+            ORDER BY id
+            ''', (after_id, now))
+            return cursor.fetchall()
+    finally:
+        connection.close()
+
+
+@timed_query
+def get_video_task_output(prompt_id, user_id=None):
+    """查询任务的结果文件信息（指定 user_id 时只查该用户的任务，用于下载前校验归属）"""
+    sql = '''
+    SELECT prompt_id, user_id, status, backend, output_path, completed_at
+    FROM video_tasks
+    WHERE prompt_id = %s
+    '''
+    params = [prompt_id]
+    if user_id is not None:
+        sql += ' AND user_id = %s'
+        params.append(user_id)
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()
+    finally:
+        connection.close()
+
+
+@timed_query
+def get_queued_video_tasks():
+    """查询仍在排队（尚未提交到ComfyUI）的任务，用于重启后恢复提交"""
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('''
+            SELECT * FROM video_tasks 
+            WHERE status = 'queued' AND attached = 0 
+            ORDER BY id
+            ''')
+            return cursor.fetchall()
+    finally:
+        connection.close()
+
+
+@timed_query
+def get_active_video_tasks():
+    """查询已提交到ComfyUI、尚未结束的任务，用于重启后恢复状态跟踪"""
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('''
+            SELECT prompt_id, user_id, backend, status FROM video_tasks
+            WHERE status IN ('pending', 'running') AND backend IS NOT NULL
+            ''')
+            return cursor.fetchall()
+    finally:
+        connection.close()
+
+
+@timed_query
+def get_task_durations(days=30, limit=5000):
+    """
+    查询最近完成任务的实测执行时间，用于校准计费模型
+
+    Returns:
+        [(模板, 宽, 高, 帧数, 执行秒数)]
+    """
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            # 复用结果的任务没有真正执行，不参与校准
+            cursor.execute('''
+            SELECT template, width, height, length,
+                   TIMESTAMPDIFF(SECOND, started_at, completed_at) AS seconds
+            FROM video_tasks
+            WHERE status = 'completed' AND attached = 0
+              AND started_at IS NOT NULL AND completed_at >= NOW() - INTERVAL %s DAY
+            ORDER BY completed_at DESC
+            LIMIT %s
+            ''', (days, limit))
+            return [(row['template'], row['width'], row['height'], row['length'], row['seconds'])
+                    for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+TASK_UPDATE_COLUMNS = ('status', 'progress', 'output_path', 'error', 'started_at', 'completed_at')
+# 时间字段以UTC秒数（time.time()）传入，由 FROM_UNIXTIME 按MySQL会话时区换算，
+# 与 created_at 的默认值以及查询中的 NOW() 是同一个时钟，不受应用服务器时区影响
+TASK_TIME_COLUMNS = ('started_at', 'completed_at')
+
+
+@timed_query
+def bulk_update_video_tasks(updates):
+    """
+    批量更新任务状态（一条 UPDATE ... CASE 语句）
+
+    Args:
+        updates: {prompt_id: {'status': ..., 'progress': ..., ...}}，每个任务只需给出有变化的字段；
+            started_at/completed_at 为UTC秒数
+
+    Returns:
+        是否成功
+    """
+    if not updates:
+        return True
+    assignments = []
+    params = []
+    for column in TASK_UPDATE_COLUMNS:
+        cases = [(prompt_id, fields[column]) for prompt_id, fields in updates.items() if column in fields]
+        if not cases:
+            continue
+        value_sql = 'FROM_UNIXTIME(%s)' if column in TASK_TIME_COLUMNS else '%s'
+        assignments.append(f"{column} = CASE prompt_id {' '.join([f'WHEN %s THEN {value_sql}'] * len(cases))} "
+                           f"ELSE {column} END")
+        for prompt_id, value in cases:
+            params.extend((prompt_id, value))
+    if not assignments:
+        return True
+    prompt_ids = list(updates)
+    params.extend(prompt_ids)
+
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            # 已结束的任务不再被迟到的事件改回进行中
+            cursor.execute(f'''
+            UPDATE video_tasks SET {', '.join(assignments)}
+            WHERE prompt_id IN ({', '.join(['%s'] * len(prompt_ids))})
+            AND status NOT IN ('completed', 'failed')
+            ''', params)
+        connection.commit()
+        return True
+    except Exception as e:
+        print(f"批量更新任务状态错误: {str(e)}")
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
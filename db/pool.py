@@ -0,0 +1,247 @@
+import threading
+import time
+from collections import deque
+
+from pymysql.constants import SERVER_STATUS
+
+
+class PoolTimeout(Exception):
+    """等待空闲连接超时"""
+
+
+class _Waiter:
+    """排队等待连接的请求；raw 为 None 表示拿到的是新建连接的名额"""
+
+    __slots__ = ('event', 'raw', 'released_at')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.raw = None
+        self.released_at = None
+
+    def wake(self, raw, released_at):
+        self.raw = raw
+        self.released_at = released_at
+        self.event.set()
+
+
+class PooledConnection:
+    """
+    连接池中借出的连接
+
+    除 close() 外的属性都直接转发给底层连接，因此 db.py 中原有的
+    cursor()/commit()/rollback()/close() 写法无需改动；close() 只是把连接还回连接池。
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise AttributeError(f'连接已归还连接池，无法访问 {name}')
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.release(raw)
+
+    def discard(self):
+        """连接已不可用时调用，直接关闭而不归还"""
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.release(raw, broken=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    线程安全的MySQL连接池
+
+    Args:
+        connect: 无参函数，返回一个新的DB-API连接（测试时可传入假连接工厂）
+        max_size: 最多同时存在的连接数（借出 + 空闲）
+        timeout: 连接全部借出时等待空闲连接的最长秒数
+        recycle: 空闲超过该秒数的连接直接关闭重建，避免被MySQL wait_timeout断开
+        ping_interval: 空闲超过该秒数的连接在借出前先 ping 一次做健康检查
+    """
+
+    def __init__(self, connect, max_size=10, timeout=10.0, recycle=3600, ping_interval=30):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+
+        self._lock = threading.Lock()
+        self._idle = deque()  # (连接, 归还时间)，后进先出，保持热连接
+        self._waiters = deque()  # 排队等待连接的请求
+        self._size = 0  # 当前已创建的连接数
+
+        # 监控指标
+        self._checked_out = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._health_failures = 0
+
+    def acquire(self):
+        """借出一个连接（返回 PooledConnection）"""
+        start = time.monotonic()
+        waited = False
+
+        while True:
+            waiter = None
+            with self._lock:
+                if self._idle and not self._waiters:
+                    raw, released_at = self._idle.pop()
+                elif self._size < self.max_size and not self._waiters:
+                    raw, released_at = None, None
+                    self._size += 1  # 先占位，连接在锁外创建
+                else:
+                    # 按先来后到排队，归还的连接直接交给队首，避免新请求插队导致饥饿
+                    waiter = _Waiter()
+                    self._waiters.append(waiter)
+
+            if waiter is not None:
+                waited = True
+                remaining = start + self.timeout - time.monotonic()
+                if not waiter.event.wait(max(remaining, 0)):
+                    with self._lock:
+                        if waiter in self._waiters:
+                            self._waiters.remove(waiter)
+                            self._timeouts += 1
+                            raise PoolTimeout(f'等待数据库连接超时（{self.timeout}秒）')
+                raw, released_at = waiter.raw, waiter.released_at
+
+            if raw is None:
+                try:
+                    raw = self._connect()
+                except Exception:
+                    self._drop_slot()
+                    raise
+                with self._lock:
+                    self._created += 1
+            elif not self._check(raw, released_at):
+                continue
+
+            with self._lock:
+                self._checked_out += 1
+                self._checkouts += 1
+                if waited:
+                    elapsed = time.monotonic() - start
+                    self._waits += 1
+                    self._wait_time_total += elapsed
+                    self._wait_time_max = max(self._wait_time_max, elapsed)
+            return PooledConnection(self, raw)
+
+    def _check(self, raw, released_at):
+        """借出前的健康检查，不可用时关闭连接并返回False"""
+        idle_for = time.monotonic() - released_at
+        if self.recycle and idle_for > self.recycle:
+            with self._lock:
+                self._recycled += 1
+            self._close_raw(raw)
+            return False
+        if idle_for > self.ping_interval:
+            try:
+                raw.ping(reconnect=False)
+            except Exception:
+                with self._lock:
+                    self._health_failures += 1
+                self._close_raw(raw)
+                return False
+        return True
+
+    def release(self, raw, broken=False):
+        """归还连接；未提交的事务会先回滚，避免下一个使用者读到旧快照"""
+        if not getattr(raw, 'open', True):
+            broken = True  # 使用过程中连接已断开
+        if not broken:
+            try:
+                if getattr(raw, 'server_status', 0) & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                    raw.rollback()
+            except Exception:
+                broken = True
+
+        with self._lock:
+            self._checked_out -= 1
+            if not broken:
+                if self._waiters:
+                    self._waiters.popleft().wake(raw, time.monotonic())
+                else:
+                    self._idle.append((raw, time.monotonic()))
+                return
+        self._close_raw(raw)
+
+    def _close_raw(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+        self._drop_slot()
+
+    def _drop_slot(self):
+        """释放一个连接名额；有人排队时把名额直接转给队首，由其新建连接"""
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().wake(None, None)
+            else:
+                self._size -= 1
+
+    def prefill(self, count=None):
+        """预先并行建立连接（最多 max_size 个）；有连接建立失败时抛出第一个异常"""
+        count = self.max_size if count is None else min(count, self.max_size)
+        connections, errors = [], []
+
+        def connect():
+            try:
+                connections.append(self.acquire())
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=connect, daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for connection in connections:
+            connection.close()
+        if errors:
+            raise errors[0]
+
+    def close_all(self):
+        """关闭所有空闲连接（借出中的连接归还时照常入池）"""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for raw, _ in idle:
+            self._close_raw(raw)
+
+    def stats(self):
+        """连接池监控指标"""
+        with self._lock:
+            return {
+                'size': self._size,
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'waiting': len(self._waiters),
+                'checked_out': self._checked_out,
+                'checkouts': self._checkouts,
+                'created': self._created,
+                'recycled': self._recycled,
+                'health_check_failures': self._health_failures,
+                'waits': self._waits,
+                'wait_timeouts': self._timeouts,
+                'wait_time_total': round(self._wait_time_total, 6),
+                'wait_time_max': round(self._wait_time_max, 6),
+            }
@@ -0,0 +1,306 @@
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import uuid
+
+from ai.comfyui_functions import download_output
+
+# 结果视频配置
+# ComfyUI输出目录在本机的挂载路径（共享目录/NFS）；为空时任务完成后从执行任务的后端下载一份到 MEDIA_DIR
+COMFYUI_OUTPUT_DIR = os.environ.get('COMFYUI_OUTPUT_DIR') or ''
+MEDIA_DIR = os.environ.get('MEDIA_DIR') or 'media'  # 封面、预览（及下载的结果视频）目录，不能放在 static 下
+MEDIA_PREVIEW_WIDTH = int(os.environ.get('MEDIA_PREVIEW_WIDTH') or 480)  # 封面和预览视频的宽度
+MEDIA_PREVIEW_CRF = int(os.environ.get('MEDIA_PREVIEW_CRF') or 32)  # 预览视频的x264质量（越大码率越低）
+MEDIA_MAX_BYTES = int(os.environ.get('MEDIA_MAX_BYTES') or 0)  # MEDIA_DIR 占用上限（字节），超出后按时间清理最旧的任务，0 为不限
+MEDIA_COLD_DIR = os.environ.get('MEDIA_COLD_DIR') or ''  # 结果视频冷存储目录（大容量低成本存储），为空时不迁移
+FFMPEG = os.environ.get('FFMPEG') or shutil.which('ffmpeg')
+
+VIDEO_NAME = 'video'
+POSTER_NAME = 'poster.jpg'
+PREVIEW_NAME = 'preview.mp4'
+
+
+def _inside(base, path):
+    """path 是否在 base 目录内（防止 ../ 越界）"""
+    base = os.path.realpath(base)
+    return os.path.commonpath([base, os.path.realpath(path)]) == base
+
+
+def _dir_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_file(follow_symlinks=False):
+            total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+def _replace_atomic(build, dest):
+    """build(temp_path) 生成文件后改名为 dest，失败时清理临时文件"""
+    root, ext = os.path.splitext(dest)
+    temp_path = f'{root}.{uuid.uuid4().hex}.part{ext}'
+    try:
+        build(temp_path)
+        os.replace(temp_path, dest)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class MediaProcessor:
+    """
+    结果视频的本地文件与衍生文件（封面、低码率预览）
+
+    任务完成后在后台线程中处理：结果视频不在共享目录时先从后端下载，
+    再用 ffmpeg 截取封面、转码预览。文件按 prompt_id 分目录存放，下载接口按路径直接发送。
+
+    Args:
+        lookup: lookup(prompt_id) -> 任务记录（需包含 backend、output_path），查不到返回 None
+        media_dir: 衍生文件目录
+        output_dir: ComfyUI输出目录在本机的挂载路径，为空时从后端下载结果视频
+        workers: 处理线程数（ffmpeg 转码占CPU，默认1）
+        max_queue: 等待处理的任务上限，超出时丢弃（下载接口仍可用，只是没有封面和预览）
+        max_bytes: 目录占用上限，超出后删除最旧的任务目录，0 为不限
+        on_evict: on_evict(prompt_ids) 任务目录被清理后的回调（用于让结果缓存失效）
+        cold_dir: 冷存储目录，迁移后的结果视频按原相对路径存放，为空时不迁移
+    """
+
+    def __init__(self, lookup, media_dir=MEDIA_DIR, output_dir=COMFYUI_OUTPUT_DIR, workers=1, max_queue=1000,
+                 timeout=300, max_bytes=MEDIA_MAX_BYTES, on_evict=None, cold_dir=MEDIA_COLD_DIR):
+        self._lookup = lookup
+        self.media_dir = media_dir
+        self.output_dir = output_dir
+        self.cold_dir = cold_dir
+        self.max_bytes = max_bytes
+        self._on_evict = on_evict
+        self._usage = None  # 目录当前占用（首次清理时扫描，之后按处理结果累加）
+        self.workers = workers
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {'processed': 0, 'failed': 0, 'dropped': 0, 'downloaded': 0, 'evicted': 0}
+        if not FFMPEG:
+            print('未找到ffmpeg，不生成视频封面和预览')
+
+    def start(self):
+        if self._threads:
+            return
+        os.makedirs(self.media_dir, exist_ok=True)
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'media-processor-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enqueue(self, prompt_id):
+        try:
+            self._queue.put_nowait(prompt_id)
+        except queue.Full:
+            self._count('dropped')
+            print(f'结果处理队列已满，任务 {prompt_id} 不生成封面和预览')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    # ---- 文件路径 ----
+
+    def task_dir(self, prompt_id):
+        return os.path.join(self.media_dir, prompt_id[:2], prompt_id)
+
+    def hot_video_path(self, task):
+        """结果视频在热存储（ComfyUI输出目录或 MEDIA_DIR）中的路径，不检查文件是否存在；路径越界时返回 None"""
+        output_path = task.get('output_path')
+        if not output_path:
+            return None
+        if self.output_dir:
+            path = os.path.join(self.output_dir, output_path)
+            return path if _inside(self.output_dir, path) else None
+        ext = os.path.splitext(output_path)[1]
+        return os.path.join(self.task_dir(task['prompt_id']), VIDEO_NAME + ext)
+
+    def cold_video_path(self, task):
+        """结果视频在冷存储中的路径（与热存储相同的相对路径），未配置冷存储时返回 None"""
+        hot = self.hot_video_path(task)
+        if not self.cold_dir or hot is None:
+            return None
+        path = os.path.join(self.cold_dir, os.path.relpath(hot, self.output_dir or self.media_dir))
+        return path if _inside(self.cold_dir, path) else None
+
+    def video_path(self, task):
+        """
+        结果视频的本地路径（先找热存储，再找冷存储），文件不存在时返回 None
+
+        Args:
+            task: 任务记录（prompt_id、output_path）
+        """
+        for path in (self.hot_video_path(task), self.cold_video_path(task)):
+            if path and os.path.isfile(path):
+                return path
+        return None
+
+    def derived_path(self, prompt_id, name):
+        """封面/预览的本地路径，尚未生成时返回 None"""
+        path = os.path.join(self.task_dir(prompt_id), name)
+        return path if os.path.isfile(path) else None
+
+    # ---- 后台处理 ----
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                prompt_id = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.process(prompt_id)
+                self._count('processed')
+            except Exception as e:
+                self._count('failed')
+                print(f'任务 {prompt_id} 结果处理失败: {e}')
+            finally:
+                self._queue.task_done()
+            if self.max_bytes:
+                try:
+                    self._account(prompt_id)
+                except Exception as e:
+                    print(f'清理结果目录失败: {e}')
+
+    def process(self, prompt_id):
+        """准备结果视频并生成封面、预览（已存在的文件跳过）"""
+        task = self._lookup(prompt_id)
+        if not task or not task.get('output_path'):
+            print(f'任务 {prompt_id} 没有结果文件，跳过结果处理')
+            return
+        os.makedirs(self.task_dir(prompt_id), exist_ok=True)
+
+        video = self.video_path(task)
+        if video is None and not self.output_dir:
+            video = self.hot_video_path(task)
+            _replace_atomic(lambda temp: download_output(task['backend'], task['output_path'], temp,
+                                                         timeout=self.timeout), video)
+            self._count('downloaded')
+        if video is None:
+            raise FileNotFoundError(f"结果文件不存在: {task['output_path']}")
+        if not FFMPEG:
+            return
+
+        scale = f'scale={MEDIA_PREVIEW_WIDTH}:-2'
+        poster = os.path.join(self.task_dir(prompt_id), POSTER_NAME)
+        if not os.path.isfile(poster):
+            # thumbnail 滤镜在前若干帧中挑选最有代表性的一帧，避免取到全黑的首帧
+            _replace_atomic(lambda temp: self._ffmpeg(
+                '-i', video, '-vf', f'thumbnail,{scale}', '-frames:v', '1', '-q:v', '4', temp), poster)
+        preview = os.path.join(self.task_dir(prompt_id), PREVIEW_NAME)
+        if not os.path.isfile(preview):
+            # faststart 把索引放到文件开头，浏览器无需下载完整文件即可开始播放
+            _replace_atomic(lambda temp: self._ffmpeg(
+                '-i', video, '-an', '-vf', scale, '-c:v', 'libx264', '-preset', 'veryfast',
+                '-crf', str(MEDIA_PREVIEW_CRF), '-pix_fmt', 'yuv420p', '-movflags', '+faststart', temp), preview)
+
+    # ---- 容量清理 ----
+
+    def _task_dirs(self):
+        """[(修改时间, prompt_id, 目录)]"""
+        dirs = []
+        if not os.path.isdir(self.media_dir):
+            return dirs
+        for shard in os.scandir(self.media_dir):
+            if shard.is_dir(follow_symlinks=False):
+                for entry in os.scandir(shard.path):
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append((entry.stat().st_mtime, entry.name, entry.path))
+        return dirs
+
+    def _account(self, prompt_id):
+        """累加新处理任务的占用，超出上限时清理"""
+        with self._lock:
+            if self._usage is None:
+                usage = None
+            else:
+                path = self.task_dir(prompt_id)
+                self._usage += _dir_size(path) if os.path.isdir(path) else 0
+                usage = self._usage
+        if usage is None or usage > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """删除最旧的任务目录，直到占用降到上限的90%以下；返回被清理的 prompt_id 列表"""
+        dirs = sorted(self._task_dirs())
+        sizes = {path: _dir_size(path) for _, _, path in dirs}
+        usage = sum(sizes.values())
+        target = self.max_bytes * 0.9
+        evicted = []
+        if usage > self.max_bytes:
+            for _, prompt_id, path in dirs:
+                if usage <= target:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                usage -= sizes[path]
+                evicted.append(prompt_id)
+        with self._lock:
+            self._usage = usage
+            self._stats['evicted'] += len(evicted)
+        if evicted:
+            print(f'结果目录超出上限，清理了{len(evicted)}个任务')
+            if self._on_evict:
+                self._on_evict(evicted)
+        return evicted
+
+    # ---- 分层存储 ----
+
+    def archive(self, task):
+        """
+        把结果视频从热存储迁移到冷存储
+
+        先完整拷贝到冷存储再删除热存储中的文件，迁移中途失败时原文件仍可用。
+
+        Returns:
+            迁移后冷存储中的文件大小（字节）；结果视频已不存在时返回 None
+        """
+        hot, cold = self.hot_video_path(task), self.cold_video_path(task)
+        if cold is None:
+            raise ValueError('未配置冷存储目录')
+        if not os.path.isfile(hot):
+            # 上次迁移在删除原文件之前中断，或文件已丢失
+            return os.path.getsize(cold) if os.path.isfile(cold) else None
+        os.makedirs(os.path.dirname(cold), exist_ok=True)
+        _replace_atomic(lambda temp: shutil.copy2(hot, temp), cold)
+        try:
+            os.remove(hot)
+        except FileNotFoundError:
+            pass
+        return os.path.getsize(cold)
+
+    def remove(self, task):
+        """删除任务的结果视频（热存储和冷存储）以及封面、预览；返回释放的字节数"""
+        freed = 0
+        for path in (self.hot_video_path(task), self.cold_video_path(task)):
+            if path and os.path.isfile(path):
+                freed += os.path.getsize(path)
+                os.remove(path)
+        path = self.task_dir(task['prompt_id'])
+        if os.path.isdir(path):
+            freed += _dir_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+        return freed
+
+    def _ffmpeg(self, *args):
+        result = subprocess.run([FFMPEG, '-y', '-v', 'error', *args], capture_output=True, timeout=self.timeout)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg失败: {result.stderr.decode('utf-8', 'replace')[-500:]}")
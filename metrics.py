@@ -0,0 +1,230 @@
+import functools
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 默认的耗时分桶（秒）：覆盖从缓存命中的亚毫秒级到ComfyUI上传大图的数秒
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数，按标签值分别计数"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """
+    分桶直方图（Prometheus 的 histogram 类型）
+
+    observe 只做一次二分查找和加锁累加；累计分桶在导出时才计算。
+    """
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # 标签值 -> [各分桶计数..., 超出最大分桶的计数, 总和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        """with histogram.time('label'): ... 记录代码块的耗时（出错时同样记录）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((labelvalues, list(series)) for labelvalues, series in self._series.items())
+        for labelvalues, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {_format_value(series[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    """
+    指标注册表，render() 输出 Prometheus 文本格式
+
+    除了直接记录的计数和直方图，还可以注册各组件的 stats() 作为采集函数，
+    在导出时读取当前值（作为 gauge 输出），热路径上没有额外开销。
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_stats(self, prefix, stats, label=None):
+        """
+        注册一个 stats() 采集函数，其中的数值字段导出为 gauge（嵌套的字典用下划线连接字段名）
+
+        Args:
+            prefix: 指标名前缀，如 videogenius_dispatcher
+            stats: stats() -> {'queued': 3, ...}；label 不为空时返回 {标签值: {'queued': 3, ...}}
+            label: 标签名（如 backend），用于多个实例的同名指标
+        """
+        with self._lock:
+            self._collectors.append((prefix, stats, label))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for prefix, stats, label in collectors:
+            try:
+                lines.extend(_render_stats(prefix, stats(), label))
+            except Exception as e:
+                print(f'采集指标 {prefix} 失败: {e}')
+        return '\n'.join(lines) + '\n'
+
+
+def _flatten(stats, prefix=''):
+    for key, value in stats.items():
+        name = f'{prefix}_{key}' if prefix else str(key)
+        if isinstance(value, dict):
+            yield from _flatten(value, name)
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+def _render_stats(prefix, stats, label):
+    series = {}  # 指标名 -> [(标签, 值)]
+    groups = stats.items() if label else [(None, stats)]
+    for label_value, group in groups:
+        for key, value in _flatten(group):
+            labels = _format_labels((label,), (label_value,)) if label else ''
+            series.setdefault(f'{prefix}_{key}', []).append((labels, value))
+    lines = []
+    for name, samples in series.items():
+        lines.append(f'# TYPE {name} gauge')
+        lines.extend(f'{name}{labels} {_format_value(value)}' for labels, value in samples)
+    return lines
+
+
+registry = Registry()
+
+# 接口请求（按路由的 endpoint 名统计，不用原始路径，避免 prompt_id 等参数造成标签爆炸）
+http_requests = registry.counter('videogenius_http_requests_total', '接口请求数', ('method', 'endpoint', 'status'))
+http_request_seconds = registry.histogram('videogenius_http_request_seconds', '接口处理耗时', ('method', 'endpoint'))
+
+# 视频生成各阶段耗时（接口内的图片保存、扣积分，调度线程内的模板加载、提交ComfyUI等）
+stage_seconds = registry.histogram('videogenius_stage_seconds', '视频生成各阶段耗时', ('stage',))
+
+# 数据库操作（db.db 中每个查询函数一个标签）
+db_query_seconds = registry.histogram('videogenius_db_query_seconds', '数据库操作耗时', ('query',))
+db_query_errors = registry.counter('videogenius_db_query_errors_total', '数据库操作抛出异常的次数', ('query',))
+
+# 到各ComfyUI后端的HTTP请求往返耗时
+comfyui_request_seconds = registry.histogram(
+    'videogenius_comfyui_request_seconds', 'ComfyUI请求往返耗时', ('backend', 'method', 'path'),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+comfyui_request_errors = registry.counter(
+    'videogenius_comfyui_request_errors_total', 'ComfyUI请求失败（网络错误或非2xx）次数', ('backend', 'path'))
+
+
+def span(stage):
+    """with span('image_ingest'): ... 记录视频生成中一个阶段的耗时"""
+    return stage_seconds.time(stage)
+
+
+def timed_query(func):
+    """数据库查询函数的装饰器：记录耗时，函数抛出异常时计数"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            db_query_errors.inc(name)
+            raise
+        finally:
+            db_query_seconds.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+
+def observe_comfyui(backend, method, path, status, seconds):
+    """KeepAliveClient 的请求回调：按后端和接口记录往返耗时（status 为 None 表示网络错误）"""
+    path = path.split('?', 1)[0]
+    if path.startswith('/history/'):
+        path = '/history'  # 去掉 prompt_id
+    comfyui_request_seconds.observe(seconds, backend, method, path)
+    if status is None or not 200 <= status < 300:
+        comfyui_request_errors.inc(backend, path)
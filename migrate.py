@@ -0,0 +1,25 @@
+"""
+数据库迁移命令：创建数据库、表、缺失的字段和索引，以及默认管理员账号
+
+可以重复执行（已存在的对象不会改动）。部署新版本时在启动工作进程之前执行一次：
+
+    python migrate.py
+
+生产入口 serve.py 启动时不迁移；直接运行 app.py（本地开发）时默认在启动时迁移，可用 AUTO_MIGRATE=0 关闭。
+"""
+import sys
+
+from db import db
+
+
+def main():
+    try:
+        ok = db.init_db()
+    except Exception as e:
+        print(f'数据库迁移失败: {e}')
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
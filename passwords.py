@@ -0,0 +1,156 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# 密码哈希配置
+# 新密码使用的哈希方法（werkzeug 格式）：scrypt:N:r:p，每次计算约占用 128×N×r 字节内存，N 越大越难暴力破解
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 2)  # 计算哈希的进程数，0 为在请求线程中计算
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING') or 16)  # 排队等待计算的上限，超出时拒绝
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT') or 10)  # 等待计算结果的秒数
+
+
+class HasherBusy(Exception):
+    """哈希计算进程已满（接口应返回503，让客户端稍后重试）"""
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(hashed, password, method):
+    """
+    在工作进程中执行：校验密码，旧方法生成的哈希校验通过后顺便用新方法重新计算
+
+    Returns:
+        (是否正确, 新哈希或 None)
+    """
+    if not check_password_hash(hashed, password):
+        return False, None
+    if hashed.split('$', 1)[0] != method:
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+
+class PasswordHasher:
+    """
+    在独立进程池中计算密码哈希
+
+    pbkdf2/scrypt 是故意设计得很慢的CPU运算，放在请求线程中会占住GIL，拖慢所有接口；
+    放到固定数量的进程中计算后，登录/注册的吞吐量固定为进程数，超出 max_pending 的请求直接拒绝，
+    不会排起长队占满服务线程，其他接口不受影响。
+
+    Args:
+        workers: 进程数，0 时在调用线程中计算（调试或不支持多进程的环境）
+        method: 新哈希使用的方法
+        max_pending: 正在计算和排队的请求上限
+        timeout: 等待结果的秒数
+    """
+
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, method=PASSWORD_HASH_METHOD,
+                 max_pending=PASSWORD_HASH_MAX_PENDING, timeout=PASSWORD_HASH_TIMEOUT):
+        self.workers = workers
+        self.method = method
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._dummy_hash = None
+        self._stats = {'hashed': 0, 'verified': 0, 'rehashed': 0, 'rejected_busy': 0}
+
+    def start(self):
+        """
+        创建工作进程（由启动入口在开始处理请求前调用；没有调用时在第一次计算哈希时创建）
+
+        用 fork 创建进程：spawn/forkserver 会在子进程中重新导入启动脚本（app.py），重复初始化整个应用。
+        导入模块时不创建进程，导入 app 的测试和工具脚本不会派生子进程。不支持 fork 的平台在调用线程中计算。
+        """
+        if self.workers <= 0 or self._executor is not None:
+            return
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            print('当前平台不支持fork，密码哈希在请求线程中计算')
+            self.workers = 0
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('fork'))
+        # 第一次提交时创建全部工作进程，顺便生成用户不存在时比较用的假哈希
+        self._dummy_hash = self._executor.submit(_hash, os.urandom(16).hex(), self.method).result()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self.start()
+        return self._executor
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected_busy')
+            raise HasherBusy('登录请求过多，请稍后重试')
+        try:
+            executor = self._get_executor() if self.workers > 0 else None
+            if executor is None:
+                return func(*args)
+            try:
+                future = executor.submit(func, *args)
+                return future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                raise HasherBusy('登录请求过多，请稍后重试')
+            except BrokenProcessPool:
+                # 工作进程异常退出（如被OOM杀掉）：丢弃进程池，下次请求重新创建
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                print('密码哈希进程池异常，已重建')
+                raise HasherBusy('登录服务暂时不可用，请稍后重试')
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        """计算新密码的哈希"""
+        hashed = self._run(_hash, password, self.method)
+        self._count('hashed')
+        return hashed
+
+    def verify(self, hashed, password):
+        """
+        校验密码
+
+        Args:
+            hashed: 数据库中的哈希；为 None（用户不存在）时与一个假哈希比较，使响应时间与用户存在时一致
+
+        Returns:
+            (是否正确, 需要写回数据库的新哈希或 None)
+        """
+        if hashed is None:
+            self._run(_verify, self._get_dummy_hash(), password, self.method)
+            return False, None
+        ok, new_hash = self._run(_verify, hashed, password, self.method)
+        self._count('verified')
+        if new_hash:
+            self._count('rehashed')
+        return ok, new_hash
+
+    def _get_dummy_hash(self):
+        if self._dummy_hash is None:
+            self._dummy_hash = _hash(os.urandom(16).hex(), self.method)
+        return self._dummy_hash
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = self.workers
+        return stats
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
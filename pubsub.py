@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+
+class Subscription:
+    """一个订阅者的事件队列；队列满时丢弃最旧的事件（进度事件只关心最新状态）"""
+
+    def __init__(self, hub, topic, maxsize=32):
+        self.hub = hub
+        self.topic = topic
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, event):
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """等待下一条事件，超时返回 None"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class TaskEventHub:
+    """
+    进程内的任务进度发布/订阅
+
+    只使用 queue/threading 原语，在 gevent 下打补丁后即为协程友好，
+    一个 worker 可以挂住大量空闲的SSE连接。同时保留每个任务的最新状态，
+    新订阅者无需查库即可拿到当前进度。
+
+    Args:
+        state_size: 最多保留多少个任务的最新状态
+    """
+
+    def __init__(self, state_size=10000):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # topic -> set(Subscription)
+        self._state = OrderedDict()  # topic -> 合并后的最新状态
+        self.state_size = state_size
+        self.published = 0
+
+    def subscribe(self, topic):
+        subscription = Subscription(self, topic)
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.topic]
+
+    def publish(self, topic, fields):
+        """发布状态变化（fields 只需包含变化的字段），返回合并后的状态"""
+        with self._lock:
+            state = dict(self._state.pop(topic, {}))
+            state.update(fields)
+            state['updated_at'] = time.time()
+            self._state[topic] = state
+            while len(self._state) > self.state_size:
+                self._state.popitem(last=False)
+            subscribers = list(self._subscribers.get(topic, ()))
+            self.published += 1
+        for subscription in subscribers:
+            subscription.put(dict(state))
+        return state
+
+    def state(self, topic):
+        with self._lock:
+            state = self._state.get(topic)
+            return dict(state) if state else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'topics': len(self._subscribers),
+                'subscribers': sum(len(s) for s in self._subscribers.values()),
+                'published': self.published,
+            }
@@ -0,0 +1,61 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 登录限流配置（令牌桶：容量为允许的突发次数，按速率每秒补充）
+LOGIN_IP_RATE = float(os.environ.get('LOGIN_IP_RATE') or 0.5)  # 每个IP每秒补充的登录次数
+LOGIN_IP_BURST = int(os.environ.get('LOGIN_IP_BURST') or 20)  # 每个IP允许的突发登录次数
+LOGIN_EMAIL_RATE = float(os.environ.get('LOGIN_EMAIL_RATE') or 0.05)  # 每个邮箱每秒补充的登录次数（每分钟3次）
+LOGIN_EMAIL_BURST = int(os.environ.get('LOGIN_EMAIL_BURST') or 5)  # 每个邮箱允许的突发登录次数
+
+
+class TokenBucketLimiter:
+    """
+    按键（IP、邮箱等）限流的令牌桶
+
+    每个键一个桶，容量为 burst，每秒补充 rate 个令牌，每次请求消耗一个，没有令牌时拒绝。
+    桶按最近使用顺序保存，超过 maxsize 时丢弃最久未使用的（丢弃的桶相当于已补满）。
+    只在本进程内计数，多进程部署时每个进程各自限流。
+
+    Args:
+        rate: 每秒补充的令牌数
+        burst: 桶容量
+        maxsize: 最多保存的桶数
+    """
+
+    def __init__(self, rate, burst, maxsize=100000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # 键 -> (剩余令牌, 上次更新时间)
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    def acquire(self, key):
+        """
+        消耗一个令牌
+
+        Returns:
+            (是否允许, 需要等待的秒数)
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                self.allowed += 1
+                allowed, retry_after = True, 0.0
+            else:
+                self.limited += 1
+                allowed, retry_after = False, (1 - tokens) / self.rate if self.rate > 0 else 60.0
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._buckets), 'allowed': self.allowed, 'limited': self.limited}
@@ -0,0 +1,51 @@
+"""
+生产环境启动入口：gevent 协程服务器
+
+启动前先用 monkey.patch_all() 把 socket、ssl、threading、queue、subprocess 等替换为协程版本，
+PyMySQL（纯Python实现）、到ComfyUI的 http.client/urllib 请求、/ws 事件连接、SSE 推送的等待
+都变成非阻塞的，一个进程可以同时保持数千个慢速上传和 SSE 订阅连接，而不需要每个请求一个线程。
+接口、令牌校验和后台调度/跟踪逻辑与 app.py 完全相同（后台线程变成协程）。
+
+    pip install gevent
+    python migrate.py   # 部署时执行一次数据库迁移
+    python serve.py
+
+启动时不执行数据库迁移（AUTO_MIGRATE 默认为0），只做有时间上限的预热（warmup.py）：
+建立数据库连接、检查模板、连接ComfyUI后端，完成后 /readyz 返回200。
+
+密码哈希在独立进程中计算（passwords.py），不占用事件循环；仍会阻塞的只有上传图片的哈希计算和本地/NFS磁盘读写，
+它们耗时较短。
+"""
+from gevent import monkey
+
+monkey.patch_all()  # 必须在导入 app（及 pymysql、urllib 等）之前执行
+
+import os  # noqa: E402
+
+os.environ.setdefault('AUTO_MIGRATE', '0')  # 迁移由 migrate.py 单独执行，工作进程启动时跳过
+
+from gevent.pool import Pool  # noqa: E402
+from gevent.pywsgi import WSGIServer  # noqa: E402
+
+from app import app, password_hasher  # noqa: E402
+
+HOST = os.environ.get('HOST') or '0.0.0.0'
+PORT = int(os.environ.get('PORT') or 5000)
+SERVER_MAX_CONNECTIONS = int(os.environ.get('SERVER_MAX_CONNECTIONS') or 10000)  # 同时处理的连接数上限
+SERVER_ACCESS_LOG = os.environ.get('SERVER_ACCESS_LOG') == '1'  # 是否打印每个请求的访问日志
+
+
+def main():
+    # 后台任务都是协程，与请求共用一个系统线程，此时 fork 不会继承被其他线程持有的锁
+    password_hasher.start()
+    server = WSGIServer((HOST, PORT), app, spawn=Pool(SERVER_MAX_CONNECTIONS),
+                        log='default' if SERVER_ACCESS_LOG else None)
+    print(f'服务已启动（gevent）: http://{HOST}:{PORT}，最多 {SERVER_MAX_CONNECTIONS} 个并发连接')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop(timeout=5)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,57 @@
 // API基础URL（使用相对路径）
 export const API_BASE_URL = '/api';
 
+// 用刷新令牌换取新的访问令牌（访问令牌有效期较短），成功时保存并返回新令牌
+export async function refreshAccessToken() {
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (!refreshToken) {
+        throw new Error('登录已过期，请重新登录');
+    }
+    const response = await fetch(`${API_BASE_URL}/token/refresh`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            refresh_token: refreshToken
+        }),
+    });
+
+    const data = await response.json();
+
+    if (!response.ok) {
+        // 刷新令牌过期或已吊销，需要重新登录
+        localStorage.removeItem('refreshToken');
+        throw new Error(data.message || '登录已过期，请重新登录');
+    }
+
+    localStorage.setItem('token', data.token);
+    localStorage.setItem('user', JSON.stringify(data.user));
+    return data;
+}
+
+// 携带访问令牌发送请求；返回401时用刷新令牌换取新令牌后重试一次
+async function authorizedFetch(url, token, options = {}) {
+    const send = accessToken => fetch(url, {
+        ...options,
+        headers: {
+            ...(options.headers || {}),
+            'Authorization': `Bearer ${accessToken}`
+        }
+    });
+
+    const response = await send(token);
+    if (response.status !== 401 || !localStorage.getItem('refreshToken')) {
+        return response;
+    }
+    try {
+        const refreshed = await refreshAccessToken();
+        return await send(refreshed.token);
+    } catch (error) {
+        return response;
+    }
+}
+
 // API调用函数 - 注册用户
 export async function registerUser(name, email, password) {
     try {
@@ -49,8 +100,9 @@ export async function loginUser(email, password) {
             throw new Error(data.message || '登录失败');
         }
 
-        // 保存token和用户信息（含积分，用于前端展示）
+        // 保存token和用户信息（含积分，用于前端展示）；刷新令牌用于访问令牌过期后换取新令牌
         localStorage.setItem('token', data.token);
+        localStorage.setItem('refreshToken', data.refresh_token);
         localStorage.setItem('user', JSON.stringify(data.user));
 
         return data;
@@ -76,6 +128,10 @@ export async function verifyToken(token) {
         const data = await response.json();
 
         if (!response.ok) {
+            // 访问令牌已过期时用刷新令牌续期，不必重新登录
+            if (response.status === 401 && localStorage.getItem('refreshToken')) {
+                return await refreshAccessToken();
+            }
             throw new Error(data.message || '令牌无效');
         }
 
@@ -88,6 +144,33 @@ export async function verifyToken(token) {
     }
 }
 
+// API调用函数 - 退出登录（吊销访问令牌和刷新令牌；allDevices 为 true 时所有设备都退出）
+export async function logoutUser(allDevices = false) {
+    const token = localStorage.getItem('token');
+    const refreshToken = localStorage.getItem('refreshToken');
+    try {
+        if (token) {
+            await authorizedFetch(`${API_BASE_URL}/logout`, token, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    refresh_token: refreshToken,
+                    all: allDevices
+                }),
+            });
+        }
+    } catch (error) {
+        console.error('退出登录错误:', error);
+    } finally {
+        // 服务端吊销失败时也清除本地令牌
+        localStorage.removeItem('token');
+        localStorage.removeItem('refreshToken');
+        localStorage.removeItem('user');
+    }
+}
+
 // API调用函数 - 生成视频（图片）
 export async function generateVideoByImage(token, imageFile, params) {
     try {
@@ -102,11 +185,8 @@ export async function generateVideoByImage(token, imageFile, params) {
         formData.append('length', params.length); // 视频长度
         formData.append('fps', params.fps);
 
-        const response = await fetch(`${API_BASE_URL}/generate-video`, {
+        const response = await authorizedFetch(`${API_BASE_URL}/generate-video`, token, {
             method: 'POST',
-            headers: {
-                'Authorization': `Bearer ${token}` // Token通过请求头传递
-            },
             body: formData // 无需设置Content-Type，浏览器自动处理
         });
 
@@ -118,9 +198,10 @@ export async function generateVideoByImage(token, imageFile, params) {
             throw new Error(data.message || '生成视频失败');
         }
 
-        // 返回任务ID和积分变动信息（供前端展示）
+        // 返回任务ID和积分变动信息（供前端展示）；任务已排队，由后台提交到ComfyUI
         return {
             promptId: data.prompt_id,
+            status: data.status,
             pointsConsumed: data.points_consumed,
             remainingPoints: data.remaining_points
         };
@@ -130,6 +211,45 @@ export async function generateVideoByImage(token, imageFile, params) {
     }
 }
 
+// API调用函数 - 批量生成视频（同一张图片、多组参数，图片只上传一次）
+// paramSets: [{positive_prompt, negative_prompt, width, height, length, fps}, ...]，省略的字段使用 defaults
+export async function generateVideoBatch(token, imageFile, paramSets, defaults = {}) {
+    try {
+        const formData = new FormData();
+        formData.append('image', imageFile);
+        formData.append('params', JSON.stringify(paramSets));
+        for (const [key, value] of Object.entries(defaults)) {
+            formData.append(key, value);
+        }
+
+        const response = await authorizedFetch(`${API_BASE_URL}/generate-video/batch`, token, {
+            method: 'POST',
+            body: formData
+        });
+
+        const data = await response.json();
+
+        if (!response.ok) {
+            throw new Error(data.message || '批量生成视频失败');
+        }
+
+        // tasks 与 paramSets 一一对应（相同参数共用同一个任务）
+        return {
+            tasks: data.tasks.map(task => ({
+                promptId: task.prompt_id,
+                status: task.status,
+                cached: task.cached,
+                pointsConsumed: task.points_consumed
+            })),
+            pointsConsumed: data.points_consumed,
+            remainingPoints: data.remaining_points
+        };
+    } catch (error) {
+        console.error('批量生成视频错误:', error);
+        throw error;
+    }
+}
+
 // API调用函数 - 生成视频（文本）
 export async function generateVideoByText(token, params) {
     try {
@@ -137,16 +257,13 @@ export async function generateVideoByText(token, params) {
         // 文本生成参数
         formData.append('prompt', params.prompt);
         formData.append('style', params.style);
-        formData.append('length', params.duration); // 对应视频长度
+        formData.append('duration', params.duration); // 视频时长（秒），后端按帧率换算为帧数
         formData.append('width', params.width);
         formData.append('height', params.height);
         formData.append('fps', params.fps);
 
-        const response = await fetch(`${API_BASE_URL}/generate-video`, {
+        const response = await authorizedFetch(`${API_BASE_URL}/generate-video`, token, {
             method: 'POST',
-            headers: {
-                'Authorization': `Bearer ${token}`
-            },
             body: formData
         });
 
@@ -158,6 +275,7 @@ export async function generateVideoByText(token, params) {
 
         return {
             promptId: data.prompt_id,
+            status: data.status,
             pointsConsumed: data.points_consumed,
             remainingPoints: data.remaining_points
         };
@@ -170,11 +288,8 @@ export async function generateVideoByText(token, params) {
 // 获取用户当前积分（仅用于前端展示，不参与校验）
 export async function getUserPoints(token) {
     try {
-        const response = await fetch(`${API_BASE_URL}/user/points`, {
-            method: 'GET',
-            headers: {
-                'Authorization': `Bearer ${token}`
-            }
+        const response = await authorizedFetch(`${API_BASE_URL}/user/points`, token, {
+            method: 'GET'
         });
 
         const data = await response.json();
@@ -188,4 +303,58 @@ export async function getUserPoints(token) {
         console.error('获取积分错误:', error);
         throw error;
     }
-}
\ No newline at end of file
+}
+
+// 任务结果地址：kind 为 video（原视频）、poster（封面）、preview（低码率预览）
+// <video>/<img> 不能设置请求头，令牌通过查询参数传递
+export function taskMediaUrl(token, promptId, kind) {
+    return `${API_BASE_URL}/tasks/${encodeURIComponent(promptId)}/${kind}?token=${encodeURIComponent(token)}`;
+}
+
+// 订阅任务进度（Server-Sent Events，替代轮询）；返回取消订阅的函数
+// onUpdate 收到的是任务当前状态：{status, progress, error, ...}，任务结束（completed/failed）后自动关闭
+export function watchTask(token, promptId, onUpdate, onError) {
+    const task = { promptId: promptId };
+    let source = null;
+    let closed = false;
+    let refreshed = false;
+
+    function open(accessToken) {
+        // EventSource 不能设置请求头，令牌通过查询参数传递
+        const url = `${API_BASE_URL}/tasks/${encodeURIComponent(promptId)}/events?token=${encodeURIComponent(accessToken)}`;
+        source = new EventSource(url);
+
+        source.onmessage = function(event) {
+            refreshed = false;
+            Object.assign(task, JSON.parse(event.data));
+            if (task.status === 'completed' || task.status === 'failed') {
+                closed = true;
+                source.close();
+            }
+            onUpdate(task);
+        };
+
+        source.onerror = function() {
+            // 连接断开时浏览器会自动重连；服务端拒绝时（多为访问令牌过期）刷新令牌后重新连接一次
+            if (source.readyState !== EventSource.CLOSED || closed) {
+                return;
+            }
+            if (!refreshed && localStorage.getItem('refreshToken')) {
+                refreshed = true;
+                refreshAccessToken()
+                    .then(data => { if (!closed) open(data.token); })
+                    .catch(() => onError && onError(new Error('任务进度连接已断开')));
+                return;
+            }
+            if (onError) {
+                onError(new Error('任务进度连接已断开'));
+            }
+        };
+    }
+
+    open(token);
+    return () => {
+        closed = true;
+        source.close();
+    };
+}
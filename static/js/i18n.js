@@ -17,10 +17,10 @@ export const translations = {
         "styles.cartoon": "卡通风格",
         "styles.anime": "动漫风格",
         "styles.abstract": "抽象风格",
-        "durations.10s": "10秒",
-        "durations.30s": "30秒",
-        "durations.60s": "60秒",
-        "durations.120s": "120秒",
+        "durations.2s": "2秒",
+        "durations.3s": "3秒",
+        "durations.5s": "5秒",
+        "durations.8s": "8秒",
         generate: "生成视频",
         generating: "正在生成视频，请稍候...",
         "video-not-supported": "您的浏览器不支持视频播放",
@@ -136,10 +136,10 @@ export const translations = {
         "styles.cartoon": "Cartoon",
         "styles.anime": "Anime",
         "styles.abstract": "Abstract",
-        "durations.10s": "10s",
-        "durations.30s": "30s",
-        "durations.60s": "60s",
-        "durations.120s": "120s",
+        "durations.2s": "2s",
+        "durations.3s": "3s",
+        "durations.5s": "5s",
+        "durations.8s": "8s",
         generate: "Generate Video",
         generating: "Generating video, please wait...",
         "video-not-supported": "Your browser does not support video playback",
@@ -255,10 +255,10 @@ export const translations = {
         "styles.cartoon": "カートゥーン",
         "styles.anime": "アニメ",
         "styles.abstract": "アブストラクト",
-        "durations.10s": "10秒",
-        "durations.30s": "30秒",
-        "durations.60s": "60秒",
-        "durations.120s": "120秒",
+        "durations.2s": "2秒",
+        "durations.3s": "3秒",
+        "durations.5s": "5秒",
+        "durations.8s": "8秒",
         generate: "動画生成",
         generating: "動画を生成中です、しばらくお待ちください...",
         "video-not-supported": "お使いのブラウザは動画再生に対応していません",
@@ -2,7 +2,7 @@ import { translations, changeLanguage } from './i18n.js';
 import { initMobileMenu, initUserMenu, initFaqToggles, initTabs } from './ui.js';
 import { initModals, openLoginModal, closeLoginModal } from './modals.js';
 import { initTextVideoGenerator, initImageVideoGenerator } from './video-generator.js';
-import { verifyToken, loginUser, registerUser } from './api.js';
+import { verifyToken, loginUser, registerUser, logoutUser } from './api.js';
 
 // 登录状态切换
 export function showLoggedInState() {
@@ -30,6 +30,7 @@ function checkLoginStatus() {
                 // 令牌无效，清除本地存储
                 console.error('令牌验证失败:', error);
                 localStorage.removeItem('token');
+                localStorage.removeItem('refreshToken');
                 localStorage.removeItem('user');
                 hideLoggedInState();
             });
@@ -112,12 +113,11 @@ function initRegisterForm() {
 function initLogout() {
     const logoutLink = document.getElementById('logout-link');
     if (logoutLink) {
-        logoutLink.addEventListener('click', function(e) {
+        logoutLink.addEventListener('click', async function(e) {
             e.preventDefault();
 
-            // 清除本地存储
-            localStorage.removeItem('token');
-            localStorage.removeItem('user');
+            // 吊销服务端令牌并清除本地存储
+            await logoutUser();
 
             // 更新UI显示未登录状态
             hideLoggedInState();
@@ -1,6 +1,45 @@
-import { generateVideoByText, generateVideoByImage } from './api.js';
+import { generateVideoByText, generateVideoByImage, watchTask, taskMediaUrl } from './api.js';
 import { openLoginModal } from './modals.js';
 
+const TASK_STATUS_TEXT = {
+    queued: '排队中',
+    pending: '等待GPU',
+    running: '生成中'
+};
+
+// 订阅任务进度并更新生成状态区域（服务端推送，无需轮询）
+// 访问令牌可能在生成过程中被刷新，每次都从本地存储读取最新的令牌
+function followTask(promptId, generationStatus, generationResult) {
+    const progressText = document.getElementById('generation-progress');
+
+    watchTask(localStorage.getItem('token'), promptId, function(task) {
+        if (task.status === 'completed') {
+            // 视频由服务端按Range分段发送，浏览器边下边播，无需整体下载
+            const video = document.getElementById('generated-video');
+            if (video) {
+                const token = localStorage.getItem('token');
+                video.poster = taskMediaUrl(token, promptId, 'poster');
+                video.src = taskMediaUrl(token, promptId, 'video');
+            }
+            generationStatus.classList.add('hidden');
+            generationResult.classList.remove('hidden');
+            return;
+        }
+        if (task.status === 'failed') {
+            generationStatus.classList.add('hidden');
+            alert(`生成视频失败: ${task.error || '未知错误'}（积分已退还）`);
+            return;
+        }
+        if (progressText) {
+            const label = TASK_STATUS_TEXT[task.status] || task.status;
+            progressText.textContent = task.status === 'running' ? `${label} ${task.progress || 0}%` : label;
+        }
+    }, function(error) {
+        generationStatus.classList.add('hidden');
+        alert(error.message);
+    });
+}
+
 // 文本生成视频逻辑
 export function initTextVideoGenerator() {
     const generateButton = document.getElementById('generate-button');
@@ -46,10 +85,8 @@ export function initTextVideoGenerator() {
                 // 调用后端API生成视频（传递token和params）
                 const result = await generateVideoByText(token, params);
 
-                // 隐藏状态，显示结果
-                generationStatus.classList.add('hidden');
-                generationResult.classList.remove('hidden');
-                alert(`视频生成任务已提交，任务ID：${result.promptId}，消耗积分：${result.pointsConsumed}`);
+                // 保持生成状态，订阅任务进度直到完成
+                followTask(result.promptId, generationStatus, generationResult);
             } catch (error) {
                 generationStatus.classList.add('hidden');
                 alert(`生成视频失败: ${error.message}`);
@@ -155,11 +192,8 @@ export function initImageVideoGenerator() {
                 // 3. 调用API生成视频（按api.js要求传递参数：token, imageFile, params）
                 const result = await generateVideoByImage(token, imageFile, params);
 
-                // 4. 显示结果（注意：后端返回的是任务ID，不是直接的videoUrl）
-                generationStatus.classList.add('hidden');
-                generationResult.classList.remove('hidden');
-                alert(`视频生成任务已提交，任务ID：${result.promptId}，消耗积分：${result.pointsConsumed}`);
-                // 若后续需要展示视频，需根据promptId轮询后端结果
+                // 4. 后端返回的是任务ID，订阅任务进度直到完成
+                followTask(result.promptId, generationStatus, generationResult);
             } catch (error) {
                 generationStatus.classList.add('hidden');
                 alert(`生成视频失败: ${error.message}`);
@@ -0,0 +1,485 @@
+import hashlib
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import uuid
+
+from flask import Request
+
+# 上传图片校验配置
+IMAGE_MAX_SIDE = int(os.environ.get('IMAGE_MAX_SIDE') or 8192)  # 图片最大边长（像素）
+IMAGE_MIN_SIDE = int(os.environ.get('IMAGE_MIN_SIDE') or 16)  # 图片最小边长（像素）
+UPLOAD_SPOOL_MEMORY = 512 * 1024  # 上传文件超过该大小后暂存到本地临时文件，而不是留在内存
+HEAD_SIZE = 64 * 1024  # 保留文件开头用于识别格式和尺寸
+CHUNK_SIZE = 1024 * 1024
+
+# 存储清理配置
+STORAGE_GC_INTERVAL = float(os.environ.get('STORAGE_GC_INTERVAL') or 300)  # 清理间隔秒数，0 为不在本进程清理
+STORAGE_INPUT_GRACE = int(os.environ.get('STORAGE_INPUT_GRACE') or 3600)  # 输入图片最后一次使用后至少保留的秒数
+STORAGE_COLD_AFTER = int(os.environ.get('STORAGE_COLD_AFTER') or 7 * 24 * 3600)  # 结果视频完成多少秒后迁移到冷存储
+STORAGE_OUTPUT_MAX_AGE = int(os.environ.get('STORAGE_OUTPUT_MAX_AGE') or 0)  # 结果视频保留秒数，超过后删除，0 为不限
+STORAGE_HOT_MAX_BYTES = int(os.environ.get('STORAGE_HOT_MAX_BYTES') or 0)  # 热存储中结果视频占用上限（字节），0 为不限
+STORAGE_GC_BATCH = 500  # 每次查询/处理的记录数
+
+# ingest_image 保存的文件（<sha256>.<扩展名>）及其写入中的临时文件，存储清理只处理这两种文件
+_INPUT_NAME = re.compile(r'([0-9a-f]{64})\.(jpg|png|webp)')
+_INPUT_TEMP_NAME = re.compile(r'\.([0-9a-f]{64})\.[0-9a-f]{32}\.part')
+_SHARD_NAME = re.compile(r'[0-9a-f]{2}')
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+_stats_lock = threading.Lock()
+ingest_stats = {'stored': 0, 'deduplicated': 0, 'rejected': 0, 'bytes_written': 0}
+
+
+def _count(key, amount=1):
+    with _stats_lock:
+        ingest_stats[key] += amount
+
+
+class HashingSpool:
+    """
+    上传文件的暂存容器：multipart 解析器写入时同步计算 SHA-256 并保留文件开头，
+    小文件留在内存，大文件落到本地临时文件（不经过NFS）
+    """
+
+    def __init__(self):
+        self._file = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY, mode='w+b')
+        self._hash = hashlib.sha256()
+        self.head = b''
+        self.size = 0
+
+    def write(self, data):
+        self._hash.update(data)
+        if len(self.head) < HEAD_SIZE:
+            self.head += data[:HEAD_SIZE - len(self.head)]
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class IngestRequest(Request):
+    """上传文件写入 HashingSpool 的请求类（app.request_class = IngestRequest）"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpool()
+
+
+def sniff_image(head, stream=None):
+    """
+    根据文件头识别图片格式和尺寸，返回 (扩展名, 宽, 高)；不是支持的图片时返回 None
+
+    JPEG 的尺寸段可能在较大的EXIF/ICC段之后，文件头里找不到时再从 stream 中按段跳读。
+    """
+    if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR' and len(head) >= 24:
+        width, height = struct.unpack('>II', head[16:24])
+        return 'png', width, height
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP' and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', head[26:30])
+            return 'webp', width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L':
+            b0, b1, b2, b3 = head[21:25]
+            return 'webp', 1 + (b0 | (b1 & 0x3F) << 8), 1 + (b1 >> 6 | b2 << 2 | (b3 & 0x0F) << 10)
+        if chunk == b'VP8X':
+            width = 1 + int.from_bytes(head[24:27], 'little')
+            height = 1 + int.from_bytes(head[27:30], 'little')
+            return 'webp', width, height
+        return None
+    if head[:3] == b'\xff\xd8\xff':
+        size = _jpeg_size(head, stream)
+        return ('jpg',) + size if size else None
+    return None
+
+
+def _jpeg_size(head, stream=None):
+    """遍历JPEG段找到SOF段读取尺寸"""
+
+    def read(offset, count):
+        if offset + count <= len(head):
+            return head[offset:offset + count]
+        if stream is None:
+            return b''
+        stream.seek(offset)
+        return stream.read(count)
+
+    offset = 2
+    while True:
+        marker_bytes = read(offset, 2)
+        if len(marker_bytes) < 2 or marker_bytes[0] != 0xFF:
+            return None
+        marker = marker_bytes[1]
+        if marker == 0xFF:  # 填充字节
+            offset += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        if marker in (0xD9, 0xDA):  # 到了图像数据仍没有SOF段
+            return None
+        segment = read(offset + 2, 7)
+        if len(segment) < 2:
+            return None
+        if marker in _SOF_MARKERS:
+            if len(segment) < 7:
+                return None
+            height, width = struct.unpack('>HH', segment[3:7])
+            return width, height
+        offset += 2 + struct.unpack('>H', segment[:2])[0]
+
+
+def _copy_stream(src, dst):
+    """拷贝文件内容；两端都是真实文件时用 sendfile 在内核中完成拷贝"""
+    if not getattr(src, '_rolled', True):
+        # 仍在内存中的小文件直接写出（取 fileno 会先把它落到磁盘）
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        return
+    try:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+    except (AttributeError, OSError, ValueError):
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        return
+    offset = src.tell()
+    total = os.fstat(src_fd).st_size - offset
+    sent = 0
+    try:
+        while sent < total:
+            count = os.sendfile(dst_fd, src_fd, offset + sent, total - sent)
+            if count == 0:
+                break
+            sent += count
+    except OSError:
+        # 部分文件系统不支持 sendfile，退回普通拷贝
+        src.seek(offset + sent)
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def image_digest(image_path):
+    """ingest_image 保存的图片文件名即内容的SHA-256"""
+    return os.path.basename(image_path).split('.', 1)[0]
+
+
+def shard_dir(dest_dir, digest):
+    """按哈希前两级分子目录（ab/cd/），避免单个目录下文件过多"""
+    return os.path.join(dest_dir, digest[:2], digest[2:4])
+
+
+def ingest_image(file_storage, dest_dir):
+    """
+    校验并保存上传图片，文件名为内容的SHA-256（相同图片只保存一次）
+
+    上传内容由 IngestRequest 在解析时就完成哈希；其他来源的文件对象会先读一遍计算哈希。
+    文件保存在按哈希分级的子目录中（见 shard_dir）。目标文件已存在时直接复用，
+    只刷新修改时间（存储清理按修改时间判断图片最近是否被使用）。
+
+    Returns:
+        (是否成功, 保存路径, 错误信息)
+    """
+    stream = file_storage.stream
+    if isinstance(stream, HashingSpool):
+        head, digest = stream.head, stream.hexdigest()
+    else:
+        hasher = hashlib.sha256()
+        stream.seek(0)
+        head = stream.read(HEAD_SIZE)
+        hasher.update(head)
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+        digest = hasher.hexdigest()
+
+    info = sniff_image(head, stream)
+    if info is None:
+        _count('rejected')
+        return False, '', '不支持的图片格式（仅支持jpeg/png/webp）'
+    ext, width, height = info
+    if not (IMAGE_MIN_SIDE <= width <= IMAGE_MAX_SIDE and IMAGE_MIN_SIDE <= height <= IMAGE_MAX_SIDE):
+        _count('rejected')
+        return False, '', f'图片尺寸 {width}x{height} 超出允许范围（{IMAGE_MIN_SIDE}-{IMAGE_MAX_SIDE}像素）'
+
+    directory = shard_dir(dest_dir, digest)
+    path = os.path.join(directory, f'{digest}.{ext}')
+    try:
+        os.utime(path)
+        _count('deduplicated')
+        return True, path, ''
+    except FileNotFoundError:
+        pass
+    except OSError:
+        if os.path.exists(path):
+            _count('deduplicated')
+            return True, path, ''
+
+    # 先写临时文件再改名，避免其他请求读到写了一半的文件
+    temp_path = os.path.join(directory, f'.{digest}.{uuid.uuid4().hex}.part')
+    try:
+        os.makedirs(directory, exist_ok=True)
+        stream.seek(0)
+        with open(temp_path, 'wb') as f:
+            _copy_stream(stream, f)
+            written = f.tell()
+        os.replace(temp_path, path)
+    except OSError as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False, '', f'图片保存失败: {str(e)}'
+    _count('stored')
+    _count('bytes_written', written)
+    return True, path, ''
+
+
+class StorageManager:
+    """
+    上传图片和结果视频的生命周期管理（后台定期清理）
+
+    - 输入图片：按内容去重，可能被多个任务共用。没有未结束任务引用、且超过 input_grace 秒
+      未被使用的图片会被删除；被引用的判断依据是 video_tasks.image_path。
+    - 结果视频：完成超过 cold_after 秒后迁移到冷存储（未配置冷存储时不迁移）；
+      热存储超出 hot_max_bytes 时把最旧的提前迁移（无冷存储时删除）；
+      完成超过 max_age 秒后删除。层级记录在 video_tasks.storage_tier，删除后结果不再参与复用。
+
+    Args:
+        upload_dir: 上传图片目录
+        media: MediaProcessor（结果视频和封面、预览的路径）
+        find_active: find_active(image_paths) -> 仍被未结束任务引用的路径集合
+        list_outputs: list_outputs(tier, older_than, limit) -> 按完成时间从旧到新的任务记录（limit 为 None 时不限条数）
+        set_tier: set_tier(prompt_ids, tier) 更新存储层级
+    """
+
+    def __init__(self, upload_dir, media, find_active, list_outputs, set_tier, interval=STORAGE_GC_INTERVAL,
+                 input_grace=STORAGE_INPUT_GRACE, cold_after=STORAGE_COLD_AFTER, max_age=STORAGE_OUTPUT_MAX_AGE,
+                 hot_max_bytes=STORAGE_HOT_MAX_BYTES):
+        self.upload_dir = upload_dir
+        self.media = media
+        self._find_active = find_active
+        self._list_outputs = list_outputs
+        self._set_tier = set_tier
+        self.interval = interval
+        self.input_grace = input_grace
+        self.cold_after = cold_after
+        self.max_age = max_age
+        self.hot_max_bytes = hot_max_bytes
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {'sweeps': 0, 'errors': 0, 'inputs_removed': 0, 'input_bytes_removed': 0,
+                       'outputs_archived': 0, 'outputs_expired': 0, 'output_bytes_removed': 0,
+                       'last_sweep_seconds': 0}
+
+    def start(self):
+        if self._thread or not self.interval:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='storage-gc', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sweep()
+
+    def sweep(self):
+        """执行一轮清理（各步骤独立，某一步失败不影响其他步骤）"""
+        started = time.monotonic()
+        steps = [('输入图片', self.sweep_inputs), ('结果视频过期', self.expire_outputs)]
+        if self.media.cold_dir:
+            steps.append(('结果视频迁移', self.archive_outputs))
+        if self.hot_max_bytes:
+            steps.append(('热存储容量', self.enforce_hot_quota))
+        for name, step in steps:
+            try:
+                step()
+            except Exception as e:
+                self._count('errors')
+                print(f'存储清理（{name}）失败: {e}')
+        with self._lock:
+            self._stats['sweeps'] += 1
+            self._stats['last_sweep_seconds'] = round(time.monotonic() - started, 3)
+
+    # ---- 输入图片 ----
+
+    def _input_files(self):
+        """
+        上传目录中 ingest_image 保存的文件：(路径, 是否为临时文件)
+
+        只遍历 ab/cd/ 两级分片目录，文件名须为64位十六进制哈希且与所在分片一致；
+        上传目录中的其他文件（旧版本保存的图片、手工放置的文件等）不受清理影响。
+        """
+        try:
+            shards = [entry for entry in os.scandir(self.upload_dir)
+                      if _SHARD_NAME.fullmatch(entry.name) and entry.is_dir(follow_symlinks=False)]
+        except FileNotFoundError:
+            return
+        for shard in shards:
+            for sub in os.scandir(shard.path):
+                if not (_SHARD_NAME.fullmatch(sub.name) and sub.is_dir(follow_symlinks=False)):
+                    continue
+                for entry in os.scandir(sub.path):
+                    match = _INPUT_NAME.fullmatch(entry.name) or _INPUT_TEMP_NAME.fullmatch(entry.name)
+                    if (match and match.group(1)[:4] == shard.name + sub.name
+                            and entry.is_file(follow_symlinks=False)):
+                        # 路径写法与 ingest_image 返回的一致，才能和任务记录中的 image_path 对上
+                        yield os.path.join(self.upload_dir, shard.name, sub.name, entry.name), match.re is _INPUT_TEMP_NAME
+
+    def _idle_inputs(self):
+        """超过保留时间未被使用的图片路径；顺带删除残留的临时文件"""
+        deadline = time.time() - self.input_grace
+        for path, temp in self._input_files():
+            try:
+                if os.stat(path).st_mtime > deadline:
+                    continue
+                if temp:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            yield path
+
+    def sweep_inputs(self):
+        """删除没有未结束任务引用、且超过保留时间未被使用的输入图片；返回删除的文件数"""
+        removed = 0
+        batch = []
+        for path in self._idle_inputs():
+            batch.append(path)
+            if len(batch) >= STORAGE_GC_BATCH:
+                removed += self._remove_inputs(batch)
+                batch = []
+        if batch:
+            removed += self._remove_inputs(batch)
+        return removed
+
+    def _remove_inputs(self, paths):
+        active = self._find_active(paths)
+        deadline = time.time() - self.input_grace
+        removed = 0
+        for path in paths:
+            if path in active:
+                continue
+            try:
+                stat = os.stat(path)
+                # 查询期间可能有新请求复用了这张图片（ingest_image 会刷新修改时间）
+                if stat.st_mtime > deadline:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            self._count('input_bytes_removed', stat.st_size)
+        self._count('inputs_removed', removed)
+        return removed
+
+    # ---- 结果视频 ----
+
+    def _drain(self, tier, older_than, handle):
+        """分批处理某一层级中完成超过 older_than 秒的结果，handle(task) 返回新层级；返回处理的任务数"""
+        total = 0
+        while not self._stop.is_set():
+            tasks = self._list_outputs(tier, older_than, STORAGE_GC_BATCH)
+            moved = {}
+            for task in tasks:
+                moved.setdefault(handle(task), []).append(task['prompt_id'])
+            for new_tier, prompt_ids in moved.items():
+                if not self._set_tier(prompt_ids, new_tier):
+                    return total
+            total += len(tasks)
+            if len(tasks) < STORAGE_GC_BATCH:
+                break
+        return total
+
+    def _expire(self, task):
+        freed = self.media.remove(task)
+        self._count('outputs_expired')
+        self._count('output_bytes_removed', freed)
+        return 'expired'
+
+    def _archive(self, task):
+        size = self.media.archive(task)
+        if size is None:
+            # 结果文件已丢失，不再参与复用
+            self._count('outputs_expired')
+            return 'expired'
+        self._count('outputs_archived')
+        return 'cold'
+
+    def expire_outputs(self):
+        """删除完成超过 max_age 秒的结果视频（含冷存储）"""
+        if not self.max_age:
+            return 0
+        return (self._drain('hot', self.max_age, self._expire)
+                + self._drain('cold', self.max_age, self._expire))
+
+    def archive_outputs(self):
+        """把完成超过 cold_after 秒的结果视频迁移到冷存储"""
+        return self._drain('hot', self.cold_after, self._archive)
+
+    def _hot_outputs(self):
+        """
+        热存储中的结果视频 [(任务, 文件大小)]，按完成时间从旧到新
+
+        只统计 hot_video_path 管理的文件：封面、预览以及输出目录中不属于任务的文件无法通过迁移释放，不计入占用。
+        """
+        outputs = []
+        for task in self._list_outputs('hot', None, None):
+            path = self.media.hot_video_path(task)
+            try:
+                size = os.stat(path).st_size if path else 0
+            except FileNotFoundError:
+                size = 0
+            outputs.append((task, size))
+        return outputs
+
+    def enforce_hot_quota(self):
+        """热存储中结果视频的占用超出上限时按完成时间从旧到新迁移（无冷存储时删除），直到降到上限的90%以下"""
+        outputs = self._hot_outputs()
+        usage = sum(size for _, size in outputs)
+        if usage <= self.hot_max_bytes:
+            return 0
+        target = self.hot_max_bytes * 0.9
+        handle = self._archive if self.media.cold_dir else self._expire
+        handled = 0
+        moved = {}
+        for task, size in outputs:
+            if usage <= target or self._stop.is_set():
+                break
+            if not size:
+                continue  # 热存储中没有文件，处理它不会释放空间
+            moved.setdefault(handle(task), []).append(task['prompt_id'])
+            usage -= size
+            handled += 1
+            if handled % STORAGE_GC_BATCH == 0:
+                if not self._flush_tiers(moved):
+                    return handled
+                moved = {}
+        self._flush_tiers(moved)
+        print(f'热存储超出上限，处理了{handled}个结果视频')
+        return handled
+
+    def _flush_tiers(self, moved):
+        for new_tier, prompt_ids in moved.items():
+            if not self._set_tier(prompt_ids, new_tier):
+                return False
+        return True
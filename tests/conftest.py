@@ -0,0 +1,160 @@
+import importlib
+import itertools
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymysql.constants import SERVER_STATUS  # noqa: E402
+
+from db import db  # noqa: E402
+from db.pool import ConnectionPool  # noqa: E402
+
+
+class FakeCursor:
+    """按顺序返回预设的 rowcount/lastrowid/结果行，并记录执行过的SQL"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+        self.lastrowid = None
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        self.connection.executed.append((' '.join(sql.split()), params))
+        if self.connection.results:
+            result = self.connection.results.pop(0)
+            if isinstance(result, Exception):
+                raise result  # 预设的异常：模拟执行出错
+            self.rowcount, self.lastrowid, self._rows = result
+        else:
+            self.rowcount, self.lastrowid, self._rows = 0, None, []
+        if sql.lstrip().upper().startswith(('UPDATE', 'INSERT', 'DELETE')):
+            self.connection.server_status |= SERVER_STATUS.SERVER_STATUS_IN_TRANS
+        return self.rowcount
+
+    def executemany(self, sql, seq_of_params):
+        """与 PyMySQL 一样把多组参数作为一条语句执行（只消耗一个预设结果）"""
+        return self.execute(sql, list(seq_of_params))
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+    """本地替身：不连接MySQL，记录 ping/commit/rollback/close 调用"""
+
+    def __init__(self, results=None):
+        self.open = True
+        self.server_status = 0
+        self.results = list(results or [])  # [(rowcount, lastrowid, rows)]
+        self.executed = []
+        self.pings = 0
+        self.commits = 0
+        self.rollbacks = 0
+        self.ping_error = None
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if self.ping_error:
+            raise self.ping_error
+
+    def commit(self):
+        self.commits += 1
+        self.server_status &= ~SERVER_STATUS.SERVER_STATUS_IN_TRANS
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.server_status &= ~SERVER_STATUS.SERVER_STATUS_IN_TRANS
+
+    def close(self):
+        self.open = False
+
+
+class FakeConnector:
+    """ConnectionPool(connect=...) 的连接工厂，记录创建过的连接"""
+
+    def __init__(self, results=None):
+        self.results = results
+        self.connections = []
+
+    def __call__(self):
+        connection = FakeConnection(self.results)
+        self.connections.append(connection)
+        return connection
+
+
+@pytest.fixture
+def fake_db():
+    """把 db 模块的连接池替换为假连接池，测试结束后恢复"""
+    saved = dict(db._pools)
+    connector = FakeConnector()
+    pool = ConnectionPool(connector, max_size=2, timeout=1)
+    db.set_pool(pool)
+    yield connector, pool
+    with db._pools_lock:
+        db._pools.clear()
+        db._pools.update(saved)
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """
+    导入 app（整个测试会话只导入一次）：数据库换成假连接池，ComfyUI换成 bench 的假服务器，不做迁移和存储清理
+
+    假连接的查询默认返回空结果，接口测试中需要的数据库函数由各测试用 monkeypatch 替换。
+    """
+    from bench.fake_comfyui import FakeComfyUIServer
+
+    server = FakeComfyUIServer(exec_seconds=60).start()
+    root = tmp_path_factory.mktemp('app')
+    saved = dict(db._pools)
+    db.set_pool(ConnectionPool(FakeConnector(), max_size=8, timeout=1))
+    with pytest.MonkeyPatch.context() as mp:
+        for key, value in {'COMFYUI_URLS': server.url, 'COMFYUI_TRANSFER_MODE': 'upload', 'AUTO_MIGRATE': '0',
+                           'UPLOAD_FOLDER': str(root / 'upload'), 'MEDIA_DIR': str(root / 'media'),
+                           'STORAGE_GC_INTERVAL': '0', 'WARMUP_TIMEOUT': '5'}.items():
+            mp.setenv(key, value)
+        module = importlib.import_module('app')
+    yield module
+    module.dispatcher.stop()
+    module.tracker.stop()
+    server.shutdown()
+    server.server_close()
+    with db._pools_lock:
+        db._pools.clear()
+        db._pools.update(saved)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+_user_ids = itertools.count(1000)
+
+
+@pytest.fixture
+def auth_headers(app_module):
+    """签发访问令牌（不经过登录接口），积分快照为 points；不指定 user_id 时每次用新用户，不受排队上限影响"""
+
+    def make(user_id=None, points=1000):
+        user_id = next(_user_ids) if user_id is None else user_id
+        user = {'id': user_id, 'name': f'user{user_id}', 'email': f'user{user_id}@example.com', 'points': points}
+        return {'Authorization': 'Bearer ' + app_module.token_service.issue_access(user)}
+
+    return make
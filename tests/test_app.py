@@ -0,0 +1,98 @@
+import pytest
+
+from ai.dispatcher import SubmissionDispatcher
+from ai.pricing import PRICING_MAX_LENGTH
+from ai.scheduler import FairScheduler
+from db import db
+
+
+@pytest.fixture
+def reserved(monkeypatch):
+    """记录 reserve_video_task 的参数，预扣总是成功"""
+    calls = []
+
+    def reserve(user_id, points, prompt_id, **task):
+        calls.append(dict(task, user_id=user_id, points=points, prompt_id=prompt_id))
+        return 'ok', 1000 - points
+
+    monkeypatch.setattr(db, 'reserve_video_task', reserve)
+    return calls
+
+
+@pytest.mark.parametrize('duration', ['2', '3', '5', '8'])
+@pytest.mark.parametrize('fps', ['12', '16', '24', '30'])
+def test_text_to_video_accepts_every_ui_option(client, auth_headers, reserved, duration, fps):
+    response = client.post('/api/generate-video', headers=auth_headers(), data={
+        'prompt': '海边日落', 'style': 'realistic', 'duration': duration, 'fps': fps,
+        'width': '832', 'height': '480'})
+    assert response.status_code == 202, response.json
+    task = reserved[-1]
+    assert task['template'] == 'wan2_2_5B_t2v' and task['image_path'] == ''
+    frames = int(duration) * int(fps)
+    assert task['length'] == frames // 4 * 4 + 1 <= PRICING_MAX_LENGTH  # Wan 需要 4k+1 帧
+    assert response.json['length'] == task['length']
+    assert task['positive_prompt'].startswith('海边日落，')
+
+
+def test_text_to_video_clamps_long_duration(client, auth_headers, reserved):
+    response = client.post('/api/generate-video', headers=auth_headers(), data={
+        'prompt': '城市夜景', 'duration': '120', 'fps': '30', 'width': '640', 'height': '640'})
+    assert response.status_code == 202, response.json
+    length = reserved[-1]['length']
+    assert length == PRICING_MAX_LENGTH and (length - 1) % 4 == 0
+
+
+def test_text_to_video_rejects_bad_duration(client, auth_headers, reserved):
+    for duration in ('0', 'abc'):
+        response = client.post('/api/generate-video', headers=auth_headers(), data={
+            'prompt': '城市夜景', 'duration': duration, 'fps': '16', 'width': '640', 'height': '640'})
+        assert response.status_code == 400
+    assert reserved == []
+
+
+def queued_rows(user_id, count):
+    return [{'prompt_id': f'r{user_id}-{i}', 'user_id': user_id, 'template': 'wan2_2_14B_i2v', 'image_path': 'a.png',
+             'positive_prompt': 'p', 'negative_prompt': '', 'width': 640, 'height': 640, 'length': 81, 'fps': 16,
+             'filename_prefix': f'video/r{i}'} for i in range(count)]
+
+
+@pytest.fixture
+def recovery(app_module, monkeypatch):
+    """让 recover_tasks 重新执行恢复，数据库中的排队任务和退款记录由测试提供"""
+    refunds = []
+    monkeypatch.setattr(app_module, 'recovered', set())
+    monkeypatch.setattr(db, 'get_active_video_tasks', lambda: [])
+    monkeypatch.setattr(db, 'refund_video_task', lambda prompt_id, user_id: refunds.append(prompt_id) or True)
+    dispatchers = []
+
+    def run(rows, job_queue=None, max_queue=100):
+        monkeypatch.setattr(db, 'get_queued_video_tasks', lambda: rows)
+        dispatcher = SubmissionDispatcher(lambda job: job.prompt_id, workers=1, max_queue=max_queue,
+                                          job_queue=job_queue)
+        dispatchers.append(dispatcher)
+        monkeypatch.setattr(app_module, 'dispatcher', dispatcher)
+        app_module.recover_tasks()
+        return dispatcher
+
+    yield run, refunds
+    for dispatcher in dispatchers:
+        dispatcher.stop()
+
+
+def test_recovered_jobs_bypass_queue_caps(recovery):
+    run, refunds = recovery
+    # 不给并发名额，恢复的任务全部留在队列中
+    scheduler = FairScheduler(lambda: 0, max_queue=5, user_max_queued=10)
+    dispatcher = run(queued_rows(7, 12) + queued_rows(8, 1), job_queue=scheduler)
+    assert scheduler.qsize() == 13 and refunds == []
+    assert dispatcher.stats()['enqueued'] == 13
+    # 恢复的任务不影响之后新任务的上限检查
+    assert scheduler.user_full(7)
+
+
+def test_unrecoverable_jobs_are_refunded(recovery):
+    run, refunds = recovery
+    # 普通队列不支持越过容量恢复：放不下的任务退还积分，而不是一直停留在 queued
+    rows = queued_rows(9, 4)
+    run(rows, max_queue=2)
+    assert refunds == [row['prompt_id'] for row in rows[2:]]
@@ -0,0 +1,125 @@
+import json
+import time
+import uuid
+
+import pytest
+
+from ai.backends import BackendPool, NoBackendAvailable
+from bench.fake_comfyui import FakeComfyUIServer
+
+MODELS_14B = frozenset({'wan2.2_i2v_14B.safetensors'})
+MODELS_5B = frozenset({'wan2.2_ti2v_5B.safetensors'})
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(count):
+        for _ in range(count):
+            started.append(FakeComfyUIServer(exec_seconds=60).start())
+        return started[-count:]
+
+    yield start
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+def submit(backend, count):
+    """直接向假后端提交任务，让它的 /queue 里有排队任务"""
+    for _ in range(count):
+        backend.client.request_json('POST', '/prompt', body=json.dumps({'prompt_id': str(uuid.uuid4())}).encode(),
+                                    headers={'Content-Type': 'application/json'}, timeout=5)
+
+
+def by_url(pool, server):
+    return next(b for b in pool.backends if b.url == server.url)
+
+
+def test_prefers_resident_models_then_queue_depth(servers):
+    a, b = servers(2)
+    pool = BackendPool([a.url, b.url], swap_penalty=2)
+    assert pool.poll_all() == 2
+    by_url(pool, b).resident_models = MODELS_14B
+
+    # 模型已驻留的后端优先，直到它的排队深度超过换模型的代价
+    chosen = [backend.url for backend in pool.acquire_many(MODELS_14B, 3)]
+    assert chosen[:2] == [b.url, b.url]
+
+    # 探测后按 /queue 的真实排队深度打分
+    submit(by_url(pool, b), 5)
+    assert pool.poll_all() == 2
+    assert by_url(pool, b).queue_running + by_url(pool, b).queue_pending == 5
+    assert pool.acquire(MODELS_14B).url == a.url
+
+
+def test_failing_backend_is_ejected_and_recovers_after_cooldown(servers):
+    good, bad = servers(2)
+    bad.available = False
+    pool = BackendPool([good.url, bad.url], fail_threshold=2, eject_seconds=0.3)
+    pool.poll_all()
+    pool.poll_all()
+    failing = by_url(pool, bad)
+    assert not failing.healthy and failing.failures == 2
+    assert all(backend.url == good.url for backend in pool.acquire_many(frozenset(), 4))
+
+    # 冷却期内即使探测成功也不重新加入
+    bad.available = True
+    pool.poll(failing)
+    assert not failing.healthy
+
+    time.sleep(0.35)
+    assert pool.poll(failing)
+    assert failing.healthy and failing.failures == 0
+
+
+def test_submit_failures_eject_backend(servers):
+    (server,) = servers(1)
+    pool = BackendPool([server.url], fail_threshold=2, eject_seconds=60)
+    for _ in range(2):
+        pool.release(pool.acquire(), success=False, submitted=False)
+    with pytest.raises(NoBackendAvailable):
+        pool.acquire()
+
+
+def test_dedicated_backend_routing(servers):
+    public, dedicated = servers(2)
+    pool = BackendPool([public.url], dedicated={dedicated.url: MODELS_5B})
+    pool.poll_all()
+    assert pool.has_dedicated(MODELS_5B)
+    assert pool.acquire(MODELS_5B).url == dedicated.url
+    assert pool.acquire(MODELS_14B).url == public.url
+    assert pool.count_available() == 1 and pool.count_available(dedicated=True) == 1
+
+    # 专用后端不可用时文生视频改用公共后端
+    dedicated.available = False
+    pool.fail_threshold = 1
+    pool.poll(by_url(pool, dedicated))
+    assert not pool.has_dedicated(MODELS_5B)
+    assert pool.acquire(MODELS_5B).url == public.url
+
+    # 公共后端全部不可用时其他工作流也可以分到专用后端
+    dedicated.available = True
+    by_url(pool, dedicated).ejected_until = 0
+    pool.poll(by_url(pool, dedicated))
+    public.available = False
+    pool.poll(by_url(pool, public))
+    assert pool.acquire(MODELS_14B).url == dedicated.url
+
+
+def test_hung_backend_does_not_delay_other_probes(servers):
+    fast, hung = servers(2)
+    hung.probe_delay = 2
+    pool = BackendPool([hung.url, fast.url], poll_interval=0.05)
+    pool.start()
+    try:
+        time.sleep(0.5)
+        assert by_url(pool, fast).last_poll > 0
+        first = by_url(pool, fast).last_poll
+        time.sleep(0.3)
+        assert by_url(pool, fast).last_poll > first  # 慢后端还在探测中，快后端照常更新
+        assert by_url(pool, hung).last_poll == 0
+    finally:
+        hung.probe_delay = 0
+        pool.stop()
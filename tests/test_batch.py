@@ -0,0 +1,129 @@
+import hashlib
+import io
+import json
+import struct
+import zlib
+
+import pytest
+
+from db import db
+
+
+def png(width=64, height=64):
+    """最小的合法PNG（灰度，全黑）"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    raw = b''.join(b'\x00' + b'\x00' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+@pytest.fixture
+def batch_db(monkeypatch):
+    """替换批量接口用到的数据库函数：记录预扣调用，结果缓存由测试预设"""
+    state = {'reserved': [], 'cached': {}}
+
+    def reserve_many(user_id, points, tasks):
+        state['reserved'].append((user_id, points, tasks))
+        return 'ok', 100000 - points
+
+    monkeypatch.setattr(db, 'reserve_video_tasks', reserve_many)
+    monkeypatch.setattr(db, 'find_cached_video_tasks_many',
+                        lambda keys, ttl: {key: state['cached'][key] for key in keys if key in state['cached']})
+    return state
+
+
+def post_batch(client, headers, param_sets, **form):
+    data = dict({'image': (io.BytesIO(png()), 'a.png'), 'params': json.dumps(param_sets), 'fps': '16'}, **form)
+    return client.post('/api/generate-video/batch', headers=headers, data=data)
+
+
+def sets(count):
+    return [{'positive_prompt': f'p{i}', 'width': 480, 'height': 480, 'length': 33} for i in range(count)]
+
+
+def test_full_batch_is_accepted_for_user_with_empty_queue(app_module, client, auth_headers, batch_db):
+    assert app_module.GENERATE_BATCH_MAX <= app_module.SCHEDULER_USER_MAX_QUEUED
+    count = app_module.GENERATE_BATCH_MAX
+    response = post_batch(client, auth_headers(points=100000), sets(count))
+    assert response.status_code == 202, response.json
+    assert [task['status'] for task in response.json['tasks']] == ['queued'] * count
+    (user_id, points, rows), = batch_db['reserved']
+    assert len(rows) == count and points == sum(row['points_consumed'] for row in rows)
+    assert response.json['points_consumed'] == points
+
+
+def test_batch_over_limit_is_rejected(app_module, client, auth_headers, batch_db):
+    response = post_batch(client, auth_headers(), sets(app_module.GENERATE_BATCH_MAX + 1))
+    assert response.status_code == 400
+    assert batch_db['reserved'] == []
+
+
+def test_batch_reuses_duplicates_and_cached_results(app_module, client, auth_headers, batch_db):
+    template = app_module.templates.get(app_module.DEFAULT_TEMPLATE)
+    digest = hashlib.sha256(png()).hexdigest()
+    params = dict(sets(1)[0], negative_prompt='', fps=16)
+    key = template.request_key(params, digest)
+    batch_db['cached'][key] = [{'prompt_id': 'other', 'user_id': -1, 'status': 'running', 'progress': 40,
+                                'backend': 'http://b', 'output_path': None, 'started_at': None, 'completed_at': None}]
+
+    response = post_batch(client, auth_headers(), sets(2) + sets(2))
+    assert response.status_code == 202, response.json
+    tasks = response.json['tasks']
+    # 第一组复用其他用户正在生成的任务，后两组与前面重复，不另外生成
+    assert tasks[0] == {'prompt_id': 'other', 'status': 'running', 'cached': True, 'points_consumed': 0}
+    assert tasks[2]['prompt_id'] == 'other' and tasks[3]['prompt_id'] == tasks[1]['prompt_id']
+    (_, points, rows), = batch_db['reserved']
+    assert [row['attached'] for row in rows] == [1, 0]
+    assert points == tasks[1]['points_consumed'] == response.json['points_consumed']
+
+
+def test_batch_insufficient_points(client, auth_headers, batch_db):
+    response = post_batch(client, auth_headers(points=0), sets(2))
+    assert response.status_code == 402
+    assert batch_db['reserved'] == []
+
+
+def test_reserve_video_tasks_inserts_all_rows_in_one_transaction(fake_db):
+    connector, pool = fake_db
+    connector.results = [(1, 880, []), (2, None, [])]
+    rows = [{'prompt_id': 'a', 'points_consumed': 60, 'status': 'queued'},
+            {'prompt_id': 'b', 'points_consumed': 60, 'status': 'queued'}]
+    assert db.reserve_video_tasks(1, 120, rows) == ('ok', 880)
+    connection = connector.connections[0]
+    update, insert = connection.executed
+    assert update[1] == (120, 1, 120)
+    assert insert[0].startswith('INSERT INTO video_tasks (user_id, prompt_id,')
+    assert [params[:2] for params in insert[1]] == [(1, 'a'), (1, 'b')]
+    assert connection.commits == 1 and pool.stats()['checked_out'] == 0
+
+
+def test_reserve_video_tasks_insufficient(fake_db):
+    connector, _ = fake_db
+    connector.results = [(0, None, [])]
+    assert db.reserve_video_tasks(1, 120, [{'prompt_id': 'a'}]) == ('insufficient', None)
+    connection = connector.connections[0]
+    assert len(connection.executed) == 1 and connection.rollbacks == 1
+
+
+def test_reserve_video_tasks_only_attached_rows(fake_db):
+    connector, _ = fake_db
+    connector.results = [(1, None, [{'points': 70}]), (1, None, [])]
+    assert db.reserve_video_tasks(1, 0, [{'prompt_id': 'a', 'attached': 1}]) == ('ok', 70)
+    assert connector.connections[0].executed[0][0] == 'SELECT points FROM users WHERE id = %s'
+
+
+def test_find_cached_video_tasks_many_groups_by_key(fake_db):
+    connector, _ = fake_db
+    assert db.find_cached_video_tasks_many([], 60) == {}
+    assert connector.connections == []  # 没有哈希时不查询
+
+    connector.results = [(3, None, [{'request_key': 'k1', 'prompt_id': 'p3'}, {'request_key': 'k2', 'prompt_id': 'p2'},
+                                    {'request_key': 'k1', 'prompt_id': 'p1'}])]
+    found = db.find_cached_video_tasks_many(['k1', 'k2', 'k3'], 60)
+    assert {key: [row['prompt_id'] for row in rows] for key, rows in found.items()} == {'k1': ['p3', 'p1'],
+                                                                                         'k2': ['p2']}
+    sql, params = connector.connections[0].executed[0]
+    assert 'request_key IN (%s, %s, %s)' in sql
+    assert params == ['k1', 'k2', 'k3', 60, 60]
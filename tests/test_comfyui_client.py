@@ -0,0 +1,62 @@
+import json
+import socket
+import time
+
+import pytest
+
+from ai.comfyui_functions import KeepAliveClient, submit_payload, upload_image
+from bench.fake_comfyui import FakeComfyUIServer
+
+
+@pytest.fixture
+def server():
+    server = FakeComfyUIServer(exec_seconds=60).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def stale_connection():
+    """模拟已被服务端关闭的空闲长连接：对端接受连接后立即关闭"""
+    listener = socket.create_server(('127.0.0.1', 0))
+    connections = []
+
+    def make(client):
+        conn = client._new_connection(5)
+        conn.sock = socket.create_connection(listener.getsockname())
+        peer, _ = listener.accept()
+        peer.close()
+        time.sleep(0.05)
+        connections.append(conn)
+        return conn
+
+    yield make
+    for conn in connections:
+        conn.close()
+    listener.close()
+
+
+def test_stale_connection_is_retried_for_bytes_body(server, stale_connection):
+    client = KeepAliveClient(server.url)
+    stale = stale_connection(client)
+    client._idle.append(stale)
+    assert submit_payload(client, json.dumps({'prompt_id': 'p1'}).encode()) == 'p1'
+    assert stale.sock is None  # 失效的连接被关闭，换新连接重发
+    assert server.counts['prompt'] == 1
+    client.close()
+
+
+def test_streaming_upload_does_not_use_pooled_connection(server, stale_connection, tmp_path):
+    client = KeepAliveClient(server.url)
+    stale = stale_connection(client)
+    client._idle.append(stale)
+    image = tmp_path / 'a.png'
+    image.write_bytes(b'x' * 1024)
+
+    # 迭代器请求体无法重放，直接用新连接发送，不会因为复用失效连接而失败
+    assert upload_image(client, str(image), 'a.png').endswith('.png')
+    assert server.counts['upload'] == 1
+    assert stale in client._idle
+    assert len(client._idle) == 2  # 上传用的新连接完成后放回池中
+    client.close()
@@ -0,0 +1,114 @@
+import threading
+import time
+
+import pytest
+
+from ai.dispatcher import PermanentSubmitError, SubmissionDispatcher, SubmissionJob
+
+
+class Recorder:
+    def __init__(self, fail=None):
+        self.fail = fail or {}  # prompt_id -> 还要失败的次数
+        self.calls = []
+        self.submitted = []
+        self.failed = []
+        self.done = threading.Event()
+
+    def submit(self, job):
+        self.calls.append((job.prompt_id, time.monotonic()))
+        if self.fail.get(job.prompt_id):
+            self.fail[job.prompt_id] -= 1
+            raise ConnectionError('后端不可用')
+        return job.prompt_id
+
+    def submit_batch(self, jobs):
+        return [self._try(job) for job in jobs]
+
+    def _try(self, job):
+        try:
+            return self.submit(job)
+        except Exception as e:
+            return e
+
+    def on_submitted(self, job, prompt_id):
+        self.submitted.append(prompt_id)
+
+    def on_failed(self, job, error):
+        self.failed.append(job.prompt_id)
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('等待超时')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def make_dispatcher():
+    started = []
+
+    def make(recorder, **kwargs):
+        dispatcher = SubmissionDispatcher(recorder.submit, on_submitted=recorder.on_submitted,
+                                          on_failed=recorder.on_failed, **kwargs)
+        dispatcher.start()
+        started.append(dispatcher)
+        return dispatcher
+
+    yield make
+    for dispatcher in started:
+        dispatcher.stop()
+
+
+def test_backoff_does_not_block_worker(make_dispatcher):
+    recorder = Recorder(fail={'a': 1})
+    dispatcher = make_dispatcher(recorder, workers=1, backoff=0.5)
+    dispatcher.enqueue(SubmissionJob('a', 1, {}))
+    wait_until(lambda: recorder.calls)
+    dispatcher.enqueue(SubmissionJob('b', 1, {}))
+
+    # 唯一的工作线程在 a 退避期间照常提交 b
+    wait_until(lambda: recorder.submitted == ['b'], timeout=0.3)
+    assert dispatcher.stats()['retry_pending'] == 1
+    wait_until(lambda: recorder.submitted == ['b', 'a'])
+    first, retry = [at for prompt_id, at in recorder.calls if prompt_id == 'a']
+    assert retry - first >= 0.5 * 0.8
+    assert dispatcher.stats()['retried'] == 1 and dispatcher.stats()['retry_pending'] == 0
+
+
+def test_gives_up_after_max_retries(make_dispatcher):
+    recorder = Recorder(fail={'a': 10})
+    dispatcher = make_dispatcher(recorder, workers=2, backoff=0.01, max_retries=2)
+    dispatcher.enqueue(SubmissionJob('a', 1, {}))
+    wait_until(lambda: recorder.failed == ['a'])
+    assert len(recorder.calls) == 3
+    assert dispatcher.stats()['failed'] == 1
+
+
+def test_permanent_error_is_not_retried(make_dispatcher):
+    recorder = Recorder()
+
+    def reject(job):
+        recorder.calls.append((job.prompt_id, time.monotonic()))
+        raise PermanentSubmitError('工作流无效')
+
+    recorder.submit = reject
+    dispatcher = make_dispatcher(recorder, workers=1, backoff=0.01)
+    dispatcher.enqueue(SubmissionJob('a', 1, {}))
+    wait_until(lambda: recorder.failed == ['a'])
+    assert len(recorder.calls) == 1 and dispatcher.stats()['retried'] == 0
+
+
+def test_failed_batch_jobs_are_requeued(make_dispatcher):
+    recorder = Recorder(fail={'a': 1, 'c': 1})
+    dispatcher = make_dispatcher(recorder, workers=1, backoff=0.2, submit_batch=recorder.submit_batch,
+                                 batch_window=0.15)
+    dispatcher.enqueue_many([SubmissionJob(prompt_id, 1, {}) for prompt_id in 'abc'])
+    wait_until(lambda: recorder.submitted == ['b'], timeout=0.3)
+
+    # 失败的两个任务退避到期后一起被收集，再作为一批提交
+    wait_until(lambda: sorted(recorder.submitted) == ['a', 'b', 'c'])
+    stats = dispatcher.stats()
+    assert stats['batches'] == 2 and stats['batched_jobs'] == 5
+    assert stats['retried'] == 2 and stats['failed'] == 0
@@ -0,0 +1,94 @@
+import threading
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from db import db
+from passwords import HasherBusy, PasswordHasher
+
+FAST_METHOD = 'scrypt:1024:8:1'
+
+
+class FakeExecutor:
+    """在调用线程中执行的进程池替身；broken 时模拟工作进程异常退出"""
+
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.submitted = 0
+
+    def submit(self, func, *args):
+        self.submitted += 1
+        if self.broken:
+            raise BrokenProcessPool('工作进程被杀掉')
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+
+def test_rejects_when_pending_limit_reached():
+    hasher = PasswordHasher(workers=0, method=FAST_METHOD, max_pending=1)
+    entered, release = threading.Event(), threading.Event()
+
+    def slow():
+        entered.set()
+        release.wait(5)
+
+    thread = threading.Thread(target=hasher._run, args=(slow,))
+    thread.start()
+    entered.wait(5)
+    with pytest.raises(HasherBusy):
+        hasher.hash('secret')
+    release.set()
+    thread.join(5)
+    assert hasher.stats()['rejected_busy'] == 1
+    assert check_password_hash(hasher.hash('secret'), 'secret')  # 名额释放后恢复
+
+
+def test_broken_pool_is_rebuilt(monkeypatch):
+    hasher = PasswordHasher(workers=1, method=FAST_METHOD)
+    hasher._executor = FakeExecutor(broken=True)
+    rebuilt = FakeExecutor()
+    monkeypatch.setattr(hasher, 'start', lambda: setattr(hasher, '_executor', rebuilt))
+
+    with pytest.raises(HasherBusy):
+        hasher.hash('secret')
+    assert hasher._executor is None
+    # 下一个请求重新创建进程池
+    assert check_password_hash(hasher.hash('secret'), 'secret')
+    assert rebuilt.submitted == 1 and hasher.stats()['hashed'] == 1
+
+
+def test_legacy_hash_is_upgraded():
+    hasher = PasswordHasher(workers=0, method=FAST_METHOD)
+    legacy = generate_password_hash('secret', method='pbkdf2:sha256:1000')
+    ok, new_hash = hasher.verify(legacy, 'secret')
+    assert ok and new_hash.startswith(FAST_METHOD + '$') and check_password_hash(new_hash, 'secret')
+    assert hasher.verify(new_hash, 'secret') == (True, None)
+    assert hasher.verify(legacy, 'wrong') == (False, None)
+    stats = hasher.stats()
+    assert stats['verified'] == 3 and stats['rehashed'] == 1
+
+
+def test_unknown_user_still_computes_hash(monkeypatch):
+    hasher = PasswordHasher(workers=0, method=FAST_METHOD)
+    calls = []
+    run = hasher._run
+    monkeypatch.setattr(hasher, '_run', lambda func, *args: calls.append(args[0]) or run(func, *args))
+    assert hasher.verify(None, 'secret') == (False, None)
+    assert hasher.verify(None, 'other') == (False, None)
+    # 与同一个假哈希比较，耗时与用户存在时相同
+    assert calls[0] == calls[1] and calls[0].startswith(FAST_METHOD + '$')
+    assert hasher.stats()['verified'] == 0
+
+
+def test_login_returns_503_when_hasher_busy(app_module, client, monkeypatch):
+    monkeypatch.setattr(db, 'get_user_by_email', lambda email: None)
+
+    def busy(hashed, password):
+        raise HasherBusy('登录请求过多，请稍后重试')
+
+    monkeypatch.setattr(app_module.password_hasher, 'verify', busy)
+    response = client.post('/api/login', json={'email': 'busy@example.com', 'password': 'secret'})
+    assert response.status_code == 503 and response.headers['Retry-After'] == '1'
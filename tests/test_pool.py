@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+from pymysql.constants import SERVER_STATUS
+
+from conftest import FakeConnector
+from db import db
+from db.pool import ConnectionPool, PoolTimeout
+
+
+def wait_until(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('等待超时')
+        time.sleep(0.005)
+
+
+def test_reuses_idle_connection():
+    connector = FakeConnector()
+    pool = ConnectionPool(connector, max_size=2)
+    first = pool.acquire()
+    first.close()
+    second = pool.acquire()
+    assert len(connector.connections) == 1
+    second.close()
+    assert pool.stats()['checked_out'] == 0
+
+
+def test_waiters_are_served_in_fifo_order():
+    pool = ConnectionPool(FakeConnector(), max_size=1, timeout=5)
+    held = pool.acquire()
+    order = []
+
+    def borrow(name):
+        connection = pool.acquire()
+        order.append(name)
+        connection.close()
+
+    threads = []
+    for i, name in enumerate(['first', 'second', 'third']):
+        thread = threading.Thread(target=borrow, args=(name,))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: pool.stats()['waiting'] == i + 1)
+
+    held.close()
+    for thread in threads:
+        thread.join(5)
+    assert order == ['first', 'second', 'third']
+    assert pool.stats()['waits'] == 3
+
+
+def test_wait_timeout():
+    pool = ConnectionPool(FakeConnector(), max_size=1, timeout=0.05)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert pool.stats()['wait_timeouts'] == 1
+    assert pool.stats()['waiting'] == 0
+    held.close()
+
+
+def test_ping_before_reuse_and_replace_dead_connection():
+    connector = FakeConnector()
+    pool = ConnectionPool(connector, max_size=1, ping_interval=0)
+    pool.acquire().close()
+    connection = pool.acquire()
+    assert connector.connections[0].pings == 1
+    connection.close()
+
+    connector.connections[0].ping_error = ConnectionError('server has gone away')
+    connection = pool.acquire()
+    assert len(connector.connections) == 2
+    assert not connector.connections[0].open
+    assert pool.stats()['health_check_failures'] == 1
+    assert pool.stats()['size'] == 1
+    connection.close()
+
+
+def test_recycle_idle_connection():
+    connector = FakeConnector()
+    pool = ConnectionPool(connector, max_size=1, recycle=0.01, ping_interval=3600)
+    pool.acquire().close()
+    time.sleep(0.02)
+    pool.acquire().close()
+    assert len(connector.connections) == 2
+    assert not connector.connections[0].open
+    assert connector.connections[0].pings == 0
+    assert pool.stats()['recycled'] == 1
+
+
+def test_release_rolls_back_open_transaction():
+    connector = FakeConnector()
+    pool = ConnectionPool(connector, max_size=1)
+    connection = pool.acquire()
+    connector.connections[0].server_status |= SERVER_STATUS.SERVER_STATUS_IN_TRANS
+    connection.close()
+    assert connector.connections[0].rollbacks == 1
+
+    connection = pool.acquire()
+    connection.close()
+    assert connector.connections[0].rollbacks == 1  # 没有未提交事务时不回滚
+
+
+def test_release_discards_closed_connection():
+    connector = FakeConnector()
+    pool = ConnectionPool(connector, max_size=1)
+    connection = pool.acquire()
+    connector.connections[0].open = False
+    connection.close()
+    assert pool.stats()['size'] == 0
+    pool.acquire().close()
+    assert len(connector.connections) == 2
+
+
+def test_reserve_video_task_insufficient_points(fake_db):
+    connector, pool = fake_db
+    connector.results = [(0, None, [])]  # 条件扣减没有命中任何行
+    status, remaining = db.reserve_video_task(1, 50, 'p1', 'a.png', 'pos', 'neg', 640, 640, 81, 16)
+    assert (status, remaining) == ('insufficient', None)
+    connection = connector.connections[0]
+    assert len(connection.executed) == 1  # 不写任务记录
+    assert connection.rollbacks == 1 and connection.commits == 0
+    assert pool.stats()['checked_out'] == 0
+
+
+def test_reserve_video_task_ok(fake_db):
+    connector, pool = fake_db
+    connector.results = [(1, 950, []), (1, 7, [])]
+    status, remaining = db.reserve_video_task(1, 50, 'p1', 'a.png', 'pos', 'neg', 640, 640, 81, 16)
+    assert (status, remaining) == ('ok', 950)
+    connection = connector.connections[0]
+    assert connection.executed[1][0].startswith('INSERT INTO video_tasks')
+    assert connection.commits == 1
+    assert pool.stats()['checked_out'] == 0
+
+
+def test_refund_video_task_without_queued_task(fake_db):
+    connector, pool = fake_db
+    connector.results = [(0, None, [])]  # 任务已不是 queued（已提交或已退款）
+    assert db.refund_video_task('p1', 1) is False
+    connector.connections[0].results = [(2, None, [])]  # 同一连接归还后被复用
+    assert db.refund_video_task('p1', 1) is True
+    assert pool.stats()['checked_out'] == 0
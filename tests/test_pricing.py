@@ -0,0 +1,54 @@
+import pytest
+
+from ai.pricing import (PRICING_MAX_LENGTH, PRICING_MIN_POINTS, PRICING_MIN_SAMPLES, PricingEngine, PricingError,
+                        fit_cost_model, frames_for_duration, pixel_frames)
+
+
+def test_default_model_price():
+    quote = PricingEngine().quote('wan2_2_14B_i2v', 640, 640, 81)
+    assert quote == {'gpu_seconds': 299, 'points': 50}  # 640×640×81 帧约5分钟
+    assert PricingEngine().quote('unknown', 640, 640, 81) == quote  # 未配置的模板按最贵的模型估算
+
+
+def test_minimum_points():
+    assert PricingEngine().quote('wan2_2_5B_t2v', 64, 64, 5)['points'] == PRICING_MIN_POINTS
+
+
+@pytest.mark.parametrize('width,height,length', [
+    (0, 640, 81),
+    (1281, 1280, 81),  # 像素过多
+    (640, 640, PRICING_MAX_LENGTH + 1),  # 帧数过多
+    (1280, 1280, PRICING_MAX_LENGTH),  # 单项都在限制内，但预计GPU耗时超过上限
+])
+def test_quote_limits(width, height, length):
+    with pytest.raises(PricingError):
+        PricingEngine().quote('wan2_2_14B_i2v', width, height, length)
+
+
+def test_frames_for_duration():
+    assert frames_for_duration(5, 16) == 81
+    assert frames_for_duration(1, 1) == 5
+    assert frames_for_duration(60, 30) == PRICING_MAX_LENGTH
+    with pytest.raises(PricingError):
+        frames_for_duration(0, 16)
+
+
+def test_fit_recovers_linear_model():
+    samples = [(x, 30 + 5 * x) for x in range(1, PRICING_MIN_SAMPLES + 1)]
+    base, slope = fit_cost_model(samples)
+    assert base == pytest.approx(30) and slope == pytest.approx(5)
+    # 所有样本计算量相同时按过原点的比例估算
+    assert fit_cost_model([(2, 10)] * PRICING_MIN_SAMPLES) == (0.0, 5.0)
+    assert fit_cost_model(samples[:-1]) is None
+
+
+def test_calibrate_needs_enough_samples():
+    engine = PricingEngine()
+    mpf = pixel_frames(640, 640, 81)
+    samples = [('wan2_2_14B_i2v', 640, 640, 81, 153.0)] * PRICING_MIN_SAMPLES
+    samples += [('wan2_2_5B_t2v', 640, 640, 81, 10.0)] * (PRICING_MIN_SAMPLES - 1)
+    models = engine.calibrate(samples)
+    assert models['wan2_2_14B_i2v'] == pytest.approx((0.0, 153.0 / mpf))
+    assert models['wan2_2_5B_t2v'] == (20.0, 2.4)  # 样本不足，保持默认模型
+    assert engine.calibrated == {'wan2_2_14B_i2v': PRICING_MIN_SAMPLES}
+    assert engine.quote('wan2_2_14B_i2v', 640, 640, 81) == {'gpu_seconds': 153, 'points': 26}
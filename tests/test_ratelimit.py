@@ -0,0 +1,50 @@
+import pytest
+
+import ratelimit
+from ratelimit import TokenBucketLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_burst_then_refill(clock):
+    limiter = TokenBucketLimiter(rate=0.5, burst=3)
+    assert [limiter.acquire('a')[0] for _ in range(3)] == [True] * 3
+    allowed, retry_after = limiter.acquire('a')
+    assert not allowed and retry_after == pytest.approx(2.0)  # 每秒补充0.5个，2秒后有一个令牌
+    assert limiter.acquire('b') == (True, 0.0)  # 各个键分别计数
+
+    clock[0] += 1
+    allowed, retry_after = limiter.acquire('a')
+    assert not allowed and retry_after == pytest.approx(1.0)
+    clock[0] += 1
+    assert limiter.acquire('a') == (True, 0.0)
+
+    clock[0] += 3600
+    assert [limiter.acquire('a')[0] for _ in range(4)] == [True] * 3 + [False]  # 最多补满到 burst
+    assert limiter.stats() == {'keys': 2, 'allowed': 8, 'limited': 3}
+
+
+def test_evicts_least_recently_used(clock):
+    limiter = TokenBucketLimiter(rate=0, burst=1, maxsize=2)
+    for key in ('a', 'b'):
+        limiter.acquire(key)
+    assert limiter.acquire('a') == (False, 60.0)  # 不补充时按60秒提示
+    limiter.acquire('c')  # 丢弃最久未使用的 b
+    assert limiter.stats()['keys'] == 2
+    assert limiter.acquire('b')[0]  # 被丢弃的桶相当于已补满
+    assert not limiter.acquire('c')[0]
+
+
+def test_login_rate_limit_sets_retry_after(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'login_email_limiter', TokenBucketLimiter(rate=0.05, burst=1))
+    monkeypatch.setattr(app_module.db, 'get_user_by_email', lambda email: None)
+    monkeypatch.setattr(app_module.password_hasher, 'verify', lambda hashed, password: (False, None))
+    first = client.post('/api/login', json={'email': 'Limit@example.com', 'password': 'x'})
+    second = client.post('/api/login', json={'email': ' limit@example.com', 'password': 'x'})
+    assert first.status_code == 401
+    assert second.status_code == 429 and second.headers['Retry-After'] == '20'
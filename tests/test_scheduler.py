@@ -0,0 +1,92 @@
+import queue
+
+import pytest
+
+from ai.dispatcher import SubmissionJob
+from ai.scheduler import FairScheduler, parse_tiers
+
+
+def jobs(user_id, count, lane=None, pool=None):
+    return [SubmissionJob(f'{user_id}-{i}', user_id, {'pool': pool}, lane=lane) for i in range(count)]
+
+
+def drain(scheduler):
+    """依次取出当前可以提交的全部任务"""
+    taken = []
+    while True:
+        try:
+            taken.append(scheduler.get(timeout=0.01).prompt_id)
+        except queue.Empty:
+            return taken
+
+
+def make_scheduler(capacity=100, **kwargs):
+    kwargs.setdefault('user_concurrency', 100)
+    return FairScheduler(lambda: capacity, pool_of=lambda job: job.params['pool'], **kwargs)
+
+
+def test_heavy_user_does_not_crowd_out_others():
+    scheduler = make_scheduler()
+    scheduler.put_many_nowait(jobs(1, 4))
+    scheduler.put_many_nowait(jobs(2, 2))
+    # 后到的用户与先提交大量任务的用户交替出队
+    assert drain(scheduler) == ['1-0', '2-0', '1-1', '2-1', '1-2', '1-3']
+
+
+def test_tier_weights():
+    tiers = parse_tiers('free:0:1, business:5000:4,pro:1000:2,bad:1')
+    assert [name for name, _, _ in tiers] == ['business', 'pro', 'free']
+    scheduler = make_scheduler(tiers=tiers)
+    assert [scheduler.lane_for(points) for points in (0, 999, 1000, 5000)] == ['free', 'free', 'pro', 'business']
+    assert scheduler.weight_for('pro') == 2 and scheduler.weight_for(None) == 1
+
+    scheduler.put_many_nowait(jobs(1, 4, lane='pro'))
+    scheduler.put_many_nowait(jobs(2, 2, lane='free'))
+    # 权重2的用户获得两倍的出队机会
+    assert drain(scheduler) == ['1-0', '1-1', '2-0', '1-2', '1-3', '2-1']
+
+
+def test_concurrency_limits_and_release():
+    scheduler = make_scheduler(capacity=3, user_concurrency=2)
+    scheduler.put_many_nowait(jobs(1, 3))
+    scheduler.put_many_nowait(jobs(2, 3))
+    assert drain(scheduler) == ['1-0', '2-0', '1-1']  # 总名额3个
+    scheduler.release('1-0', completed=True)
+    assert drain(scheduler) == ['2-1']  # 用户1已有2个在执行，名额给用户2
+    scheduler.release('2-0')
+    scheduler.release('2-1')
+    assert drain(scheduler) == ['1-2', '2-2']
+    stats = scheduler.stats()
+    assert stats['queued'] == 0 and stats['inflight'] == 3 and stats['completed'] == 1
+
+
+def test_put_many_is_all_or_nothing():
+    scheduler = make_scheduler(max_queue=5, user_max_queued=3)
+    scheduler.put_many_nowait(jobs(1, 2))
+    with pytest.raises(queue.Full):
+        scheduler.put_many_nowait(jobs(2, 1) + jobs(1, 2))  # 用户1超过排队上限，用户2的任务也不入队
+    assert scheduler.qsize() == 2 and scheduler.room(2) == 3
+    assert scheduler.stats()['rejected_user'] == 1
+    with pytest.raises(queue.Full):
+        scheduler.put_many_nowait(jobs(2, 2) + jobs(3, 2))  # 超过排队总数
+    assert scheduler.qsize() == 2 and scheduler.room(2) == 3
+
+    scheduler.put_many_nowait(jobs(1, 1))
+    assert scheduler.user_full(1) and scheduler.room(2) == 2
+    with pytest.raises(queue.Full):
+        scheduler.put_nowait(jobs(1, 1)[0])
+
+
+def test_named_pool_does_not_block_other_jobs():
+    scheduler = make_scheduler(capacity=1, pools={'t2v': lambda: 1})
+    scheduler.put_many_nowait([SubmissionJob('long-0', 1, {'pool': 't2v'}), SubmissionJob('long-1', 1, {'pool': 't2v'}),
+                               SubmissionJob('short', 1, {'pool': None})])
+    # 独立池满时，同一用户后面使用公共名额的任务先出队
+    assert drain(scheduler) == ['long-0', 'short']
+    assert scheduler.stats()['pools'] == {'t2v': {'inflight': 1, 'capacity': 1}}
+    scheduler.release('short')
+    assert drain(scheduler) == []  # 公共名额释放不影响独立池
+    scheduler.release('long-0')
+    assert drain(scheduler) == ['long-1']
+    scheduler.release('long-1')
+    assert scheduler.stats()['users'] == 0  # 空闲用户的状态被清理
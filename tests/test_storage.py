@@ -0,0 +1,88 @@
+import hashlib
+import os
+
+import pytest
+
+from media import MediaProcessor
+from storage import StorageManager, shard_dir
+
+
+def write(path, size, old=True):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    if old:
+        os.utime(path, (0, 0))
+    return path
+
+
+@pytest.fixture
+def tasks():
+    return {}
+
+
+@pytest.fixture
+def manager(tmp_path, tasks):
+    def list_outputs(tier, older_than, limit):
+        rows = [dict(t) for t in tasks.values() if t['tier'] == tier]
+        return rows if limit is None else rows[:limit]
+
+    def set_tier(prompt_ids, tier):
+        for prompt_id in prompt_ids:
+            tasks[prompt_id]['tier'] = tier
+        return True
+
+    media = MediaProcessor(lookup=None, media_dir=str(tmp_path / 'media'), output_dir=str(tmp_path / 'out'))
+    return StorageManager(str(tmp_path / 'upload'), media, find_active=lambda paths: set(),
+                          list_outputs=list_outputs, set_tier=set_tier, interval=0, input_grace=60)
+
+
+def test_sweep_only_removes_sharded_inputs(manager):
+    upload = manager.upload_dir
+    digest = hashlib.sha256(b'a').hexdigest()
+    idle = write(os.path.join(shard_dir(upload, digest), f'{digest}.png'), 10)
+    temp = write(os.path.join(shard_dir(upload, digest), f'.{digest}.{"0" * 32}.part'), 10)
+    fresh_digest = hashlib.sha256(b'b').hexdigest()
+    fresh = write(os.path.join(shard_dir(upload, fresh_digest), f'{fresh_digest}.jpg'), 10, old=False)
+    other = hashlib.sha256(b'c').hexdigest()
+    kept = [
+        write(os.path.join(upload, '0.jpg'), 10),
+        write(os.path.join(upload, 'upload here'), 10),
+        write(os.path.join(upload, f'{other}.png'), 10),  # 不在分片目录中
+        write(os.path.join(upload, 'ab', 'cd', f'{other}.png'), 10),  # 分片与哈希不一致
+        write(os.path.join(shard_dir(upload, other), other[4:6], f'{other}.png'), 10),  # 目录层级不对
+        write(os.path.join(shard_dir(upload, other), f'{other}.txt'), 10),
+    ]
+
+    assert manager.sweep_inputs() == 1
+    assert not os.path.exists(idle) and not os.path.exists(temp)
+    assert os.path.exists(fresh)
+    assert all(os.path.exists(path) for path in kept)
+
+
+def test_hot_quota_counts_only_task_videos(manager, tasks):
+    out = manager.media.output_dir
+    for i in range(3):
+        prompt_id = f'p{i}'
+        write(os.path.join(out, f'v{i}.mp4'), 1000)
+        write(os.path.join(manager.media.task_dir(prompt_id), 'poster.jpg'), 500)
+        tasks[prompt_id] = {'prompt_id': prompt_id, 'output_path': f'v{i}.mp4', 'tier': 'hot'}
+    write(os.path.join(out, 'unrelated.png'), 10000)
+
+    # 结果视频共3000字节，封面和输出目录中的其他文件不计入
+    manager.hot_max_bytes = 3000
+    assert manager.enforce_hot_quota() == 0
+
+    manager.hot_max_bytes = 2500
+    assert manager.enforce_hot_quota() == 1
+    assert [t['tier'] for t in tasks.values()] == ['expired', 'hot', 'hot']
+
+
+def test_hot_quota_stops_when_nothing_left_to_evict(manager, tasks):
+    write(os.path.join(manager.media.output_dir, 'v0.mp4'), 1000)
+    tasks['p0'] = {'prompt_id': 'p0', 'output_path': 'v0.mp4', 'tier': 'hot'}
+    tasks['p1'] = {'prompt_id': 'p1', 'output_path': 'missing.mp4', 'tier': 'hot'}
+    manager.hot_max_bytes = 10
+    assert manager.enforce_hot_quota() == 1
+    assert tasks['p0']['tier'] == 'expired'
+    assert tasks['p1']['tier'] == 'hot'  # 热存储中没有文件，处理它不会释放空间
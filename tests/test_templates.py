@@ -0,0 +1,115 @@
+import json
+import os
+
+import pytest
+
+from ai.templates import (TemplateError, TemplateRegistry, WAN22_I2V_14B_BINDINGS, WAN22_T2V_5B_BINDINGS,
+                          WorkflowTemplate, create_default_registry)
+
+PARAMS = {'image': 'in.png', 'positive_prompt': '海边日落', 'negative_prompt': '模糊', 'width': 832, 'height': 480,
+          'length': 81, 'fps': 16, 'filename_prefix': 'video/p1'}
+
+
+def workflow(path, **extra):
+    """最小的工作流：采样节点引用文本节点"""
+    prompt = {'1': {'class_type': 'CLIPTextEncode', 'inputs': {'text': ''}},
+              '2': {'class_type': 'LoadImage', 'inputs': {'image': 'x.png'}},
+              '3': {'class_type': 'KSampler', 'inputs': {'positive': ['1', 0], 'image': ['2', 0], 'seed': 1}}}
+    prompt.update(extra)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(prompt, f)
+    return str(path)
+
+
+@pytest.mark.parametrize('name', ['wan2_2_14B_i2v', 'wan2_2_5B_ti2v', 'wan2_2_5B_t2v'])
+def test_payload_matches_patched_workflow(name):
+    template = create_default_registry().get(name)
+    with open(template.path, encoding='utf-8') as f:
+        expected = json.load(f)
+    for node_id in template.remove_nodes:
+        del expected[node_id]
+    for node_id, input_name in template.remove_inputs:
+        del expected[node_id]['inputs'][input_name]
+    for param, targets in template.bindings.items():
+        for node_id, input_name in targets:
+            expected[node_id]['inputs'][input_name] = PARAMS[param]
+
+    body = json.loads(template.build_payload(PARAMS, prompt_id='p1', client_id='c1'))
+    assert body == {'prompt': expected, 'prompt_id': 'p1', 'client_id': 'c1'}
+    assert template.render(PARAMS) == expected
+    # 生成请求不修改模板本身
+    assert template.prompt['98' if name == 'wan2_2_14B_i2v' else '55']['inputs']['width'] != 832
+
+
+def test_none_keeps_template_default():
+    template = create_default_registry().get('wan2_2_14B_i2v')
+    body = json.loads(template.build_payload(dict(PARAMS, negative_prompt=None)))
+    node_id, input_name = WAN22_I2V_14B_BINDINGS['negative_prompt'][0]
+    assert body['prompt'][node_id]['inputs'][input_name] == template.prompt[node_id]['inputs'][input_name]
+    assert set(body) == {'prompt'}
+
+
+def test_text_to_video_drops_image_node():
+    template = create_default_registry().get('wan2_2_5B_t2v')
+    assert '56' not in template.prompt and 'start_image' not in template.prompt['55']['inputs']
+    assert 'image' not in WAN22_T2V_5B_BINDINGS
+
+
+def test_binding_must_exist(tmp_path):
+    path = workflow(tmp_path / 'w.json')
+    with pytest.raises(TemplateError, match='1.prompt'):
+        WorkflowTemplate('w', path, {'positive_prompt': [('1', 'prompt')]}).load()
+    with pytest.raises(TemplateError, match='9.text'):
+        WorkflowTemplate('w', path, {'positive_prompt': [('9', 'text')]}).load()
+
+
+def test_removed_node_must_not_be_referenced(tmp_path):
+    path = workflow(tmp_path / 'w.json')
+    with pytest.raises(TemplateError, match='不存在的节点 2'):
+        WorkflowTemplate('w', path, {}, remove_nodes=('2',)).load()
+    with pytest.raises(TemplateError, match='没有要删除的节点 7'):
+        WorkflowTemplate('w', path, {}, remove_nodes=('7',)).load()
+    with pytest.raises(TemplateError, match='3.missing'):
+        WorkflowTemplate('w', path, {}, remove_inputs=(('3', 'missing'),)).load()
+
+    template = WorkflowTemplate('w', path, {'positive_prompt': [('1', 'text')]}, remove_nodes=('2',),
+                                remove_inputs=(('3', 'image'),))
+    template.load()
+    assert json.loads(template.build_payload({'positive_prompt': 'a'}))['prompt'] == {
+        '1': {'class_type': 'CLIPTextEncode', 'inputs': {'text': 'a'}},
+        '3': {'class_type': 'KSampler', 'inputs': {'positive': ['1', 0], 'seed': 1}}}
+
+
+def test_request_key_normalizes_params(tmp_path):
+    template = WorkflowTemplate('w', workflow(tmp_path / 'w.json'), {'positive_prompt': [('1', 'text')],
+                                                                    'seed': [('3', 'seed')]})
+    template.load()
+    key = template.request_key({'positive_prompt': ' 海边  日落 ', 'seed': 2.0, 'filename_prefix': 'a'}, 'd')
+    assert key == template.request_key({'seed': 2, 'positive_prompt': '海边 日落', 'filename_prefix': 'b'}, 'd')
+    assert key != template.request_key({'seed': 2, 'positive_prompt': '海边 日落'}, 'e')
+
+
+def test_reload_on_change_keeps_last_good_version(tmp_path):
+    path = workflow(tmp_path / 'w.json')
+    registry = TemplateRegistry(check_interval=0)
+    original = registry.register('w', path, {'positive_prompt': [('1', 'text')]})
+    assert registry.get('w') is original
+
+    # 修改后的文件缺少绑定的节点：继续使用旧版本
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'3': {'inputs': {}}}, f)
+    os.utime(path, (1, 1))
+    assert registry.get('w') is original
+
+    workflow(tmp_path / 'w.json', **{'4': {'class_type': 'SaveVideo', 'inputs': {}}})
+    os.utime(path, (2, 2))
+    fresh = registry.get('w')
+    assert fresh is not original and '4' in fresh.prompt
+    assert fresh.fingerprint != original.fingerprint  # 模板修改后旧的结果不再复用
+
+    with pytest.raises(TemplateError):
+        registry.get('missing')
+
+
+def test_default_templates_exist():
+    assert sorted(create_default_registry().names()) == ['wan2_2_14B_i2v', 'wan2_2_5B_t2v', 'wan2_2_5B_ti2v']
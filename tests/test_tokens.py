@@ -0,0 +1,84 @@
+import time
+
+import jwt
+import pytest
+
+from db import db
+from tokens import RevocationList, TokenRevoked, TokenService
+
+USER = {'id': 1, 'name': '管理员', 'email': 'admin@example.com', 'points': 1000}
+
+
+@pytest.fixture
+def service():
+    rows = []
+
+    def save(jti, user_id, revoked_at, expires_at):
+        rows.append({'id': len(rows) + 1, 'jti': jti, 'user_id': user_id,
+                     'revoked_at': revoked_at, 'expires_at': expires_at})
+        return True
+
+    revocations = RevocationList(load=lambda after: [r for r in rows if r['id'] > (after or 0)], save=save)
+    return TokenService({'k1': 'secret'}, revocations), rows
+
+
+def test_revocation_times_are_whole_epoch_seconds(service):
+    tokens, rows = service
+    claims = tokens.verify(tokens.issue_access(USER))
+    tokens.revoke(claims)
+    tokens.revocations.revoke_user(USER['id'], max_ttl=60)
+    for row in rows:
+        assert isinstance(row['revoked_at'], int) and isinstance(row['expires_at'], int)
+        assert abs(row['revoked_at'] - time.time()) < 2
+    assert rows[0]['expires_at'] == claims['exp']
+    assert rows[1]['expires_at'] == rows[1]['revoked_at'] + 60
+
+
+def test_relogin_in_same_second_is_not_revoked(service):
+    tokens, _ = service
+    old = tokens.issue_access(USER)
+    time.sleep(1.05 - time.time() % 1)  # 让旧令牌的 iat 早于吊销时间
+    tokens.revocations.revoke_user(USER['id'])
+    with pytest.raises(TokenRevoked):
+        tokens.verify(old)
+    # 吊销后同一秒内重新登录签发的令牌仍然有效
+    assert tokens.verify(tokens.issue_access(USER))['user_id'] == USER['id']
+
+
+def test_other_process_syncs_revocations(service):
+    tokens, rows = service
+    claims = tokens.verify(tokens.issue_access(USER))
+    tokens.revoke(claims)
+    other = RevocationList(load=tokens.revocations._load, save=tokens.revocations._save)
+    other.sync()
+    assert other.is_revoked(claims)
+    assert not other.is_revoked(dict(claims, jti='other'))
+    assert other.stats()['tokens'] == 1
+
+    # 过期的记录在同步时清理
+    rows.append({'id': 9, 'jti': 'gone', 'user_id': None, 'revoked_at': 0, 'expires_at': int(time.time()) - 1})
+    other.sync()
+    assert other.stats()['tokens'] == 1
+
+
+def test_refresh_token_cannot_be_used_as_access(service):
+    tokens, _ = service
+    with pytest.raises(jwt.InvalidTokenError):
+        tokens.verify(tokens.issue_refresh(USER))
+
+
+def test_revoked_token_rows_round_trip_epoch_seconds(fake_db):
+    connector, _ = fake_db
+    assert db.add_revoked_token(None, 1, 1700000000, 1700000060)
+    connection = connector.connections[0]
+    assert connection.executed[0][1] == (None, 1, 1700000000, 1700000060)
+
+    connection.results = [(0, None, []), (1, None, [{'id': 1, 'jti': None, 'user_id': 1,
+                                                     'revoked_at': 1700000000, 'expires_at': 1700000060}])]
+    rows = db.get_revoked_tokens()
+    assert rows[0]['revoked_at'] == 1700000000
+    # 过期判断用应用写入的秒数，而不是MySQL会话时区下的 NOW()
+    delete, select = connection.executed[1:]
+    assert delete[0] == 'DELETE FROM revoked_tokens WHERE expires_at < %s'
+    assert 'NOW()' not in select[0] and select[1][0] == 0
+    assert abs(select[1][1] - time.time()) < 2
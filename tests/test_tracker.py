@@ -0,0 +1,126 @@
+import time
+
+from ai.tracker import TaskTracker
+from db import db
+
+
+class FakePool:
+    backends = []
+
+
+def make_tracker():
+    flushed = []
+
+    def flush(updates):
+        flushed.append(updates)
+        return True
+
+    return TaskTracker(FakePool(), flush), flushed
+
+
+def test_event_times_are_epoch_seconds():
+    tracker, flushed = make_tracker()
+    tracker.track('p1', 'http://a')
+    before = time.time()
+    tracker.handle_event({'type': 'execution_start', 'data': {'prompt_id': 'p1'}})
+    tracker.handle_event({'type': 'execution_success', 'data': {'prompt_id': 'p1'}})
+    tracker.flush_now()
+    fields = flushed[0]['p1']
+    assert before <= fields['started_at'] <= fields['completed_at'] <= time.time()
+
+
+def test_bulk_update_converts_times_in_database(fake_db):
+    connector, _ = fake_db
+    assert db.bulk_update_video_tasks({'p1': {'status': 'running', 'started_at': 1700000000.5}})
+    sql, params = connector.connections[0].executed[0]
+    # 时间由数据库按会话时区换算，与查询中的 NOW() 是同一个时钟
+    assert 'started_at = CASE prompt_id WHEN %s THEN FROM_UNIXTIME(%s) ELSE started_at END' in sql
+    assert 'status = CASE prompt_id WHEN %s THEN %s ELSE status END' in sql
+    assert params == ['p1', 'running', 'p1', 1700000000.5, 'p1']
+
+
+def test_late_events_do_not_reopen_finished_task():
+    tracker, flushed = make_tracker()
+    events = []
+    tracker.add_listener(lambda prompt_id, fields: events.append(fields.get('status')))
+    tracker.track('p1', 'http://a')
+    tracker.handle_event({'type': 'progress', 'data': {'prompt_id': 'p1', 'value': 5, 'max': 10}})
+    tracker.handle_event({'type': 'executed', 'data': {'prompt_id': 'p1', 'node': '9',
+                                                       'output': {'videos': [{'filename': 'a.mp4', 'subfolder': 'v'}]}}})
+    tracker.handle_event({'type': 'execution_error', 'data': {'prompt_id': 'p1', 'exception_message': '显存不足'}})
+    tracker.handle_event({'type': 'progress', 'data': {'prompt_id': 'p1', 'value': 9, 'max': 10}})
+    assert tracker.tracked() == 0 and events == ['running', None, 'failed']
+
+    tracker.flush_now()
+    fields = flushed[0]['p1']
+    # 同一任务的多次变化合并成一次写库
+    assert len(flushed) == 1 and fields['status'] == 'failed' and fields['progress'] == 50
+    assert fields['output_path'] == 'v/a.mp4' and fields['error'] == '显存不足'
+
+
+def test_failed_flush_is_retried_with_newer_changes_first():
+    results = [False, True]
+    flushed = []
+
+    def flush(updates):
+        flushed.append({prompt_id: dict(fields) for prompt_id, fields in updates.items()})
+        return results.pop(0)
+
+    tracker = TaskTracker(FakePool(), flush)
+    tracker.track('p1', 'http://a')
+    tracker.track('p2', 'http://a')
+    tracker.update('p1', status='running', progress=10)
+    tracker.flush_now()
+    tracker.update('p1', progress=60)
+    tracker.update('p2', status='running')
+    tracker.flush_now()
+    assert flushed[1] == {'p1': {'status': 'running', 'progress': 60}, 'p2': {'status': 'running'}}
+    assert tracker.flushes == 1
+
+
+class FakeBackend:
+    def __init__(self, history):
+        self.history = history
+
+    def get_json(self, path):
+        return self.history
+
+
+def test_history_fallback():
+    tracker, flushed = make_tracker()
+    for prompt_id in ('p1', 'p2', 'p3'):
+        tracker.track(prompt_id, 'http://a')
+    tracker.check_history(FakeBackend({}), 'p1')  # 仍在执行
+    tracker.check_history(FakeBackend({'p2': {'status': {'status_str': 'success', 'completed': True}, 'outputs': {
+        '9': {'gifs': [{'filename': 'b.mp4'}], 'images': [{'filename': 't.png', 'type': 'temp'}]}}}}), 'p2')
+    tracker.check_history(FakeBackend({'p3': {'status': {'status_str': 'error', 'messages': [
+        ['execution_start', {}], ['execution_error', {'exception_message': '节点出错'}]]}}}), 'p3')
+    tracker.flush_now()
+    updates = flushed[0]
+    assert set(updates) == {'p2', 'p3'} and tracker.tracked() == 1
+    assert updates['p2']['status'] == 'completed' and updates['p2']['output_path'] == 'b.mp4'
+    assert updates['p3']['status'] == 'failed' and updates['p3']['error'] == '节点出错'
+
+
+def test_bulk_update_is_one_guarded_statement(fake_db):
+    connector, _ = fake_db
+    assert db.bulk_update_video_tasks({})
+    assert connector.connections == []  # 没有变化时不访问数据库
+
+    assert db.bulk_update_video_tasks({'p1': {'status': 'running', 'progress': 10},
+                                       'p2': {'progress': 30, 'unknown': 1}})
+    connection = connector.connections[0]
+    (sql, params), = connection.executed
+    assert 'progress = CASE prompt_id WHEN %s THEN %s WHEN %s THEN %s ELSE progress END' in sql
+    assert 'unknown' not in sql
+    # 已结束的任务不会被迟到的事件改回进行中
+    assert sql.endswith("WHERE prompt_id IN (%s, %s) AND status NOT IN ('completed', 'failed')")
+    assert params == ['p1', 'running', 'p1', 10, 'p2', 30, 'p1', 'p2']
+    assert connection.commits == 1
+
+
+def test_bulk_update_failure_is_reported(fake_db):
+    connector, _ = fake_db
+    connector.results = [RuntimeError('连接断开')]
+    assert not db.bulk_update_video_tasks({'p1': {'status': 'running'}})
+    assert connector.connections[0].rollbacks == 1
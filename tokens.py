@@ -0,0 +1,218 @@
+import os
+import threading
+import time
+import uuid
+
+import jwt
+
+from db.cache import TTLCache
+
+# 令牌配置
+# 签名密钥环：kid:密钥，逗号分隔；第一个用于签发新令牌，其余只用于校验（轮换密钥时旧令牌在过期前仍然有效）
+JWT_KEYS = os.environ.get('JWT_KEYS') or ''
+JWT_ACCESS_TTL = int(os.environ.get('JWT_ACCESS_TTL') or 900)  # 访问令牌有效秒数
+JWT_REFRESH_TTL = int(os.environ.get('JWT_REFRESH_TTL') or 7 * 24 * 3600)  # 刷新令牌有效秒数
+JWT_VERIFY_CACHE_SIZE = int(os.environ.get('JWT_VERIFY_CACHE_SIZE') or 10000)  # 已校验令牌缓存条数
+JWT_VERIFY_CACHE_TTL = int(os.environ.get('JWT_VERIFY_CACHE_TTL') or 300)  # 已校验令牌最多缓存秒数
+JWT_REVOCATION_POLL = float(os.environ.get('JWT_REVOCATION_POLL') or 5)  # 同步吊销列表的间隔秒数
+
+LEGACY_KID = 'default'  # 没有 kid 的旧令牌使用 SECRET_KEY 校验
+
+
+class TokenRevoked(jwt.InvalidTokenError):
+    """令牌已被吊销（退出登录或强制下线）"""
+
+
+def parse_keys(value, default_secret):
+    """
+    解析 JWT_KEYS（kid:密钥,kid:密钥），未配置时只有 SECRET_KEY 一个密钥
+
+    Returns:
+        {kid: 密钥}，按配置顺序，第一个为签发密钥
+    """
+    keys = {}
+    for item in value.split(','):
+        kid, sep, secret = item.strip().partition(':')
+        if sep and kid and secret:
+            keys[kid] = secret
+    if not keys:
+        keys[LEGACY_KID] = default_secret
+    return keys
+
+
+class RevocationList:
+    """
+    令牌吊销列表：进程内保存仍未过期的吊销记录，后台定期从数据库同步其他进程新增的记录
+
+    吊销记录有两种：按 jti 吊销单个令牌（退出登录），按用户吊销此前签发的全部令牌（强制下线）。
+
+    Args:
+        load: load(after_id) -> id 大于 after_id 的吊销记录 [{'id', 'jti', 'user_id', 'revoked_at', 'expires_at'}]，
+            首次同步时 after_id 为 None；时间均为UTC秒数
+        save: save(jti, user_id, revoked_at, expires_at) 写入吊销记录（时间为整数秒，与令牌的 iat/exp 一致），返回是否成功
+        interval: 同步间隔秒数
+    """
+
+    def __init__(self, load, save, interval=JWT_REVOCATION_POLL):
+        self._load = load
+        self._save = save
+        self.interval = interval
+        self._jtis = {}  # jti -> 过期时间戳
+        self._users = {}  # user_id -> (吊销时间戳, 过期时间戳)
+        self._last_id = None  # 尚未同步过
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.syncs = 0
+        self.errors = 0
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='token-revocations', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except Exception as e:
+                self.errors += 1
+                print(f'同步令牌吊销列表失败: {e}')
+
+    def sync(self):
+        """拉取新增的吊销记录并清理已过期的记录（启动预热时先同步一次）"""
+        rows = self._load(self._last_id)
+        now = time.time()
+        with self._lock:
+            self._last_id = self._last_id or 0
+            for row in rows:
+                self._last_id = max(self._last_id, row['id'])
+                expires_at = int(row['expires_at'])
+                if row['jti']:
+                    self._jtis[row['jti']] = expires_at
+                else:
+                    revoked_at = int(row['revoked_at'])
+                    previous = self._users.get(row['user_id'])
+                    if previous is None or previous[0] < revoked_at:
+                        self._users[row['user_id']] = (revoked_at, expires_at)
+            self._jtis = {jti: exp for jti, exp in self._jtis.items() if exp > now}
+            self._users = {uid: item for uid, item in self._users.items() if item[1] > now}
+            self.syncs += 1
+
+    def revoke(self, jti, expires_at):
+        """吊销单个令牌，expires_at 为令牌的过期时间戳"""
+        expires_at = int(expires_at)
+        with self._lock:
+            self._jtis[jti] = expires_at
+        return self._save(jti, None, int(time.time()), expires_at)
+
+    def revoke_user(self, user_id, max_ttl=JWT_REFRESH_TTL):
+        """吊销用户此前签发的全部令牌（max_ttl 秒后这些令牌都已自然过期，记录随之清理）"""
+        now = int(time.time())
+        with self._lock:
+            self._users[user_id] = (now, now + max_ttl)
+        return self._save(None, user_id, now, now + max_ttl)
+
+    def is_revoked(self, claims):
+        with self._lock:
+            if claims.get('jti') in self._jtis:
+                return True
+            revoked = self._users.get(claims.get('user_id'))
+        # iat 只精确到秒：吊销的同一秒内重新登录签发的令牌不算被吊销
+        return revoked is not None and claims.get('iat', 0) < revoked[0]
+
+    def stats(self):
+        with self._lock:
+            return {'tokens': len(self._jtis), 'users': len(self._users), 'syncs': self.syncs,
+                    'errors': self.errors}
+
+
+class TokenService:
+    """
+    签发与校验访问令牌、刷新令牌
+
+    访问令牌有效期短，载荷中带有用户名、邮箱和签发时的积分快照，接口不必为了认证查询用户；
+    刷新令牌有效期长，只能用于换取新的访问令牌，换取时重新读取用户信息。
+    签名密钥按 kid 组成密钥环，令牌头部的 kid 决定用哪个密钥校验，轮换时把新密钥放在第一位即可。
+    校验通过的令牌放入 LRU 缓存，同一令牌的重复请求不再计算签名；吊销检查不经过缓存。
+
+    Args:
+        keys: {kid: 密钥}，第一个用于签发
+        revocations: RevocationList
+        access_ttl / refresh_ttl: 访问令牌、刷新令牌的有效秒数
+        legacy_secret: 没有 kid 的旧令牌的校验密钥
+    """
+
+    def __init__(self, keys, revocations, access_ttl=JWT_ACCESS_TTL, refresh_ttl=JWT_REFRESH_TTL,
+                 legacy_secret=None, cache_size=JWT_VERIFY_CACHE_SIZE, cache_ttl=JWT_VERIFY_CACHE_TTL):
+        self.keys = dict(keys)
+        self.signing_kid = next(iter(self.keys))
+        self.revocations = revocations
+        self.access_ttl = access_ttl
+        self.refresh_ttl = refresh_ttl
+        self.legacy_secret = legacy_secret
+        self.cache_ttl = cache_ttl
+        self._verified = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def _encode(self, claims, ttl):
+        now = int(time.time())
+        claims = dict(claims, jti=uuid.uuid4().hex, iat=now, exp=now + ttl)
+        return jwt.encode(claims, self.keys[self.signing_kid], algorithm='HS256',
+                          headers={'kid': self.signing_kid})
+
+    def issue_access(self, user):
+        """签发访问令牌（载荷含用户名、邮箱和积分快照）"""
+        return self._encode({'typ': 'access', 'user_id': user['id'], 'name': user['name'],
+                             'email': user['email'], 'points': user['points']}, self.access_ttl)
+
+    def issue_refresh(self, user):
+        return self._encode({'typ': 'refresh', 'user_id': user['id']}, self.refresh_ttl)
+
+    def verify(self, token, typ='access'):
+        """
+        校验令牌并返回载荷
+
+        Raises:
+            jwt.ExpiredSignatureError: 令牌已过期
+            jwt.InvalidTokenError: 签名错误、类型不符、kid 未知或已被吊销（TokenRevoked）
+        """
+        claims = self._verified.get(token)
+        if claims is None:
+            claims = self._decode(token)
+            # 缓存时间不超过令牌剩余有效期，过期的令牌不会从缓存中命中
+            ttl = min(self.cache_ttl, claims['exp'] - time.time()) if 'exp' in claims else self.cache_ttl
+            if ttl > 0:
+                self._verified.set(token, claims, ttl=ttl)
+        if claims.get('typ', 'access') != typ:
+            raise jwt.InvalidTokenError('令牌类型不符')
+        if self.revocations.is_revoked(claims):
+            raise TokenRevoked('令牌已被吊销')
+        return claims
+
+    def _decode(self, token):
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid is None and self.legacy_secret:
+            # 密钥环启用之前签发的令牌（只含 user_id），过期前继续有效
+            return jwt.decode(token, self.legacy_secret, algorithms=['HS256'])
+        secret = self.keys.get(kid)
+        if secret is None:
+            raise jwt.InvalidTokenError('未知的签名密钥')
+        return jwt.decode(token, secret, algorithms=['HS256'])
+
+    def revoke(self, claims):
+        """吊销单个令牌（退出登录）；旧令牌没有 jti，只能按用户吊销"""
+        if 'jti' not in claims:
+            return self.revocations.revoke_user(claims['user_id'])
+        return self.revocations.revoke(claims['jti'], claims['exp'])
+
+    def stats(self):
+        return {'signing_kid': self.signing_kid, 'keys': len(self.keys),
+                'verified_cache': self._verified.stats(), 'revocations': self.revocations.stats()}
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+
+# 启动预热配置
+WARMUP_TIMEOUT = float(os.environ.get('WARMUP_TIMEOUT') or 10)  # 启动时等待预热完成的最长秒数
+WARMUP_RETRY_INTERVAL = float(os.environ.get('WARMUP_RETRY_INTERVAL') or 5)  # 必需步骤失败后重试的间隔秒数
+
+
+class Warmup:
+    """
+    工作进程启动预热：在接收请求之前建立数据库连接、检查模板、连接ComfyUI后端
+
+    各步骤在独立线程中并行执行，run() 最多等待 timeout 秒，超时的步骤在后台继续执行，
+    启动时间有上限。必需步骤（如数据库）失败后每隔 retry_interval 秒重试，
+    全部必需步骤成功之前 ready() 为 False（/readyz 返回503，负载均衡不会把请求转发过来）。
+
+    Args:
+        timeout: run() 等待的最长秒数
+        retry_interval: 必需步骤失败后重试的间隔秒数
+    """
+
+    def __init__(self, timeout=WARMUP_TIMEOUT, retry_interval=WARMUP_RETRY_INTERVAL):
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._steps = []  # (名称, 函数, 是否必需)
+        self._results = {}  # 名称 -> {'ok': 是否成功, 'seconds': 耗时, 'attempts': 尝试次数, 'error': 错误}
+        self._lock = threading.Lock()
+        self._started = None
+        self.boot_seconds = None  # run() 实际等待的秒数
+
+    def add(self, name, func, required=True):
+        """添加预热步骤；func 抛异常表示失败"""
+        self._steps.append((name, func, required))
+
+    def run(self):
+        """并行执行全部步骤，最多等待 timeout 秒；返回是否已就绪"""
+        self._started = time.monotonic()
+        threads = []
+        for name, func, required in self._steps:
+            thread = threading.Thread(target=self._run_step, args=(name, func, required),
+                                      name=f'warmup-{name}', daemon=True)
+            thread.start()
+            threads.append(thread)
+        deadline = self._started + self.timeout
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self.boot_seconds = round(time.monotonic() - self._started, 3)
+
+        pending = [name for name, _, _ in self._steps if name not in self._results]
+        failed = [name for name, result in self._results.items() if not result['ok']]
+        if pending:
+            print(f'预热超时（{self.timeout}秒），以下步骤在后台继续执行: {", ".join(pending)}')
+        if failed:
+            print(f'预热失败的步骤: {", ".join(failed)}')
+        if not pending and not failed:
+            print(f'预热完成，耗时 {self.boot_seconds} 秒')
+        return self.ready()
+
+    def _run_step(self, name, func, required):
+        attempts = 0
+        while True:
+            attempts += 1
+            started = time.monotonic()
+            error = None
+            try:
+                func()
+            except Exception as e:
+                error = str(e)[:200]
+            with self._lock:
+                self._results[name] = {
+                    'ok': error is None,
+                    'seconds': round(time.monotonic() - started, 3),
+                    'attempts': attempts,
+                    'error': error,
+                }
+            if error is None or not required:
+                return
+            if attempts == 1:
+                print(f'预热步骤 {name} 失败，{self.retry_interval}秒后重试: {error}')
+            time.sleep(self.retry_interval)
+
+    def ready(self):
+        """全部必需步骤都已成功"""
+        with self._lock:
+            return all(self._results.get(name, {}).get('ok') for name, _, required in self._steps if required)
+
+    def describe(self):
+        """/readyz 的响应内容"""
+        with self._lock:
+            steps = {name: dict(self._results.get(name) or {'ok': False, 'pending': True}, required=required)
+                     for name, _, required in self._steps}
+        return {'ready': self.ready(), 'boot_seconds': self.boot_seconds, 'steps': steps}
+
+    def stats(self):
+        with self._lock:
+            steps = {name: {'ok': result['ok'], 'seconds': result['seconds'], 'attempts': result['attempts']}
+                     for name, result in self._results.items()}
+        return {'ready': self.ready(), 'boot_seconds': self.boot_seconds or 0, 'steps': steps}